@@ -0,0 +1,244 @@
+#!/usr/bin/env python2
+"""Merge every subject's avgFile and anxScaleAvgs outputs into per-subject/color/block/phase summaries."""
+
+import csv
+import glob
+import hashlib
+import multiprocessing
+import os
+import re
+
+import numpy as np
+
+import BehavLog
+
+CACHE_VERSION = 1
+# one row per rating sample, as in avgFile<subject>.csv; Rating is nan in files that don't have it
+COLUMNS = [('Absolute Time', 'f8'), ('Block', 'i2'), ('Trial', 'i2'), ('Color', 'i2'), ('Trial Time', 'f8'),
+           ('Phase', 'U16'), ('Phase Time', 'f8'), ('Rating', 'f8')]
+PATTERNS = ['avgFile*.csv', 'avgFile*.bin', 'anxScaleAvgs*.csv']
+_SUBJECT = re.compile(r'^(avgFile|anxScaleAvgs)(.*)\.(csv|bin)$')
+# columns a summary can be grouped by
+GROUP_COLUMNS = {'subject': 'Subject', 'source': 'Source', 'block': 'Block', 'color': 'Color', 'phase': 'Phase'}
+
+
+# stamp that changes whenever an output file is rewritten
+def _Stamp(filename):
+    stat = os.stat(filename)
+    return (stat.st_mtime, stat.st_size)
+
+
+# Find every session output in the directories, sorted by name
+def FindOutputs(directories=['.', "Old Csv's"]):
+    files = []
+    for directory in directories:
+        for pattern in PATTERNS:
+            files += glob.glob(os.path.join(directory, pattern))
+    return sorted(set(os.path.normpath(f) for f in files))
+
+
+# --- PARSE ONE OUTPUT FILE --- #
+# Returns (meta, table): meta is a dict with the source ('avgFile'/'anxScaleAvgs'), subject, session and the
+# number of lines skipped, table a structured array with COLUMNS.
+def ParseOutput(filename):
+    source, subject, extension = _SUBJECT.match(os.path.basename(filename)).groups()
+    meta = {'source': source, 'subject': subject, 'session': '', 'skipped': 0}
+    if extension == 'bin':
+        rows = [row + (np.nan,) for row in BehavLog.ReadBinaryLog(filename)]
+        return meta, np.array(rows, dtype=COLUMNS)
+
+    # anxScaleAvgs files start with 'key: value' lines; older ones also hold per-trial rating vectors (one line of
+    # times, one of ratings) that aren't samples, so only lines shaped like the last sample header are kept
+    rows = []
+    iColumns = None
+    with open(filename, encoding='utf-8', newline='') as f:
+        for row in csv.reader(f):
+            if not row or not ''.join(row).strip():
+                continue
+            if len(row) == 1 and ':' in row[0]:
+                key, value = row[0].split(':', 1)
+                if key.strip() in ('subject', 'session'):
+                    meta[key.strip()] = value.strip()
+                continue
+            names = [name.strip() for name in row]
+            if 'Block' in names and 'Phase' in names:
+                nFields = len(names)
+                iColumns = [names.index(name) if name in names else None for name, dtype in COLUMNS]
+                continue
+            try:
+                if iColumns is None or len(row) != nFields:
+                    raise ValueError(row)
+                rows.append(tuple(np.nan if i is None else float(row[i]) if dtype != 'U16' else row[i].strip()
+                                  for i, (name, dtype) in zip(iColumns, COLUMNS)))
+            except ValueError:
+                meta['skipped'] += 1
+    return meta, np.array(rows, dtype=COLUMNS)
+
+
+# --- COLUMNAR CACHE --- #
+# Each parsed file is kept as an uncompressed .npz (one array per column) in cacheDir, named after its path and
+# holding the file's modification time and size, so it's only parsed again when it changes.
+def _CacheFile(filename, cacheDir):
+    name = hashlib.md5(os.path.abspath(filename).encode('utf-8')).hexdigest()
+    return os.path.join(cacheDir, '%s_%s.npz' % (os.path.basename(filename), name[:12]))
+
+
+def _ReadCache(filename, cacheDir):
+    try:
+        with np.load(_CacheFile(filename, cacheDir)) as cached:
+            if int(cached['version']) != CACHE_VERSION or tuple(cached['stamp']) != _Stamp(filename):
+                return None
+            meta = {'source': str(cached['source']), 'subject': str(cached['subject']),
+                    'session': str(cached['session']), 'skipped': int(cached['skipped'])}
+            table = np.zeros(len(cached['Block']), dtype=COLUMNS)
+            for name, dtype in COLUMNS:
+                table[name] = cached[name]
+        return meta, table
+    except Exception:
+        return None  # missing, old or unreadable cache: parse the file again
+
+
+def _WriteCache(filename, cacheDir, meta, table):
+    cacheFile = _CacheFile(filename, cacheDir)
+    tmpFile = cacheFile + '.tmp.npz'
+    columns = dict((name, table[name]) for name, dtype in COLUMNS)
+    np.savez(tmpFile, version=CACHE_VERSION, stamp=np.array(_Stamp(filename)), **dict(meta, **columns))
+    os.replace(tmpFile, cacheFile)
+
+
+# parse one file and cache it (runs in the worker processes)
+def _ParseAndCache(args):
+    filename, cacheDir = args
+    meta, table = ParseOutput(filename)
+    _WriteCache(filename, cacheDir, meta, table)
+    return filename, meta, table
+
+
+class Aggregator(object):
+    # Loads every session output, reading unchanged files from the cache and parsing new or changed ones in a
+    # process pool (nProcesses defaults to the number of cores), then summarizes them all at once.
+    def __init__(self, directories=['.', "Old Csv's"], cacheDir='aggregateCache', nProcesses=None):
+        self.directories = directories
+        self.cacheDir = cacheDir
+        self.nProcesses = nProcesses or multiprocessing.cpu_count()
+        self.files = []
+        self.meta = {}  # filename -> dict of source, subject, session, skipped
+        self.tables = {}  # filename -> structured array with COLUMNS
+        self.nParsed = 0  # files parsed in the last Load (cache misses)
+        self.nCached = 0
+
+    def Load(self):
+        if not os.path.isdir(self.cacheDir):
+            os.makedirs(self.cacheDir)
+        self.files = FindOutputs(self.directories)
+        self.nParsed = self.nCached = 0
+        toParse = []
+        for filename in self.files:
+            cached = _ReadCache(filename, self.cacheDir)
+            if cached is None:
+                toParse.append(filename)
+            else:
+                self.meta[filename], self.tables[filename] = cached
+                self.nCached += 1
+        if len(toParse) > 1 and self.nProcesses > 1:
+            pool = multiprocessing.Pool(min(self.nProcesses, len(toParse)))
+            try:
+                results = pool.map(_ParseAndCache, [(f, self.cacheDir) for f in toParse], chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_ParseAndCache((f, self.cacheDir)) for f in toParse]
+        for filename, meta, table in results:
+            self.meta[filename], self.tables[filename] = meta, table
+            self.nParsed += 1
+        return self
+
+    # All loaded rows in one table, with the Subject and Source of each row added
+    def Combined(self):
+        dtype = [('Subject', 'U32'), ('Source', 'U16')] + COLUMNS
+        parts = []
+        for filename in self.files:
+            table = self.tables[filename]
+            part = np.zeros(len(table), dtype=dtype)
+            part['Subject'] = self.meta[filename]['subject']
+            part['Source'] = self.meta[filename]['source']
+            for name, columnType in COLUMNS:
+                part[name] = table[name]
+            parts.append(part)
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+
+    # Summarize the rows grouped by the given columns (any of GROUP_COLUMNS). For each group: the number of
+    # trials and samples, the mean Phase Time and Rating over samples, and the mean phase duration (the
+    # last Phase Time of each trial's phase, averaged over trials).
+    def Summarize(self, by=('subject', 'color', 'block', 'phase')):
+        rows = self.Combined()
+        keys = [GROUP_COLUMNS[b] for b in by]
+        summaryType = [(GROUP_COLUMNS[b], rows.dtype[GROUP_COLUMNS[b]].str) for b in by] + \
+                      [('Trials', 'i4'), ('Samples', 'i4'), ('Mean Phase Time', 'f8'),
+                       ('Mean Phase Duration', 'f8'), ('Mean Rating', 'f8')]
+        if len(rows) == 0:
+            return np.zeros(0, dtype=summaryType)
+
+        groups, iGroup = np.unique(rows[keys], return_inverse=True)
+        iGroup = iGroup.ravel()
+        nGroups = len(groups)
+        nSamples = np.bincount(iGroup, minlength=nGroups)
+        phaseTime = np.bincount(iGroup, weights=rows['Phase Time'], minlength=nGroups) / nSamples
+        hasRating = ~np.isnan(rows['Rating'])
+        nRated = np.bincount(iGroup[hasRating], minlength=nGroups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rating = np.bincount(iGroup[hasRating], weights=rows['Rating'][hasRating], minlength=nGroups) / nRated
+
+        # one duration per (group, subject, source, block, trial, phase): the largest Phase Time in it
+        trialKeys = ['Subject', 'Source', 'Block', 'Trial', 'Phase']
+        trials, iTrial = np.unique(rows[trialKeys], return_inverse=True)
+        iTrial = iTrial.ravel()
+        duration = np.full(len(trials), -np.inf)
+        np.maximum.at(duration, iTrial, rows['Phase Time'])
+        trialGroup = np.zeros(len(trials), dtype=int)
+        trialGroup[iTrial] = iGroup
+        nTrials = np.bincount(trialGroup, minlength=nGroups)
+        meanDuration = np.bincount(trialGroup, weights=duration, minlength=nGroups) / nTrials
+
+        summary = np.zeros(nGroups, dtype=summaryType)
+        for key in keys:
+            summary[key] = groups[key]
+        summary['Trials'] = nTrials
+        summary['Samples'] = nSamples
+        summary['Mean Phase Time'] = phaseTime
+        summary['Mean Phase Duration'] = meanDuration
+        summary['Mean Rating'] = rating
+        return summary
+
+
+# Write a summary (or any structured array) as csv
+def SaveSummary(summary, filename):
+    with open(filename, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(summary.dtype.names)
+        for row in summary:
+            writer.writerow(['%g' % v if isinstance(v, float) else v for v in row.tolist()])
+
+
+# --- AGGREGATE FROM THE COMMAND LINE --- #
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Summarize every subject\'s avgFile/anxScaleAvgs outputs.')
+    parser.add_argument('directories', nargs='*', default=['.', "Old Csv's"])
+    parser.add_argument('--by', default='subject,color,block,phase',
+                        help='comma-separated columns to group by (%s)' % ', '.join(sorted(GROUP_COLUMNS)))
+    parser.add_argument('--out', default='aggregateSummary.csv')
+    parser.add_argument('--cache', default='aggregateCache')
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    tStart = time.time()
+    aggregator = Aggregator(args.directories, cacheDir=args.cache, nProcesses=args.processes).Load()
+    tLoad = time.time() - tStart
+    summary = aggregator.Summarize(by=args.by.split(','))
+    SaveSummary(summary, args.out)
+    print('%d files (%d parsed, %d from cache) in %.2f s; %d summary rows in %s' % (
+        len(aggregator.files), aggregator.nParsed, aggregator.nCached, tLoad, len(summary), args.out))
@@ -3,9 +3,14 @@
 
 from psychopy import core, event, logging#, visual
 import time
+from collections import OrderedDict
 
 from HelperFunctions import reverse_string
 
+# Laid-out TextStims, keyed by window, text, font, height, wrapWidth and placement, most recently used last
+_textStims = OrderedDict()
+maxTextStims = 100
+
 
 # --- PARSE QUESTION FILE INTO QUESTIONS AND OPTIONS --- #
 def ParseQuestionFile(filename,optionsType=None): # optionsType 'Likert' returns the Likert scale for every question's options.
@@ -71,19 +76,33 @@ def ParsePromptFile(filename):
     # return results
     return (topPrompts,bottomPrompts)
 
+# --- GET A TEXT STIMULUS LIKE template SHOWING text --- #
+# Setting the text or font of a TextStim lays the glyphs out again, so screens that come back (e.g. the rest
+# message) are drawn from a stim made the first time they were shown. template itself is left unchanged.
+def GetTextStim(template, text, font='Arial Hebrew'):
+    from psychopy import visual
+    key = (template.win, text, font, template.height, template.wrapWidth, tuple(template.pos), str(template.color),
+           template.units)
+    if key in _textStims:
+        _textStims[key] = _textStims.pop(key)  # now most recently used
+        return _textStims[key]
+    stim = visual.TextStim(template.win, text=text, font=font, pos=template.pos, height=template.height,
+                           wrapWidth=template.wrapWidth, color=template.color, alignHoriz='center',
+                           units=template.units, name=template.name, autoLog=False)
+    _textStims[key] = stim
+    while len(_textStims) > maxTextStims:
+        _textStims.popitem(last=False)
+    return stim
+
 # Display prompts and let the subject page through them one by one.
 def RunPrompts(topPrompts,bottomPrompts,win,message1,message2,backKey='backspace',backPrompt=0,name='Instructions',ignoreKeys=[]):
     iPrompt = 0
     redraw = True # redraw a new prompt?
     while iPrompt < len(topPrompts):
         if redraw:
-            message1.setText(topPrompts[iPrompt])
-            message1.setFont('Arial Hebrew')
-            message2.setText(bottomPrompts[iPrompt])
-            message2.setFont('Arial Hebrew')
             #display instructions and wait
-            message1.draw()
-            message2.draw()
+            GetTextStim(message1, topPrompts[iPrompt]).draw()
+            GetTextStim(message2, bottomPrompts[iPrompt]).draw()
             win.logOnFlip(level=logging.EXP, msg='Display %s%d'%(name,iPrompt+1))
             win.flip()
         #check for a keypress
@@ -0,0 +1,126 @@
+#!/usr/bin/env python2
+"""Crash-safe streaming writer for the behavioral (avgFile) log."""
+
+import os
+import struct
+import threading
+
+COLUMNS = ['Absolute Time', 'Block', 'Trial', 'Color', 'Trial Time', 'Phase', 'Phase Time']
+# binary record: absTime, block, trial, color, trialTime, phase (utf-8, padded), phaseTime
+RECORD = struct.Struct('<dhhhd16sd')
+MAGIC = b'BEHAVLOG1\n'
+
+
+# write rows in the same csv format pandas' DataFrame.to_csv gave us (leading unnamed index column)
+def _CsvHeader():
+    return ',' + ','.join(COLUMNS) + '\n'
+
+
+def _CsvRow(index, row):
+    return '%d,%r,%d,%d,%d,%r,%s,%r\n' % (index, float(row[0]), row[1], row[2], row[3], float(row[4]), row[5],
+                                           float(row[6]))
+
+
+class BehavLogWriter(object):
+    # Rows go into a bounded buffer and a background thread appends them to disk every flushInterval seconds
+    # (fsynced), so a crash loses at most the last interval and memory use doesn't grow with the session.
+    # binary=True writes fixed-size records instead of csv text; convert them with ConvertToCsv().
+    def __init__(self, filename, binary=False, maxBuffer=5000, flushInterval=1.0, fsync=True):
+        self.filename = filename
+        self.binary = binary
+        self.maxBuffer = maxBuffer
+        self.flushInterval = flushInterval
+        self.fsync = fsync
+        self.nRows = 0  # rows written to disk so far
+        self._buffer = []
+        self._cond = threading.Condition()  # guards the buffer
+        self._writeLock = threading.Lock()  # keeps batches in order on disk
+        self._closed = False
+        self._error = None
+        if binary:
+            self._file = open(filename, 'wb')
+            self._file.write(MAGIC)
+        else:
+            self._file = open(filename, 'w', encoding='utf-8', newline='')
+            self._file.write(_CsvHeader())
+        self._thread = threading.Thread(target=self._Run, name='BehavLogWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    # Add one row (never touches the disk, unless the buffer is full and the writer has fallen behind)
+    def Write(self, absTime, block, trial, color, trialTime, phase, phaseTime):
+        with self._cond:
+            if self._closed:
+                raise ValueError('BehavLogWriter %s is closed' % self.filename)
+            while len(self._buffer) >= self.maxBuffer:
+                self._cond.notify_all()  # wake the writer thread now
+                self._cond.wait(0.1)
+            self._buffer.append((absTime, block, trial, color, trialTime, phase, phaseTime))
+            if len(self._buffer) >= self.maxBuffer // 2:
+                self._cond.notify_all()
+
+    def _WriteRows(self, rows):
+        if self.binary:
+            self._file.write(b''.join([RECORD.pack(r[0], r[1], r[2], r[3], r[4], r[5].encode('utf-8'), r[6])
+                                       for r in rows]))
+        else:
+            self._file.write(''.join([_CsvRow(self.nRows + i, r) for i, r in enumerate(rows)]))
+        self.nRows += len(rows)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def _Run(self):
+        while True:
+            with self._cond:
+                if not self._buffer and not self._closed:
+                    self._cond.wait(self.flushInterval)
+                closed = self._closed
+            try:
+                self.Flush()
+            except Exception as e:
+                self._error = e
+                print('ERROR WRITING BEHAVIORAL LOG %s: %s' % (self.filename, e))
+            if closed:
+                break
+
+    # Write everything buffered so far and wait until it is on disk
+    def Flush(self):
+        with self._writeLock:
+            with self._cond:
+                rows, self._buffer = self._buffer, []
+                self._cond.notify_all()  # let blocked writers continue
+            if rows:
+                self._WriteRows(rows)
+
+    # Write the rest of the buffer and close the file
+    def Close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._file.close()
+        if self._error is not None:
+            raise self._error
+
+
+# --- READ ROWS BACK FROM A BINARY LOG --- #
+def ReadBinaryLog(filename):
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a binary behavioral log' % filename)
+        data = f.read()
+    nRecords = len(data) // RECORD.size  # ignore a partial record left by a crash
+    for iRecord in range(nRecords):
+        r = RECORD.unpack_from(data, iRecord * RECORD.size)
+        yield (r[0], r[1], r[2], r[3], r[4], r[5].rstrip(b'\0').decode('utf-8'), r[6])
+
+
+# --- CONVERT A BINARY LOG TO THE CSV FORMAT --- #
+def ConvertToCsv(binFilename, csvFilename):
+    with open(csvFilename, 'w', encoding='utf-8', newline='') as f:
+        f.write(_CsvHeader())
+        for index, row in enumerate(ReadBinaryLog(binFilename)):
+            f.write(_CsvRow(index, row))
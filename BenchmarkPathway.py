@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Benchmark devices.Pathway against the local emulator
+====================================================
+
+Measures per-command latency, throughput and reconnect cost of the Pathway client
+offline, using PathwayEmulator in place of the thermode, and checks that the client
+recovers from a response that arrives after its timeout.
+
+    python BenchmarkPathway.py --n 200 --delay 0.002
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import socket
+import time
+
+from devices import Pathway
+from PathwayEmulator import PathwayEmulator
+
+
+def Summarize(label, latencies):
+    # print min/median/p90/p99/max in ms
+    lat = sorted(latencies)
+    pct = lambda p: lat[min(len(lat) - 1, int(round(p / 100. * (len(lat) - 1))))]
+    print('%-28s n=%-5d mean=%7.2f  min=%7.2f  p50=%7.2f  p90=%7.2f  p99=%7.2f  max=%7.2f ms' % (
+        label, len(lat), 1000 * sum(lat) / len(lat), 1000 * lat[0], 1000 * pct(50), 1000 * pct(90), 1000 * pct(99),
+        1000 * lat[-1]))
+
+
+def TimeCalls(pathway, command, n, protocol=None, **kwargs):
+    # latency of n sequential calls
+    latencies = []
+    for _ in range(n):
+        t = time.time()
+        pathway.call(command, protocol=protocol, **kwargs)
+        latencies.append(time.time() - t)
+    return latencies
+
+
+def RunBenchmark(n=100, delay=0., jitter=0., protocol=100):
+    with PathwayEmulator(delay=delay, jitter=jitter) as emulator:
+        ip, port = emulator.address
+        pathway = Pathway(ip, port, verbose=False)
+
+        print('--- per-command latency (one open connection) ---')
+        Summarize('STATUS', TimeCalls(pathway, 'STATUS', n))
+        cycle = {'TEST_PROGRAM': [], 'START': [], 'TRIGGER': [], 'STOP': []}
+        for _ in range(n):
+            for command in ['TEST_PROGRAM', 'START', 'TRIGGER', 'STOP']:
+                cycle[command] += TimeCalls(pathway, command, 1, protocol=protocol)
+        for command in ['TEST_PROGRAM', 'START', 'TRIGGER', 'STOP']:
+            Summarize(command, cycle[command])
+
+        print('--- throughput ---')
+        t = time.time()
+        TimeCalls(pathway, 'STATUS', n)
+        print('%-28s %8.1f commands/s' % ('sequential STATUS', n / (time.time() - t)))
+        t = time.time()
+        pathway.call_many(['STATUS'] * n)
+        print('%-28s %8.1f commands/s' % ('pipelined STATUS', n / (time.time() - t)))
+        batch = []
+        for command in ['TEST_PROGRAM', 'START', 'TRIGGER', 'STOP']:
+            batch.append((command, protocol))
+        latencies = []
+        for _ in range(n):
+            t = time.time()
+            pathway.call_many(batch)
+            latencies.append(time.time() - t)
+        Summarize('pipelined heat cycle', latencies)
+
+        print('--- reconnect cost ---')
+        Summarize('STATUS, reused socket', TimeCalls(pathway, 'STATUS', n))
+        Summarize('STATUS, new socket', TimeCalls(pathway, 'STATUS', n, reuse_socket=False))
+        connections = emulator.connections
+        emulator.close_after = 1  # device hangs up after every response
+        Summarize('STATUS, server hangs up', TimeCalls(pathway, 'STATUS', n))
+        print('%-28s %d' % ('connections opened', emulator.connections - connections))
+        emulator.close_after = 0
+
+        print('--- late response ---')
+        CheckLateResponse(emulator)
+
+
+def CheckLateResponse(emulator, timeout=.5):
+    # a START answered after the client's timeout must not leave the Pathway unusable, or have its late response
+    # taken for the answer to the next command
+    ip, port = emulator.address
+    pathway = Pathway(ip, port, timeout=timeout, verbose=False)
+    delay = emulator.delay
+    emulator.delay = {'START': 2 * timeout}
+    try:
+        pathway.call('START')
+        raise AssertionError('START answered within the timeout')
+    except socket.timeout:
+        pass
+    finally:
+        emulator.delay = delay
+    response = pathway.call('STATUS')
+    assert response['command_id'] == 'STATUS', response
+    print('%-28s ok' % 'STATUS after a timed-out START')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the Pathway client against the local emulator.')
+    parser.add_argument('--n', type=int, default=100, help='repetitions per measurement')
+    parser.add_argument('--delay', type=float, default=0., help='emulated device response time, in seconds')
+    parser.add_argument('--jitter', type=float, default=0., help='extra random device delay, up to this many seconds')
+    args = parser.parse_args()
+    RunBenchmark(n=args.n, delay=args.delay, jitter=args.jitter)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python2
+"""Timestamp every window flip with a phase label, for per-phase jitter and dropped-frame reports."""
+
+from psychopy import core, logging
+import numpy as np
+
+
+class FlipTimer(object):
+    # Wraps win.flip so every flip (including those inside RatingScales and BasicPromptTools) is timestamped
+    # into preallocated ring buffers. Each SetPhase() call starts a new segment; intervals are only measured
+    # between flips of the same segment, so waits between phases don't count as dropped frames.
+    def __init__(self, win, frameDur, capacity=2 ** 20):
+        self.win = win
+        self.frameDur = frameDur
+        self.capacity = capacity
+        self.nFlips = 0
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._segments = np.zeros(capacity, dtype=np.int32)
+        self._segmentPhases = ['none']  # segment number -> phase label
+        self._segment = 0
+        self._flip = win.flip
+        win.flip = self.Flip
+
+    # Label the flips that follow (e.g. 'square', 'full', 'VAS', 'fixation')
+    def SetPhase(self, label):
+        self._segmentPhases.append(label)
+        self._segment = len(self._segmentPhases) - 1
+
+    # Keep the current label but don't measure intervals across this point (e.g. after a wait without flips)
+    def NewSegment(self):
+        self.SetPhase(self._segmentPhases[self._segment])
+
+    def Flip(self, *args, **kwargs):
+        t = self._flip(*args, **kwargs)
+        if t is None:
+            t = core.getTime()
+        i = self.nFlips % self.capacity
+        self._times[i] = t
+        self._segments[i] = self._segment
+        self.nFlips += 1
+        return t
+
+    # Put back the original win.flip
+    def Detach(self):
+        self.win.flip = self._flip
+
+    # flip times and segments in the order they happened (only the last `capacity` flips are kept)
+    def GetFlips(self):
+        n = min(self.nFlips, self.capacity)
+        start = self.nFlips % self.capacity if self.nFlips > self.capacity else 0
+        order = (np.arange(n) + start) % self.capacity
+        return self._times[order], self._segments[order]
+
+    # Per-phase flip count, interval mean/SD/max (ms) and dropped frames, as a list of dicts
+    def Summary(self):
+        times, segments = self.GetFlips()
+        intervals = np.diff(times)
+        sameSegment = segments[1:] == segments[:-1]
+        flipPhases = np.array(self._segmentPhases, dtype=object)[segments]
+        rows = []
+        for label in sorted(set(flipPhases)):
+            these = intervals[sameSegment & (flipPhases[1:] == label)]
+            late = these[these > 1.5 * self.frameDur]
+            rows.append({'phase': label,
+                         'flips': int(np.sum(flipPhases == label)),
+                         'meanInterval': 1000 * these.mean() if len(these) else np.nan,
+                         'sdInterval': 1000 * these.std() if len(these) else np.nan,
+                         'maxInterval': 1000 * these.max() if len(these) else np.nan,
+                         'droppedFrames': int(np.sum(np.round(late / self.frameDur) - 1))})
+        return rows
+
+    # Write the per-phase summary to a csv file and the log
+    def SaveSummary(self, filename):
+        rows = self.Summary()
+        with open(filename, 'w') as f:
+            f.write('Phase,Flips,Mean Interval (ms),SD Interval (ms),Max Interval (ms),Dropped Frames\n')
+            for r in rows:
+                f.write('%s,%d,%.3f,%.3f,%.3f,%d\n' % (r['phase'], r['flips'], r['meanInterval'], r['sdInterval'],
+                                                       r['maxInterval'], r['droppedFrames']))
+                logging.log(level=logging.INFO, msg='flips %s: n=%d mean=%.3fms sd=%.3fms max=%.3fms dropped=%d' % (
+                    r['phase'], r['flips'], r['meanInterval'], r['sdInterval'], r['maxInterval'],
+                    r['droppedFrames']))
+        return rows
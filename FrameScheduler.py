@@ -0,0 +1,100 @@
+#!/usr/bin/env python2
+"""Frame-locked timing of experiment phases, with intended vs. actual onset logging."""
+
+from psychopy import core, event, logging
+
+
+class FrameScheduler(object):
+    # Runs each phase as a whole number of screen refreshes: draw, flip once per refresh (the flip itself waits
+    # for the refresh, so no busy loop) and poll the escape keys once per frame.
+    # Phases that follow each other keep their intended onsets on a fixed grid, so timing doesn't creep.
+    def __init__(self, win, clock, frameRate=None, escapeKeys=['q', 'escape'], onEscape=None):
+        self.win = win
+        self.clock = clock  # all onsets are in this clock's time
+        if frameRate is None:
+            frameRate = win.getActualFrameRate()
+            if frameRate is None:  # couldn't measure it
+                frameRate = 60.0
+        self.frameRate = frameRate
+        self.frameDur = 1.0 / frameRate
+        self.escapeKeys = escapeKeys
+        self.onEscape = onEscape  # called when an escape key is pressed
+        self.intendedNext = None  # intended onset of the next back-to-back phase
+        self.phaseLog = []  # one dict per phase
+        self.flipTimer = None  # FlipTimer to label with the phase being shown, if any
+        self.triggers = None  # TriggerScheduler to send timed codes from while waiting without flips, if any
+
+    # number of frames closest to a duration in seconds
+    def Frames(self, duration):
+        return max(0, int(round(duration * self.frameRate)))
+
+    # empty the whole key buffer (so keys pressed during a phase aren't read later, e.g. as a VAS response) and
+    # check it for the escape keys
+    def _CheckKeys(self):
+        keys = event.getKeys()
+        if set(keys) & set(self.escapeKeys or []) and self.onEscape is not None:
+            self.onEscape()
+
+    # Show a phase for a duration (in seconds, rounded to whole frames).
+    # draw is called before every flip (None = blank screen); onFrame(iFrame, t) is called after every flip.
+    # onset is the intended onset; by default it follows the previous phase if that just ended.
+    def RunPhase(self, label, duration, draw=None, onFrame=None, onset=None):
+        nFrames = self.Frames(duration)
+        now = self.clock.getTime()
+        if onset is None:
+            if self.intendedNext is not None and abs(now - self.intendedNext) < self.frameDur:
+                onset = self.intendedNext
+            else:
+                onset = now + self.frameDur / 2.  # next refresh, on average
+        if self.flipTimer is not None:
+            self.flipTimer.SetPhase(label)
+        tActual = None
+        tLast = None
+        nDropped = 0
+        for iFrame in range(nFrames):
+            if draw is not None:
+                draw()
+            self.win.flip()
+            t = self.clock.getTime()
+            if tActual is None:
+                tActual = t
+            elif t - tLast > 1.5 * self.frameDur:
+                nDropped += int(round((t - tLast) / self.frameDur)) - 1
+            tLast = t
+            self._CheckKeys()
+            if onFrame is not None:
+                onFrame(iFrame, t)
+        self.intendedNext = onset + nFrames * self.frameDur
+        record = {'phase': label, 'intendedOnset': onset, 'actualOnset': tActual, 'nFrames': nFrames,
+                  'intendedDuration': nFrames * self.frameDur,
+                  'actualDuration': None if tActual is None else self.clock.getTime() - tActual,
+                  'droppedFrames': nDropped}
+        self.phaseLog.append(record)
+        if nDropped > 0:
+            logging.log(level=logging.WARNING, msg='%s: %d dropped frames' % (label, nDropped))
+        return record
+
+    # Wait without flipping (keeps what's on screen) until a time on the clock, sleeping a frame at a time
+    # and polling the escape keys once per frame.
+    def WaitUntil(self, deadline):
+        while True:
+            remaining = deadline - self.clock.getTime()
+            if remaining <= 0:
+                break
+            core.wait(min(remaining, self.frameDur), hogCPUperiod=0)
+            self._CheckKeys()
+            if self.triggers is not None:
+                self.triggers.Poll()
+        self.intendedNext = None
+        if self.flipTimer is not None:
+            self.flipTimer.NewSegment()
+
+    # Write one line per phase with intended and actual onsets
+    def SaveLog(self, filename):
+        with open(filename, 'w') as f:
+            f.write('Phase,Intended Onset,Actual Onset,Frames,Intended Duration,Actual Duration,Dropped Frames\n')
+            for r in self.phaseLog:
+                f.write('%s,%r,%r,%d,%r,%r,%d\n' % (r['phase'], r['intendedOnset'], r['actualOnset'], r['nFrames'],
+                                                    r['intendedDuration'], r['actualDuration'], r['droppedFrames']))
+        logging.log(level=logging.INFO, msg='%d phases, %d dropped frames' % (
+            len(self.phaseLog), sum(r['droppedFrames'] for r in self.phaseLog)))
@@ -1,2 +1,61 @@
+import unicodedata
+
+# Visual (left-to-right drawing) order of each string we've already processed
+_visualCache = {}
+
+# brackets swap sides when a right-to-left run is reversed
+_MIRROR = {'(': ')', ')': '(', '[': ']', ']': '[', '{': '}', '}': '{', '<': '>', '>': '<'}
+
+
+# right-to-left (Hebrew/Arabic letters), left-to-right (latin letters, digits) or neutral (spaces, punctuation)
+def _Direction(c):
+    d = unicodedata.bidirectional(c)
+    if d in ('R', 'AL'):
+        return 'R'
+    if d in ('L', 'EN', 'AN'):
+        return 'L'
+    return 'N'
+
+
+# Reorder one line of right-to-left text for display: the order of the runs is reversed, Hebrew (and the
+# neutrals around it) is reversed character by character, and runs of numbers/latin text keep their order,
+# including the punctuation inside them (e.g. 12.5, 3-4, Arial Hebrew).
+def _VisualLine(line):
+    directions = [_Direction(c) for c in line]
+    # neutrals between two left-to-right characters belong to that left-to-right run
+    lastStrong = None
+    for i, d in enumerate(directions):
+        if d == 'N':
+            continue
+        if d == 'L' and lastStrong is not None and directions[lastStrong] == 'L':
+            for j in range(lastStrong + 1, i):
+                directions[j] = 'L'
+        lastStrong = i
+    # split into runs and lay them out from right to left
+    runs = []
+    for c, d in zip(line, directions):
+        isLtr = d == 'L'
+        if runs and runs[-1][0] == isLtr:
+            runs[-1][1].append(c)
+        else:
+            runs.append((isLtr, [c]))
+    out = []
+    for isLtr, chars in reversed(runs):
+        if isLtr:
+            out.append(''.join(chars))
+        else:
+            out.append(''.join(_MIRROR.get(c, c) for c in reversed(chars)))
+    return ''.join(out)
+
+
+# Put right-to-left text in the order PsychoPy draws it. Each line is reordered separately, and every unique
+# string is only processed once per session. Text (in the question files and in Main.py) is written in reading
+# order, including numbers: a scale anchor of ten is stored as 10, not hand-reversed as 01.
 def reverse_string(s):
-    return s[::-1]
\ No newline at end of file
+    try:
+        return _visualCache[s]
+    except KeyError:
+        pass
+    visual = '\n'.join(_VisualLine(line) for line in s.split('\n'))
+    _visualCache[s] = visual
+    return visual
@@ -0,0 +1,281 @@
+#!/usr/bin/env python2
+"""Typed, cached event index over PsychoPy session .log files, for querying ratings and medoc events."""
+
+import glob
+import mmap
+import multiprocessing
+import os
+import re
+
+import numpy as np
+
+INDEX_VERSION = 1
+# PsychoPy writes one event per line as '<time> \t<LEVEL> \t<message>' (some loggers write the level number)
+LEVELS = {'CRITICAL': 50, 'ERROR': 40, 'WARNING': 30, 'DATA': 25, 'EXP': 22, 'INFO': 20, 'DEBUG': 10}
+_LINE = re.compile(br'^(-?\d+\.\d+)\s*\t(\w+)\s*\t(.*)$', re.S)
+
+# message classes, in the order of their codes in the 'kind' column. name/value hold the fields parsed from the
+# message: the scale name and rating / RT, the medoc code or command, the port data, the displayed screen...
+KINDS = ['other', 'param', 'rating', 'noResponse', 'ratingRT', 'ratingHistory', 'display', 'medocSet', 'medocCommand',
+         'medocRunning', 'port', 'endBlock']
+_MESSAGES = [
+    ('rating', re.compile(r'^RatingScale (\S+): rating=(\S+)$')),
+    ('noResponse', re.compile(r'^RatingScale (\S+): \(no response\) rating=(\S+)$')),
+    ('ratingRT', re.compile(r'^RatingScale (\S+): rating RT=(\S+)$')),
+    ('ratingHistory', re.compile(r'^RatingScale (\S+): history=()')),
+    ('display', re.compile(r'^Display (\S+)()$')),
+    ('medocSet', re.compile(r'^set medoc (\S+)()$')),
+    ('medocCommand', re.compile(r'^medoc (\S+) queued=\S+ sent=\S+ ack=(\S+)$')),  # value: ack time
+    ('medocRunning', re.compile(r'^medoc (RUNNING) after (\S+)$')),  # value: wait for the pre-test
+    ('port', re.compile(r'^set port (\S+) to (\S+)$')),
+    ('endBlock', re.compile(r'^==== END BLOCK (\d+)/\d+ ====()$')),
+    ('param', re.compile(r'^([A-Za-z]\w*): (.*)$')),
+]
+# one row per logged event; offset and length locate the full message in the log file
+EVENT_DTYPE = [('time', 'f8'), ('level', 'i2'), ('kind', 'i2'), ('name', 'U32'), ('value', 'f8'), ('offset', 'i8'),
+               ('length', 'i4')]
+# one row per rating scale response
+RATING_DTYPE = [('time', 'f8'), ('name', 'U32'), ('rating', 'f8'), ('rt', 'f8'), ('noResponse', '?')]
+SESSION_RATING_DTYPE = [('subject', 'U32'), ('session', 'U16'), ('log', 'U128')] + RATING_DTYPE
+
+
+# stamp that changes whenever a log is written to
+def _Stamp(filename):
+    stat = os.stat(filename)
+    return (stat.st_mtime, stat.st_size)
+
+
+def _Value(text):
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+
+# Classify one message: (kind code, name, value)
+def ParseMessage(message):
+    for kind, pattern in _MESSAGES:
+        match = pattern.match(message)
+        if match is not None:
+            if kind == 'param':
+                return KINDS.index(kind), match.group(1)[:32], _Value(match.group(2))
+            return KINDS.index(kind), match.group(1), _Value(match.group(2)) if match.group(2) else np.nan
+    return 0, '', np.nan
+
+
+# --- SCAN A LOG --- #
+# Parse the events that start between byte offsets start and the last complete line of the memory-mapped log.
+# Lines that don't start with a time (e.g. the rest of a multi-line message) are added to the previous event.
+# Returns (events, end offset of the last complete line, subject and session found in the parameters).
+def ScanLog(filename, start=0):
+    events = []
+    info = {}
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= start:
+            return np.zeros(0, dtype=EVENT_DTYPE), start, info
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            pos = start
+            while pos < size:
+                end = mm.find(b'\n', pos)
+                if end < 0:
+                    break  # line still being written
+                line = mm[pos:end].rstrip(b'\r')
+                match = _LINE.match(line)
+                if match is None:
+                    if events:
+                        events[-1][6] = end - events[-1][5]
+                else:
+                    t, level, message = match.groups()
+                    level = level.decode('ascii')
+                    message = message.decode('utf-8', 'replace').strip()
+                    kind, name, value = ParseMessage(message)
+                    if KINDS[kind] == 'param' and name in ('subject', 'session') and name not in info:
+                        info[name] = message.split(':', 1)[1].strip()
+                    events.append([float(t), int(level) if level.isdigit() else LEVELS.get(level, 0), kind, name,
+                                   value, pos, end - pos])
+                pos = end + 1
+        finally:
+            mm.close()
+    return np.array([tuple(e) for e in events], dtype=EVENT_DTYPE), pos, info
+
+
+class LogIndex(object):
+    # The events of one log, indexed once and stored next to it as <log>.idx.npz (columns, the parsed length of
+    # the log and its stamp). Logs only grow while a session runs, so a log that grew is indexed from where the
+    # last index stopped; one that was rewritten is indexed again from the start.
+    def __init__(self, filename, indexFile=None):
+        self.filename = filename
+        self.indexFile = indexFile or filename + '.idx.npz'
+        self.events = np.zeros(0, dtype=EVENT_DTYPE)
+        self.subject = ''
+        self.session = ''
+        self.nScanned = 0  # bytes parsed by the last Update (0 if the index was up to date)
+        self._parsedBytes = 0
+        self._stamp = None
+        self._head = b''  # the first bytes of the log, to notice when it was rewritten
+        self._Load()
+
+    def _Load(self):
+        try:
+            with np.load(self.indexFile) as stored:
+                if int(stored['version']) != INDEX_VERSION:
+                    return
+                self.events = stored['events']
+                self.subject = str(stored['subject'])
+                self.session = str(stored['session'])
+                self._parsedBytes = int(stored['parsedBytes'])
+                self._stamp = tuple(stored['stamp'])
+                self._head = stored['head'].tobytes()
+        except Exception:
+            pass  # no (readable) index yet
+
+    def _ReadHead(self):
+        with open(self.filename, 'rb') as f:
+            return f.read(256)
+
+    # Index whatever was added to the log since the last time, and save the index if anything changed
+    def Update(self):
+        self.nScanned = 0
+        stamp = _Stamp(self.filename)
+        if stamp == self._stamp:
+            return self
+        head = self._ReadHead()
+        if stamp[1] < self._parsedBytes or head[:len(self._head)] != self._head:
+            self.events = np.zeros(0, dtype=EVENT_DTYPE)  # rewritten: start over
+            self._parsedBytes = 0
+            self.subject = self.session = ''
+        events, parsedBytes, info = ScanLog(self.filename, self._parsedBytes)
+        self.nScanned = parsedBytes - self._parsedBytes
+        self.events = np.concatenate([self.events, events])
+        self.subject = self.subject or info.get('subject', '')
+        self.session = self.session or info.get('session', '')
+        self._parsedBytes = parsedBytes
+        self._stamp = stamp
+        self._head = head
+        self.Save()
+        return self
+
+    def Save(self):
+        tmpFile = self.indexFile + '.tmp.npz'
+        try:
+            np.savez(tmpFile, version=INDEX_VERSION, events=self.events, subject=self.subject, session=self.session,
+                     parsedBytes=self._parsedBytes, stamp=np.array(self._stamp),
+                     head=np.frombuffer(self._head, dtype=np.uint8))
+            os.replace(tmpFile, self.indexFile)
+        except (IOError, OSError):
+            print('Could not write log index %s' % self.indexFile)
+
+    # Events of the given kind (see KINDS), whose name starts with name, at or above level, between tMin and tMax
+    def Query(self, kind=None, name=None, level=None, tMin=None, tMax=None):
+        mask = np.ones(len(self.events), dtype=bool)
+        if kind is not None:
+            mask &= self.events['kind'] == KINDS.index(kind)
+        if name is not None:
+            mask &= np.char.startswith(self.events['name'], name)
+        if level is not None:
+            mask &= self.events['level'] >= LEVELS.get(level, level)
+        if tMin is not None:
+            mask &= self.events['time'] >= tMin
+        if tMax is not None:
+            mask &= self.events['time'] <= tMax
+        return self.events[mask]
+
+    # The full text of an event, read from the log
+    def Message(self, event):
+        with open(self.filename, 'rb') as f:
+            f.seek(event['offset'])
+            line = f.read(event['length'])
+        match = _LINE.match(line)
+        return (match.group(3) if match else line).decode('utf-8', 'replace').strip()
+
+    # One row per answered (or timed out) rating scale whose name starts with name: time, name, rating, RT and
+    # whether it timed out
+    def Ratings(self, name=''):
+        ratingKinds = [KINDS.index('rating'), KINDS.index('noResponse'), KINDS.index('ratingRT')]
+        events = self.events[np.isin(self.events['kind'], ratingKinds) & np.char.startswith(self.events['name'], name)]
+        rows = []
+        pending = {}  # scale name -> row waiting for its RT
+        for event in events:
+            if event['kind'] == ratingKinds[2]:
+                if event['name'] in pending:
+                    pending.pop(event['name'])[3] = event['value']
+            else:
+                row = [event['time'], event['name'], event['value'], np.nan, event['kind'] == ratingKinds[1]]
+                pending[event['name']] = row
+                rows.append(row)
+        return np.array([tuple(r) for r in rows], dtype=RATING_DTYPE)
+
+
+# index one log (runs in the worker processes)
+def _UpdateIndex(filename):
+    index = LogIndex(filename).Update()
+    return filename, index.nScanned
+
+
+class LogDirectory(object):
+    # Every session log in a directory, indexed in parallel (one log per process) the first time and then only
+    # where they changed. Queries run on the stored indexes without reading the logs again.
+    def __init__(self, directory='.', pattern='*.log', nProcesses=None):
+        self.directory = directory
+        self.pattern = pattern
+        self.nProcesses = nProcesses or multiprocessing.cpu_count()
+        self.indexes = []
+        self.nScanned = 0  # logs (re)indexed by the last Update
+
+    def Update(self):
+        filenames = sorted(glob.glob(os.path.join(self.directory, self.pattern)))
+        stale = [f for f in filenames if LogIndex(f)._stamp != _Stamp(f)]
+        if len(stale) > 1 and self.nProcesses > 1:
+            pool = multiprocessing.Pool(min(self.nProcesses, len(stale)))
+            try:
+                pool.map(_UpdateIndex, stale, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for filename in stale:
+                _UpdateIndex(filename)
+        self.nScanned = len(stale)
+        self.indexes = [LogIndex(f) for f in filenames]
+        return self
+
+    # LogIndex of each session of this subject (all sessions if subject is None)
+    def Sessions(self, subject=None):
+        return [index for index in self.indexes if subject is None or index.subject == str(subject)]
+
+    # Ratings of every session of the subject, with the subject, session and log of each row
+    def Ratings(self, name='', subject=None):
+        parts = []
+        for index in self.Sessions(subject):
+            ratings = index.Ratings(name)
+            part = np.zeros(len(ratings), dtype=SESSION_RATING_DTYPE)
+            part['subject'] = index.subject
+            part['session'] = index.session
+            part['log'] = os.path.basename(index.filename)
+            for field in ratings.dtype.names:
+                part[field] = ratings[field]
+            parts.append(part)
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=SESSION_RATING_DTYPE)
+
+
+# --- INDEX AND QUERY FROM THE COMMAND LINE --- #
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Index PsychoPy session logs and list rating scale responses.')
+    parser.add_argument('directory', nargs='?', default='.')
+    parser.add_argument('--pattern', default='*.log')
+    parser.add_argument('--ratings', default='PainRatingScale', help='rating scale name (prefix) to list')
+    parser.add_argument('--subject', default=None)
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    tStart = time.time()
+    logs = LogDirectory(args.directory, args.pattern, nProcesses=args.processes).Update()
+    print('%d logs (%d indexed) in %.2f s' % (len(logs.indexes), logs.nScanned, time.time() - tStart))
+    print('subject,session,log,time,name,rating,rt,noResponse')
+    for row in logs.Ratings(args.ratings, args.subject):
+        print(','.join(str(v) for v in row.tolist()))
@@ -4,15 +4,29 @@
 # ===Import all the relevant packages=== #
 # ====================================== #
 
-from psychopy import core, gui, data, event, sound, logging
-import pandas as pd
+import importlib
+import sys
+import Startup  # for the startup profile and loading slow resources while the dialog is open
+startupProfile = Startup.StartupProfile(enabled='--profile-startup' in sys.argv)  # python Main.py --profile-startup
+
+from psychopy import core, gui, event, logging
 from psychopy.tools.filetools import fromFile, toFile  # saving and loading parameter files
+startupProfile.Mark('import psychopy')
 import time as ts, numpy as np  # for timing and array operations
+startupProfile.Mark('import numpy')
 import BasicPromptTools  # for loading/presenting prompts and questions
 import RatingScales
+import StimulusBank  # for preloading the growing square images
+import TextBundle  # for loading the parsed prompt and question files from a cache
+import TemperatureTable  # for converting temperatures to medoc program codes
+import BehavLog  # for streaming the behavioral (avgFile) log to disk
+import FrameScheduler  # for frame-locked phase timing
+import FlipTimer  # for per-flip timing and dropped-frame reports
+import Triggers  # for sending parallel port codes on the flip they mark
 import random  # for randomization of trials
-from devices import Pathway
+from devices import Pathway, AsyncPathway, StatusWatcher
 from HelperFunctions import reverse_string
+startupProfile.Mark('import experiment modules')
 # from psychopy import visual # visual causes a bug in the guis, so it's declared after all GUIs run.
 
 # ====================== #
@@ -34,6 +48,7 @@ params = {
     'promptFile': 'HeatAnticipationPrompts.txt',  # Name of text file containing prompts
      # 'initialpromptFile': 'InitialSafePrompts.txt',  # explain "safe" and "get ready" before the practice - NOT USING THESE SCREENS RIGHT NOW
     'questionFile': 'Text/AnxietyScale.txt',  # Name of text file containing Q&As
+    'textBundleFile': 'textBundle.cache',  # parsed prompt and question files, rebuilt when any of them change
     'questionDownKey': '1',  # move slider left
     'questionUpKey': '2',  # move slider right
     'questionDur': 5.0,
@@ -60,6 +75,8 @@ params = {
     'fixCrossSize': 50,  # size of cross, in pixels
     'fixCrossPos': [0, 0],  # (x,y) pos of fixation cross displayed before each stimulus (for gaze drift correction)
     'screenColor': (217, 217, 217),  # in rgb255 space: (r,g,b) all between 0 and 255 - light grey
+    'frameRate': None,  # screen refresh rate in Hz (None = measure it at startup)
+    'flipBufferSize': 2 ** 20,  # number of most recent flip times kept for the frame timing report
     # parallel port parameters
     'sendPortEvents': False,  # send event markers to biopac computer via parallel port
     'portAddress': 20121,  # 0xE050,  0x0378,  address of parallel port
@@ -67,14 +84,70 @@ params = {
     'codeFixation': 143,  # parallel port code for fixation period - safe
     'codeReady': 145,  # parallel port code for Get ready stimulus
     'codeVAS': 142,  # parallel port code for 3 VASs
+    'triggerPulseWidth': None,  # seconds before the port goes back to 0 after each code (None = hold until the next code)
+    'triggerBufferSize': 4096,  # number of most recent codes kept for the trigger log
     'convExcel': 'tempConv.xlsx',  # excel file with temp to binary code mappings
+    'medocRunTimeout': 5.0,  # max time (in seconds) to wait for the medoc pre-test to end before giving up on the trigger
     'image1' : 'img/image1.png',
     'image2' : 'img/image2.png',
     'image3' : 'img/image3.png',
     'techInstructionImage1': 'img/techInstructionImage1.png',
     'techInstructionImage2': 'img/techInstructionImage2.png',
+    # growing square images
+    'squareImageFile': 'Circles2/{color}{colorName}_{size}.JPG',  # filled in with color code, color name and size (1-5)
+    'squareColorNames': {1: 'White', 2: 'Green', 3: 'Yellow', 4: 'Red'},  # color code -> name in image file names
+    'nSquareSizes': 5,  # number of square sizes shown in each trial
+    'maxSquareTextures': 20,  # max number of square images kept on the GPU at once
+    'preloadSquares': True,  # decode and upload all square images at startup (False = on first use)
+    # behavioral log
+    'behavLogBinary': False,  # write the behavioral log as binary records (converted to the avgFile csv at the end)
+    'behavLogFlushInterval': 1.0,  # how often (in seconds) buffered behavioral rows are written to disk
+    # trial schedule
+    'scheduleSeed': None,  # seed for the session's trial order and timing (None = a random one; logged either way)
+    'colorList': [1, 2, 3, 4, 1, 2, 3, 4],  # 1-white, 2-green, 3-yellow, 4-red, ensure each color is presented twice at random per block
+    'painJitters': [0, 0.5, 1, 1.5, 2],  # slightly vary onset of heat pain
+    'painISI': [1, 1, 1, 1, 1, 1, 1, 1],  # for "random" ITI avg 15 sec
+    'maxColorRun': None,  # max number of trials in a row with the same color (None = no limit)
+    'vasBlocks': {0: 'PreVAS', 2: 'MidRun'},  # mood VAS run at the start of these blocks
+    # startup
+    'importVisualDuringDialog': False,  # import psychopy.visual in the background while the dialog is open (visual and gui have conflicted before)
 }
 
+
+# ======================================== #
+# == LOAD RESOURCES WHILE DIALOG IS OPEN == #
+# ======================================== #
+
+# parse (or read from the cache) every prompt and question file used in the session
+def LoadTextBundle():
+    bundle = TextBundle.TextBundle(params['textBundleFile'])
+    for questionFile in [params['questionFile'], params['moodQuestionFile1'], params['moodQuestionFile2'],
+                         params['moodQuestionFile3'], params['MoodRatingPainFile'], params['introPractice']]:
+        bundle.GetQuestions(questionFile)
+    bundle.GetPrompts(params['promptDir'] + params['promptFile'])
+    return bundle
+
+
+# decode the growing square images into memory (they're uploaded once the window exists)
+def DecodeSquares():
+    bank = StimulusBank.StimulusBank(None, params['squareImageFile'], params['squareColorNames'],
+                                     nSizes=params['nSquareSizes'], maxTextures=params['maxSquareTextures'],
+                                     name='squareBank')
+    if params['preloadSquares']:
+        bank.Decode()
+    return bank
+
+
+loader = Startup.BackgroundLoader(startupProfile)
+if params['importVisualDuringDialog']:
+    loader.Add('import psychopy.visual', importlib.import_module, 'psychopy.visual')
+loader.Add('import TrialSchedule', importlib.import_module, 'TrialSchedule')
+loader.Add('load text files', LoadTextBundle)
+# excel in the folder to convert from Celsius temp to binary code for the medoc machine (cached after the first read)
+loader.Add('load temperature table', TemperatureTable.LoadTemperatureTable, params['convExcel'])
+loader.Add('decode square images', DecodeSquares)
+loader.Start()
+
 # ========================== #
 # ===== SET UP LOGGING ===== #
 # ========================== #
@@ -105,6 +178,7 @@ except:  # if not there then use a default set
 dlg = gui.DlgFromDict(expInfo, title=scriptName, order=['subject','session','T2','T4','T6','T8','painSupport'])
 if not dlg.OK:
     core.quit()  # the user hit cancel, so exit
+startupProfile.Mark('setup dialog')
 
 params['painSupport'] = expInfo['painSupport']
 
@@ -129,20 +203,18 @@ for key in sorted(params.keys()):  # in alphabetical order
     logging.log(level=logging.INFO, msg='%s: %s' % (key, params[key]))  # log each parameter
 
 logging.log(level=logging.INFO, msg='---END PARAMETERS---')
+startupProfile.Mark('log file')
 
 
 # ==================================== #
 # == SET UP PARALLEL PORT AND MEDOC == #
 # ==================================== #
 #
-if params['painSupport']:
-    if params['sendPortEvents']:
-        from psychopy import parallel
-
-        port = parallel.ParallelPort(address=params['portAddress'])
-        port.setData(0)  # initialize to all zeros
-    else:
-        print("Parallel port not used.")
+if params['painSupport'] and params['sendPortEvents']:
+    portBackend = Triggers.ParallelBackend(params['portAddress'])
+else:
+    portBackend = Triggers.NullBackend()  # codes are still timed and logged, just not sent anywhere
+    print("Parallel port not used.")
 
 if params['painSupport']:
     # ip and port number from medoc application
@@ -152,10 +224,37 @@ if params['painSupport']:
     response = my_pathway.status()
     print(response)
 
+    # send all further commands from a background thread so screen updates never wait on the network
+    def LogMedocCommand(cmd):
+        logging.log(level=logging.EXP, msg='medoc %s queued=%.4f sent=%.4f ack=%.4f' % (
+            cmd.command, cmd.queued_time, cmd.sent_time, cmd.ack_time))
+    medoc = AsyncPathway(my_pathway, clock=core.getTime)
+    # poll medoc state on the same connection, to trigger as soon as a program is running
+    medocStatus = StatusWatcher(my_pathway, clock=core.getTime)
+
+    def TriggerWhenRunning(wait):
+        if wait.error is None:
+            logging.log(level=logging.EXP, msg='medoc RUNNING after %.4f' % (wait.met_time - wait.since))
+            medoc.trigger(callback=LogMedocCommand)
+        else:
+            logging.log(level=logging.WARNING, msg='medoc did not reach RUNNING, no trigger sent')
+
+    # once START has been sent, wait for the program to run; a RUNNING status from the previous stimulus,
+    # polled before START went out, doesn't count
+    def WaitUntilRunning(cmd):
+        LogMedocCommand(cmd)
+        if cmd.error is None:
+            medocStatus.wait_for('test_state', 'RUNNING', since=cmd.sent_time, timeout=params['medocRunTimeout'],
+                                 callback=TriggerWhenRunning)
+        else:
+            logging.log(level=logging.WARNING, msg='medoc START failed (%s), no trigger sent' % cmd.error)
+startupProfile.Mark('connect to medoc and parallel port')
+
 # ========================== #
 # ===== SET UP STIMULI ===== #
 # ========================== #
 from psychopy import visual
+startupProfile.Mark('import psychopy.visual')
 
 
 #Initializing screen Resolution
@@ -170,6 +269,19 @@ win = visual.Window(screenRes, fullscr=params['fullScreen'], allowGUI=False, mon
                     screen=params['screenToShow'], units='deg', name='win', color=params['screenColor'],
                     colorSpace='rgb255')
 win.setMouseVisible(False)
+startupProfile.Mark('open window')
+# run timed phases a whole number of frames at a time, flipping once per refresh
+scheduler = FrameScheduler.FrameScheduler(win, globalClock, frameRate=params['frameRate'],
+                                          onEscape=lambda: CoolDown())
+logging.log(level=logging.INFO, msg='frame rate: %.2f Hz' % scheduler.frameRate)
+# timestamp every flip with the phase on screen
+flipTimer = FlipTimer.FlipTimer(win, scheduler.frameDur, capacity=params['flipBufferSize'])
+scheduler.flipTimer = flipTimer
+# send parallel port codes right after the flip they mark
+triggers = Triggers.TriggerScheduler(win, portBackend, globalClock, pulseWidth=params['triggerPulseWidth'],
+                                     capacity=params['triggerBufferSize'],
+                                     portName='port %s' % format(params['portAddress'], '#04x'))
+scheduler.triggers = triggers
 # create fixation cross
 fCS = params['fixCrossSize']  # size (for brevity)
 fCP = params['fixCrossPos']  # position (for brevity)
@@ -188,7 +300,8 @@ message2 = visual.TextStim(win, pos=[0, -.5], wrapWidth=1.5, color='#000000', al
                            text="bbb", units='norm')
 
 # load VAS Qs & options
-[questions, options, answers] = BasicPromptTools.ParseQuestionFile(params['questionFile'])
+textBundle = loader.Result('load text files')
+[questions, options, answers] = textBundle.GetQuestions(params['questionFile'])
 print('%d questions loaded from %s' % (len(questions), params['questionFile']))
 
 # load technical instruction images
@@ -204,55 +317,83 @@ image3 = visual.ImageStim(win, image=params['image3'], pos=(0, 0))
 instructionsSlides = [image1, image2, image3]
 
 
+# load growing square images once, so each trial only has to draw them
+squareBank = loader.Result('decode square images')
+squareBank.win = win
+if params['preloadSquares']:
+    squareBank.Preload()
+    squareBank.Report()
+
 # get stimulus files
 
 # image slide in instructions to explain color of square
 promptImage = 'TIMprompt2.jpg'
 stimImage = visual.ImageStim(win, pos=[0, 0], name='ImageStimulus', image=promptImage, units='pix')
 
-color_list = [1, 2, 3, 4, 1, 2, 3,4]  # 1-white, 2-green, 3-yellow, 4-red, ensure each color is presented twice at random per block
-random.shuffle(color_list)
-
-sleepRand = [0, 0.5, 1, 1.5, 2]  # slightly vary onset of heat pain
+startupProfile.Mark('create stimuli')
 
-# for "random" ITI avg 15 sec
-painITI = 0
-painISI = [1, 1, 1, 1, 1, 1, 1, 1]
-random.shuffle(painISI)
+# draw the whole session's colors, jitters, ISIs and rest durations now, so trials only look them up
+TrialSchedule = loader.Result('import TrialSchedule')
+schedule = TrialSchedule.TrialSchedule(params['nBlocks'], params['nTrials'], params['colorList'],
+                                       params['painJitters'], params['painISI'], vasBlocks=params['vasBlocks'],
+                                       maxColorRun=params['maxColorRun'], seed=params['scheduleSeed'])
+schedule.Save('schedule%s.csv' % expInfo['subject'])
+logging.log(level=logging.INFO, msg='schedule seed: %d' % schedule.seed)
 
 # read questions and answers from text files for instructions text, 3 Vass, and practice scale questions
-[topPrompts, bottomPrompts] = BasicPromptTools.ParsePromptFile(params['promptDir'] + params['promptFile'])
+[topPrompts, bottomPrompts] = textBundle.GetPrompts(params['promptDir'] + params['promptFile'])
 print('%d prompts loaded from %s' % (len(topPrompts), params['promptFile']))
 
 # PROMPTS FOR EXPLANATION - NOT USING
-# [topPrompts1, bottomPrompts1] = BasicPromptTools.ParsePromptFile(params['promptDir'] + "InitialSafePrompts1.txt")
+# [topPrompts1, bottomPrompts1] = textBundle.GetPrompts(params['promptDir'] + "InitialSafePrompts1.txt")
 # print('%d prompts loaded from %s' % (len(topPrompts1), "InitialSafePrompts1.txt"))
 #
-# [topPrompts2, bottomPrompts2] = BasicPromptTools.ParsePromptFile(params['promptDir'] + "InitialSafePrompts2.txt")
+# [topPrompts2, bottomPrompts2] = textBundle.GetPrompts(params['promptDir'] + "InitialSafePrompts2.txt")
 # print('%d prompts loaded from %s' % (len(topPrompts2), "InitialSafePrompts2.txt"))
 #
-# [topPrompts3, bottomPrompts3] = BasicPromptTools.ParsePromptFile(params['promptDir'] + "InitialSafePrompts3.txt")
+# [topPrompts3, bottomPrompts3] = textBundle.GetPrompts(params['promptDir'] + "InitialSafePrompts3.txt")
 # print('%d prompts loaded from %s' % (len(topPrompts3), "InitialSafePrompts3.txt"))
 
-[questions_vas1, options_vas1, answers_vas1] = BasicPromptTools.ParseQuestionFile(params['moodQuestionFile1'])
+[questions_vas1, options_vas1, answers_vas1] = textBundle.GetQuestions(params['moodQuestionFile1'])
 print('%d questions loaded from %s' % (len(questions_vas1), params['moodQuestionFile1']))
 
-[questions_vas2, options_vas2, answers_vas2] = BasicPromptTools.ParseQuestionFile(params['moodQuestionFile2'])
+[questions_vas2, options_vas2, answers_vas2] = textBundle.GetQuestions(params['moodQuestionFile2'])
 print('%d questions loaded from %s' % (len(questions_vas2), params['moodQuestionFile2']))
 
-[questions_vas3, options_vas3, answers_vas3] = BasicPromptTools.ParseQuestionFile(params['moodQuestionFile3'])
+[questions_vas3, options_vas3, answers_vas3] = textBundle.GetQuestions(params['moodQuestionFile3'])
 print('%d questions loaded from %s' % (len(questions_vas3), params['moodQuestionFile3']))
 
-[questions_RatingPain, options_RatingPain, answers_RatingPain] = BasicPromptTools.ParseQuestionFile(params['MoodRatingPainFile'])
+[questions_RatingPain, options_RatingPain, answers_RatingPain] = textBundle.GetQuestions(params['MoodRatingPainFile'])
 print('%d questions loaded from %s' % (len(questions_vas3), params['moodQuestionFile3']))
 
-[questions_prac, options_prac, answers_prac] = BasicPromptTools.ParseQuestionFile(params['introPractice'])
+[questions_prac, options_prac, answers_prac] = textBundle.GetQuestions(params['introPractice'])
 print('%d questions loaded from %s' % (len(questions_prac), params['introPractice']))
 
-listlist = []
-
-# excel in the folder to convert from Celsius temp to binary code for the medoc machine
-excelTemps = pd.read_excel(params['convExcel'])
+textBundle.Save()  # only writes if a file had to be parsed
+
+# build the rating scales once now, so VAS onsets don't pay for constructing them
+vasStyle = dict(upKey=params['questionUpKey'], downKey=params['questionDownKey'],
+                selectKey=params['questionSelectKey'], textColor=params['vasTextColor'],
+                markerSize=params['vasMarkerSize'], tickHeight=1, tickLabelWidth=0.9)
+RatingScales.PreloadVAS(options_vas1 + options_vas2 + options_vas3 + options_RatingPain, win,
+                        pos=(0., -0.25), scaleTextPos=[0., 0.25], labelYPos=-0.25 - params['vasLabelYDist'],
+                        **vasStyle)
+
+# behavioral rows are streamed to disk as the session runs, so a crash doesn't lose them
+if params['behavLogBinary']:
+    behavLog = BehavLog.BehavLogWriter('avgFile%s.bin' % expInfo['subject'], binary=True,
+                                       flushInterval=params['behavLogFlushInterval'])
+else:
+    behavLog = BehavLog.BehavLogWriter('avgFile%s.csv' % expInfo['subject'],
+                                       flushInterval=params['behavLogFlushInterval'])
+
+# temperature to medoc program code table (loaded in the background during the dialog)
+tempTable = loader.Result('load temperature table')
+# medoc program code for each square color, looked up once for the session
+medocCodes = {1: TemperatureTable.GetProgramCode(tempTable, expInfo['T2']),
+              2: TemperatureTable.GetProgramCode(tempTable, expInfo['T4']),
+              3: TemperatureTable.GetProgramCode(tempTable, expInfo['T6']),
+              4: TemperatureTable.GetProgramCode(tempTable, expInfo['T8'])}
 
 
 # ============================ #
@@ -271,18 +412,12 @@ def SetFlipTimeToNow():
 
 # pause everything until stimuli are ready to move on
 def WaitForFlipTime():
-    while (globalClock.getTime() < tNextFlip[0]):
-        keyList = event.getKeys()
-        # Check for escape characters
-        for key in keyList:
-            if key in ['q', 'escape']:
-                CoolDown()
+    scheduler.WaitUntil(tNextFlip[0])
 
 
 # main function that takes information to run through each trial
 def GrowingSquare(color, block, trial, params):
     import time
-    global painITI
 
     # set color of square
     if color == 1:
@@ -309,10 +444,8 @@ def GrowingSquare(color, block, trial, params):
     trialStart = globalClock.getTime()
     phaseStart = globalClock.getTime()
 
-    # Load pre-defined images of square at different sizes
-    squareImages = []
-    for i in range(1, 6):
-        squareImages.append(visual.ImageStim(win, image=f"Circles2/{color}{colorName}_{i}.JPG", pos=(0, 0)))
+    # Get pre-loaded images of square at different sizes
+    squareImages = squareBank.GetStimuli(color)
 
     WaitForFlipTime()
     # gray color = during the instructions
@@ -324,20 +457,8 @@ def GrowingSquare(color, block, trial, params):
         # Set size of rating scale marker based on current square size
         sizeRatio = squareImages[i].size[0] / squareImages[0].size[0]
 
-        squareImages[i].draw()
-        win.flip()
-
-        # Wait for specified duration
-        core.wait(2)
-
-        # get new keys
-        newKeys = event.getKeys(keyList=['q', 'escape'], timeStamped=globalClock)
-        # check each keypress for escape keys
-        if len(newKeys) > 0:
-            for thisKey in newKeys:
-                if thisKey[0] in ['q', 'escape']:  # escape keys
-                    CoolDown()  # exit gracefully
-
+        # Show this size for the specified duration
+        scheduler.RunPhase('square', 2.0, draw=squareImages[i].draw)
 
         if col != 'gray':
             BehavFile(globalClock.getTime(), block + 1, trial + 1, color, globalClock.getTime() - trialStart, "square",
@@ -349,70 +470,43 @@ def GrowingSquare(color, block, trial, params):
         phaseStart = globalClock.getTime()
         tNextFlip[0] = globalClock.getTime() + (params['painDur'])
         if params['painSupport']:
-            my_pathway.start()
+            medoc.start(callback=LogMedocCommand)
         # make sure can update rating scale while delaying onset of heat pain
-        timer = core.Clock()
-        timer.add(3 + random.sample(sleepRand, 1)[0])
-        while timer.getTime() < 0:
-            # rect.draw()
-            squareImages[-1].draw()
-
-            win.flip()
-            BehavFile(globalClock.getTime(), block + 1, trial + 1, color, globalClock.getTime() - trialStart, "full",
-                      globalClock.getTime() - phaseStart,)
-            # get new keys
-            newKeys = event.getKeys(keyList=['q', 'escape'], timeStamped=globalClock)
-            # check each keypress for escape keys
-            if len(newKeys) > 0:
-                for thisKey in newKeys:
-                    if thisKey[0] in ['q', 'escape']:  # escape keys
-                        CoolDown()  # exit gracefully
+        def LogFullFrame(iFrame, t):
+            BehavFile(t, block + 1, trial + 1, color, t - trialStart, "full", t - phaseStart)
+        scheduler.RunPhase('full', 3 + schedule.Trial(block, trial)['painJitter'], draw=squareImages[-1].draw,
+                           onFrame=LogFullFrame)
         if params['painSupport']:
-            my_pathway.trigger()
+            medoc.trigger(callback=LogMedocCommand)
         # give medoc time to give heat before signalling to stop
         timer = core.Clock()
         timer.add(5)
 
         if params['painSupport']:
-            response = my_pathway.stop()
+            medoc.stop(callback=LogMedocCommand)
         # Flush the key buffer and mouse movements
         event.clearEvents()
 
     return trialStart, phaseStart
 
 
-# Send parallel port event
-def SetPortData(data):
-    if params['painSupport'] and params['sendPortEvents']:
-        logging.log(level=logging.EXP, msg='set port %s to %d' % (format(params['portAddress'], '#04x'), data))
-        port.setData(data)
-        print(data)
-    else:
-        if params['painSupport']:
-            print('Port event: %d' % data)
+# Send parallel port event on the next flip (or at the first flip at or after time at)
+def SetPortData(data, at=None):
+    triggers.Queue(data, at=at)
 
 
 # use color, size, and block to calculate data for SetPortData
 def SetPort(color, size, block):
     SetPortData((color - 1) * 6 ** 2 + (size - 1) * 6 + (block))
     if size == 1:
-        if color == 1:
-            code = excelTemps[excelTemps['Temp'].astype(str).str.contains(str(expInfo['T2']))]
-            logging.log(level=logging.EXP, msg='set medoc %s' % (code.iat[0, 1]))
-        elif color == 2:
-            code = excelTemps[excelTemps['Temp'].astype(str).str.contains(str(expInfo['T4']))]
-            logging.log(level=logging.EXP, msg='set medoc %s' % (code.iat[0, 1]))
-        elif color == 3:
-            code = excelTemps[excelTemps['Temp'].astype(str).str.contains(str(expInfo['T6']))]
-            logging.log(level=logging.EXP, msg='set medoc %s' % (code.iat[0, 1]))
-        elif color == 4:
-            code = excelTemps[excelTemps['Temp'].astype(str).str.contains(str(expInfo['T8']))]
-            logging.log(level=logging.EXP, msg='set medoc %s' % (code.iat[0, 1]))
+        code = medocCodes[color]
+        logging.log(level=logging.EXP, msg='set medoc %s' % code)
 
         if params['painSupport']:
-            response = my_pathway.program(code.iat[0, 1])
-            my_pathway.start()
-            my_pathway.trigger()
+            # queued in order and sent in the background, so the trial keeps flipping frames
+            medoc.program(code, callback=LogMedocCommand)
+            # the pre-test has a variable length and triggers sent during it are missed
+            medoc.start(callback=WaitUntilRunning)
 
 
 # Handle end of a session
@@ -423,16 +517,11 @@ def RunVas(questions, options, pos=(0., -0.25), scaleTextPos=[0., 0.25], questio
     WaitForFlipTime()
 
     # Show questions and options
+    flipTimer.SetPhase('VAS')
     [rating, decisionTime, choiceHistory] = RatingScales.ShowVAS(questions, options, win, questionDur=questionDur, \
-                                                                 upKey=params['questionUpKey'],
-                                                                 downKey=params['questionDownKey'],
-                                                                 selectKey=params['questionSelectKey'], \
-                                                                 isEndedByKeypress=isEndedByKeypress,
-                                                                 textColor=params['vasTextColor'], name=name, pos=pos, \
+                                                                 isEndedByKeypress=isEndedByKeypress, name=name, pos=pos, \
                                                                  scaleTextPos=scaleTextPos,
-                                                                 labelYPos=pos[1] - params['vasLabelYDist'],
-                                                                 markerSize=params['vasMarkerSize'], \
-                                                                 tickHeight=1, tickLabelWidth=0.9)
+                                                                 labelYPos=pos[1] - params['vasLabelYDist'], **vasStyle)
 
     # Update next stim time
     if isEndedByKeypress:
@@ -448,6 +537,7 @@ def RunMoodVas(questions, options, name='MoodVas'):
     SetPortData(params['codeBaseline'])
     # display pre-VAS prompt
     if not params['skipPrompts']:
+        flipTimer.SetPhase('prompt')
         BasicPromptTools.RunPrompts([params['PreVasMsg']], [reverse_string("לחץ על כל דבר כדי להמשיך")], win, message1, message2)
 
     # Display this VAS
@@ -460,6 +550,7 @@ def RunMoodVas(questions, options, name='MoodVas'):
 
         RunVas(question, option, questionDur=float("inf"), isEndedByKeypress=True, name=name)
 
+    flipTimer.SetPhase('prompt')
     BasicPromptTools.RunPrompts([], [reverse_string("מנוחה קצרה")], win, message1, message2)
     tNextFlip[0] = globalClock.getTime()
 
@@ -477,18 +568,27 @@ def CoolDown():
     except:
         print('fixation cross does not exist.')
 
-    df = pd.DataFrame(listlist,
-                      columns=['Absolute Time', 'Block', 'Trial', 'Color', 'Trial Time', 'Phase', 'Phase Time'])
-    df.to_csv('avgFile%s.csv' % expInfo['subject'])
+    # make sure medoc commands still in the queue are sent
+    if params['painSupport']:
+        medocStatus.close()
+        medoc.close()
+        for key in sorted(medocStatus.wait_latencies):
+            logging.log(level=logging.INFO, msg='medoc %s=%s latency histogram: %s' % (
+                key[0], key[1], dict(medocStatus.latency_histogram(key))))
+
+    # write the rest of the behavioral log and the phase, frame and trigger timing logs
+    behavLog.Close()
+    triggers.Close()
+    triggers.SaveLog('triggers%s.csv' % expInfo['subject'])
+    scheduler.SaveLog('phaseTimes%s.csv' % expInfo['subject'])
+    flipTimer.SaveSummary('frameTiming%s.csv' % expInfo['subject'])
+    flipTimer.SetPhase('end')
+    if params['behavLogBinary']:
+        BehavLog.ConvertToCsv(behavLog.filename, 'avgFile%s.csv' % expInfo['subject'])
 
-    message1.setText(reverse_string("הגענו לסוף הניסוי"))
-    message2.setText(reverse_string("לחץ על אסקייפ כדי לסיים"))
     win.logOnFlip(level=logging.EXP, msg='Display TheEnd')
-
-    message1.setFont('Arial Hebrew')
-    message2.setFont('Arial Hebrew')
-    message1.draw()
-    message2.draw()
+    BasicPromptTools.GetTextStim(message1, reverse_string("הגענו לסוף הניסוי")).draw()
+    BasicPromptTools.GetTextStim(message2, reverse_string("לחץ על אסקייפ כדי לסיים")).draw()
     win.flip()
 
     thisKey = event.waitKeys(keyList=['q', 'escape'])
@@ -499,8 +599,7 @@ def CoolDown():
 
 # handle transition between blocks
 def BetweenBlock(params):
-    while (globalClock.getTime() < tNextFlip[0]):
-        win.flip()  # to update ratingScale
+    scheduler.RunPhase('betweenBlock', tNextFlip[0] - globalClock.getTime())  # to update ratingScale
     # stop autoDraw
     AddToFlipTime(1)
     tNextFlip[0] = globalClock.getTime() + 1.0
@@ -521,14 +620,19 @@ def BetweenBlock(params):
     #     tNextFlip[0] = globalClock.getTime() + 2.0
 
 def BehavFile(absTime, block, trial, color, trialTime, phase, phaseTime):
-    list = [absTime, block, trial, color, trialTime, phase, phaseTime]
-    listlist.append(list)
+    behavLog.Write(absTime, block, trial, color, trialTime, phase, phaseTime)
 
 # =========================== #
 # ===== MAIN EXPERIMENT ===== #
 # =========================== #
 
 
+startupProfile.Mark('load questions, schedule and logs')
+# log how long each import and setup step took
+startupProfile.Report(log=lambda msg: logging.log(level=logging.INFO, msg=msg))
+if startupProfile.enabled:
+    startupProfile.Save('startupProfile%s.csv' % expInfo['subject'])
+
 # log the start of the and set up
 logging.log(level=logging.EXP, msg='---START EXPERIMENT---')
 
@@ -541,16 +645,22 @@ avgArray = []
 # Starts a for loop that iterates over each block of the experiment.
 for block in range(0, params['nBlocks']):
 
-    if block == 0: #  If it's the first block, runs a mood VAS rating task and displays some prompts to the participant.
+    if block == 0: # Before the first block, shows the technical instructions
+        flipTimer.SetPhase('instructions')
         for slide in technicalInstructionsSlides:
             slide.draw()
             win.flip()
             event.waitKeys(keyList=['space'])
         WaitForFlipTime()
+
+    if schedule.Block(block)['vas'] == 'PreVAS': # runs the mood VAS rating task before each block vasBlocks gives 'PreVAS'
         SetPortData(params['codeVAS'])
         RunMoodVas(questions_vas1, options_vas1, name='PreVAS')
+
+    if block == 0: # and then displays some prompts to the participant
         # RunPrompts() We don't use "Run Prompts", but give instructions as text
         # Present each slide and wait for spacebar input to advance to the next slide
+        flipTimer.SetPhase('instructions')
         for slide in instructionsSlides:
             slide.draw()
             win.flip()
@@ -559,7 +669,7 @@ for block in range(0, params['nBlocks']):
 
 
 
-    if block == 2: # If it's the second block, stops drawing the anxiety slider and fixation cross, runs a mood VAS rating task, displays some prompts, and sets the next stimulus presentation time to 4-6 seconds in the future.
+    if schedule.Block(block)['vas'] == 'MidRun': # If it's the second block, stops drawing the anxiety slider and fixation cross, runs a mood VAS rating task, displays some prompts, and sets the next stimulus presentation time to 4-6 seconds in the future.
         print("got to block 2 if statement")
         fixation.autoDraw = False
 
@@ -567,17 +677,10 @@ for block in range(0, params['nBlocks']):
         RunMoodVas(questions_vas2, options_vas2, name='MidRun')
 
         # Rest slide
-        message1.setText(reverse_string("מנוחה קצרה"))
-        message1.setFont('Arial Hebrew')
-        message1.draw()
-        win.flip()
-
-        timer = core.Clock()
-        timer.add(random.randint(1, 2))
-        while timer.getTime() < 0:
-            win.flip()
+        restMessage = BasicPromptTools.GetTextStim(message1, reverse_string("מנוחה קצרה"))
+        scheduler.RunPhase('rest', schedule.Block(block)['restDur'], draw=restMessage.draw)
 
-        tNextFlip[0] = globalClock.getTime() + random.randint(1, 2)
+        tNextFlip[0] = globalClock.getTime() + schedule.Block(block)['restDelay']
 
         # BasicPromptTools.RunPrompts(["Thank you for your responses."], ["Press the space bar to continue."], win,message1, message2)
         # thisKey = event.waitKeys(keyList=['space'])  # use space bar to avoid accidental advancing
@@ -585,10 +688,8 @@ for block in range(0, params['nBlocks']):
         #     tNextFlip[0] = globalClock.getTime() + random.randint(4, 6)
 
     # wait before first stimulus
-    fixationCross.draw()
     win.logOnFlip(level=logging.EXP, msg='Display Fixation')
-    win.flip() # Flip the window to display the fixation cross
-    core.wait(1) # Change to that: random.randint(4, 6)
+    scheduler.RunPhase('fixation', 1, draw=fixationCross.draw) # Change to that: random.randint(4, 6)
 
     # wait until it's time to show screen
     WaitForFlipTime()
@@ -596,44 +697,38 @@ for block in range(0, params['nBlocks']):
     win.flip()
     AddToFlipTime(1)
 
-    win.callOnFlip(SetPortData, data=params['codeBaseline']) # Calls a function to set the port data to the baseline code.
+    SetPortData(params['codeBaseline']) # Sets the port data to the baseline code on the next flip.
 
     # Waits for 2 seconds before displaying the first stimulus.
-    while (globalClock.getTime() < tNextFlip[0] + 2):
-
-        win.flip()  # to update ratingScale
+    scheduler.RunPhase('baseline', tNextFlip[0] + 2 - globalClock.getTime())  # to update ratingScale
 
     arrayLength = 1
-    painITI = 0
 
     ############################################
 
     # Starts a loop to present each trial.
     for trial in range(params['nTrials']):
 
-        color = color_list[trial] # Selects the color for this trial.
+        trialInfo = schedule.Trial(block, trial)
+        color = int(trialInfo['color']) # Selects the color for this trial.
 
         # Calls the GrowingSquare function to present the stimulus, and records the start time and phase start time.
         trialStart, phaseStart = GrowingSquare(color, block, trial, params)
-        win.flip() # Flips the screen and waits for 2 seconds.
-        core.wait(1)
+        scheduler.RunPhase('blank', 1) # Flips the screen and waits for 1 second.
 
         # Sets the next stimulus presentation time.
-        tNextFlip[0] = globalClock.getTime() + (painISI[painITI])
-        painITI += 1
+        tNextFlip[0] = globalClock.getTime() + trialInfo['isi']
         RunMoodVas(questions_RatingPain, options_RatingPain, name='PainRatingScale')
         WaitForFlipTime()
-        tNextFlip[0] = globalClock.getTime() + random.randint(2, 4)
+        tNextFlip[0] = globalClock.getTime() + trialInfo['postVasDelay']
 
     ### THE FIXATION "SAFE" AND "GET READY" WAS DELETED FROM HERE ###
 
     ############################################
 
-    # Randomize order of colors for next block (if there is a next block, meaning we are not in the end)
+    # Pause before the next block (if there is a next block, meaning we are not in the end)
     if block < (params['nBlocks'] - 1):
         BetweenBlock(params)  # betweenblock message
-        random.shuffle(color_list)
-        random.shuffle(painISI)
     logging.log(level=logging.EXP, msg='==== END BLOCK %d/%d ====' % (block + 1, params['nBlocks'])) #  Logs the end of the block.
 
     # finish recording
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+"""
+Local stand-in for the Medoc Pathway
+====================================
+
+Speaks the same binary protocol as devices.Pathway (see its segmentation_points)
+so the client can be tested and benchmarked without the thermode on the network.
+
+Run on its own with ``python PathwayEmulator.py --port 20121`` and point Pathway at 127.0.0.1.
+"""
+
+from __future__ import division, print_function
+
+__all__ = ['PathwayEmulator']
+
+import random
+import socket
+import struct
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:  # python 2
+    import SocketServer as socketserver
+
+# codes as in devices.Pathway
+TEST_STATES = {'IDLE': 0, 'RUNNING': 1, 'PAUSED': 2, 'READY': 3}
+STATE_CODES = {'IDLE': 0, 'READY': 1, 'TEST': 2}
+COMMAND_CODES = {0: 'STATUS', 1: 'TEST_PROGRAM', 2: 'START', 3: 'PAUSE', 4: 'TRIGGER', 5: 'STOP', 6: 'ABORT',
+                 7: 'YES', 8: 'NO'}
+RESPONSE_CODES = {'RESULT_OK': 0, 'RESULT_ILLEGAL_ARG': 1, 'RESULT_ILLEGAL_STATE': 2,
+                  'RESULT_ILLEGAL_TEST_STATE': 3, 'RESULT_DEVICE_COMM_ERROR': 4096,
+                  'RESULT_SAFETY_WARNING': 8192, 'RESULT_SAFETY_ERROR': 16384}
+
+HEADER = struct.Struct('<I')  # LENGTH_OFFSET
+COMMAND = struct.Struct('<IB')  # TIMESTAMP_OFFSET, COMMAND_OFFSET
+PROTOCOL = struct.Struct('<I')  # protocol number after a TEST_PROGRAM command
+RESPONSE = struct.Struct('<IIBBBHI')  # length, timestamp, command, system state, test state, result, test time
+
+
+class PathwayEmulator(object):
+
+    """
+    PathwayEmulator is a TCP server that behaves like the Medoc Pathway for the commands devices.Pathway sends.
+
+    State transitions follow the device: TEST_PROGRAM selects a program (pathway_state READY), START enters TEST with
+    test_state READY (the pre-test) and moves to RUNNING after pretest_duration, TRIGGER is only accepted while
+    RUNNING, and STOP/ABORT go back to READY/IDLE.
+
+    Args:
+        ip (str): address to listen on; default '127.0.0.1'
+        port_number (int): port to listen on; default 0 (any free port, see .address after start())
+        delay (float/dict): seconds to wait before each response, or a dict of command name -> seconds; default 0
+        jitter (float): extra uniformly random delay of up to this many seconds; default 0
+        pretest_duration (float): seconds from START until test_state becomes RUNNING; default 0
+        error_rate (float): probability of answering RESULT_DEVICE_COMM_ERROR instead of running the command; default 0
+        drop_rate (float): probability of closing the connection instead of answering; default 0
+        close_after (int): close each connection after this many responses (e.g. 1 mimics a one-shot server); default 0 (never)
+        seed (int): seed for failure injection and jitter; default None
+        verbose (bool): print each command; default False
+        clock (callable): time source for the pre-test and test time, e.g. a virtual clock; default time.time
+
+    """
+
+    def __init__(self, ip='127.0.0.1', port_number=0, delay=0., jitter=0., pretest_duration=0., error_rate=0.,
+                 drop_rate=0., close_after=0, seed=None, verbose=False, clock=time.time):
+        self.ip = ip
+        self.port_number = port_number
+        self.delay = delay
+        self.jitter = jitter
+        self.pretest_duration = pretest_duration
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.close_after = close_after
+        self.verbose = verbose
+        self.clock = clock
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.start_time = clock()
+        self.pathway_state = 'IDLE'
+        self.test_state = 'IDLE'
+        self.program = None
+        self.run_at = None
+        self.log = []  # (time received, command name, protocol, result name)
+        self.connections = 0
+        self.server = None
+        self.address = None
+        self._thread = None
+
+    def start(self):
+        """Start serving in a background thread and return the (ip, port) being listened on."""
+        emulator = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                emulator._serve_connection(self.request)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((self.ip, self.port_number), Handler)
+        self.server.daemon_threads = True
+        self.address = self.server.server_address
+        self._thread = threading.Thread(target=self.server.serve_forever, name='PathwayEmulator')
+        self._thread.daemon = True
+        self._thread.start()
+        return self.address
+
+    def stop(self):
+        """Stop serving."""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self._thread.join()
+            self.server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _read_exactly(self, conn, nbytes):
+        data = b''
+        while len(data) < nbytes:
+            chunk = conn.recv(nbytes - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def _serve_connection(self, conn):
+        with self.lock:
+            self.connections += 1
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        answered = 0
+        while True:
+            header = self._read_exactly(conn, HEADER.size)
+            if header is None:
+                return
+            payload = self._read_exactly(conn, HEADER.unpack(header)[0])
+            if payload is None:
+                return
+            _, command = COMMAND.unpack_from(payload)
+            protocol = None
+            if len(payload) >= COMMAND.size + PROTOCOL.size:
+                protocol = PROTOCOL.unpack_from(payload, COMMAND.size)[0]
+
+            name = COMMAND_CODES.get(command, command)
+            delay = self.delay.get(name, 0.) if isinstance(self.delay, dict) else self.delay
+            if self.jitter:
+                delay += self.random.uniform(0, self.jitter)
+            if delay > 0:
+                time.sleep(delay)
+            if self.drop_rate and self.random.random() < self.drop_rate:
+                return
+            conn.sendall(self.respond(command, protocol))
+            answered += 1
+            if self.close_after and answered >= self.close_after:
+                return
+
+    def respond(self, command, protocol=None):
+        """
+        Apply one command to the emulated device and build the response bytes.
+
+        Args:
+            command (int): command_id number
+            protocol (int): protocol number (only for TEST_PROGRAM)
+
+        Returns:
+            response (bytes): response message, including the length header
+        """
+        with self.lock:
+            name = COMMAND_CODES.get(command)
+            if self.error_rate and self.random.random() < self.error_rate:
+                result = 'RESULT_DEVICE_COMM_ERROR'
+            elif name is None:
+                result = 'RESULT_ILLEGAL_ARG'
+                command = 0
+            else:
+                result = self._transition(name, protocol)
+            self.log.append((self.clock(), name, protocol, result))
+            if self.verbose:
+                print('{} {} -> {} ({}/{})'.format(name, protocol, result, self.pathway_state, self.test_state))
+            test_time = int((self.clock() - self.start_time) * 1000)
+            return RESPONSE.pack(RESPONSE.size - HEADER.size, int(time.time()), command,
+                                 STATE_CODES[self.pathway_state], TEST_STATES[self.test_state],
+                                 RESPONSE_CODES[result], test_time)
+
+    def _transition(self, name, protocol):
+        # pre-test ends by itself after pretest_duration
+        if self.test_state == 'READY' and self.run_at is not None and self.clock() >= self.run_at:
+            self.test_state = 'RUNNING'
+            self.run_at = None
+
+        if name in ('STATUS', 'YES', 'NO'):
+            return 'RESULT_OK'
+        if name == 'TEST_PROGRAM':
+            if protocol is None:
+                return 'RESULT_ILLEGAL_ARG'
+            if self.pathway_state == 'TEST':
+                return 'RESULT_ILLEGAL_STATE'
+            self.program = protocol
+            self.pathway_state = 'READY'
+            return 'RESULT_OK'
+        if name == 'START':
+            if self.pathway_state != 'READY':
+                return 'RESULT_ILLEGAL_STATE'
+            self.pathway_state = 'TEST'
+            if self.pretest_duration > 0:
+                self.test_state = 'READY'
+                self.run_at = self.clock() + self.pretest_duration
+            else:
+                self.test_state = 'RUNNING'
+            return 'RESULT_OK'
+        if name == 'TRIGGER':
+            if self.test_state != 'RUNNING':
+                return 'RESULT_ILLEGAL_TEST_STATE'
+            return 'RESULT_OK'
+        if name == 'PAUSE':
+            if self.test_state != 'RUNNING':
+                return 'RESULT_ILLEGAL_TEST_STATE'
+            self.test_state = 'PAUSED'
+            return 'RESULT_OK'
+        if name in ('STOP', 'ABORT'):
+            if self.pathway_state != 'TEST':
+                return 'RESULT_ILLEGAL_STATE'
+            self.pathway_state = 'READY'
+            self.test_state = 'IDLE'
+            self.run_at = None
+            return 'RESULT_OK'
+        return 'RESULT_ILLEGAL_ARG'
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run a local Medoc Pathway emulator.')
+    parser.add_argument('--ip', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=20121)
+    parser.add_argument('--delay', type=float, default=0., help='seconds before each response')
+    parser.add_argument('--jitter', type=float, default=0., help='extra random delay, up to this many seconds')
+    parser.add_argument('--pretest', type=float, default=0., help='seconds from START until RUNNING')
+    parser.add_argument('--error-rate', type=float, default=0.)
+    parser.add_argument('--drop-rate', type=float, default=0.)
+    parser.add_argument('--close-after', type=int, default=0)
+    args = parser.parse_args()
+
+    emulator = PathwayEmulator(args.ip, args.port, delay=args.delay, jitter=args.jitter,
+                               pretest_duration=args.pretest, error_rate=args.error_rate,
+                               drop_rate=args.drop_rate, close_after=args.close_after, verbose=True)
+    print('Pathway emulator listening on %s:%d' % emulator.start())
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        emulator.stop()
@@ -2,14 +2,77 @@
 """Wrapper for RatingScale objects.."""
 
 from psychopy import core, event, logging#, visual # visual and gui conflict, so don't import it here
-import time
 
+# Built RatingScales, keyed by window, tick labels and style, so each label set is only constructed once.
+# ShowVAS re-binds the question text and resets the scale instead of building a new one for every question.
+_scalePool = {}
+# One pyglet KeyStateHandler per window, pushed while a VAS is on screen and removed afterwards.
+_keyStates = {}
+
+
+def _GetScale(win, options, textColor, pos, hideMouse, scaleTextPos, labelYPos, markerSize, tickHeight,
+              tickLabelWidth, questionDur, upKey, downKey, selectKey):
+    # import packages
+    from psychopy import visual # for ratingScale
+    import numpy as np # for tick locations
+
+    poolKey = (win, tuple(options), str(textColor), tuple(pos), hideMouse, tuple(scaleTextPos), labelYPos,
+               markerSize, tickHeight, tickLabelWidth, questionDur, upKey, downKey, selectKey)
+    if poolKey in _scalePool:
+        return _scalePool[poolKey]
+
+    # Make triangle
+    markerStim = visual.ShapeStim(win,lineColor=textColor,fillColor=textColor,vertices=((-markerSize/2.,markerSize*np.sqrt(5./4.)),(markerSize/2.,markerSize*np.sqrt(5./4.)),(0,0)),units='norm',closeShape=True,name='triangle');
+
+    tickMarks = np.linspace(0,100,len(options)).tolist()
+    if tickLabelWidth==0.0: # if default value, determine automatically to fit all tick mark labels
+        tickWrapWidth = (tickMarks[1]-tickMarks[0])*0.9/100 # *.9 for extra space, /100 for norm units
+    else: # use user-specified value
+        tickWrapWidth = tickLabelWidth;
+
+    ratingScale = visual.RatingScale(win, scale=' ', \
+        low=0., high=100., markerStart=50., precision=1., labels=options, tickMarks=tickMarks, tickHeight=tickHeight, \
+        marker=markerStim, markerColor=textColor, markerExpansion=1, singleClick=False, disappear=False, \
+        textSize=0.8, textColor=textColor, textFont='Arial Hebrew', showValue=False, \
+        showAccept=False, acceptKeys=selectKey, acceptPreText='key, click', acceptText='accept?', acceptSize=1.0, \
+        leftKeys=downKey, rightKeys=upKey, respKeys=(), lineColor=textColor, skipKeys=['q','escape'], \
+        mouseOnly=False, noMouse=hideMouse, size=2.0, stretch=1.0, pos=pos, minTime=0.4, maxTime=questionDur, \
+        flipVert=False, depth=0, name='VAS', autoLog=True)
+    # Fix text wrapWidth
+    for iLabel in range(len(ratingScale.labels)):
+        ratingScale.labels[iLabel].wrapWidth = tickWrapWidth
+        ratingScale.labels[iLabel].pos  = (ratingScale.labels[iLabel].pos[0],labelYPos)
+        ratingScale.labels[iLabel].alignHoriz = 'center'
+    # Move main text
+    ratingScale.scaleDescription.pos = scaleTextPos
+
+    _scalePool[poolKey] = ratingScale
+    return ratingScale
+
+
+# Build the scales for these option lists ahead of time (same style arguments as ShowVAS), so the first
+# VAS of the session doesn't pay for constructing them either.
+def PreloadVAS(options_list, win, questionDur=float('inf'), upKey='up', downKey='down', selectKey='enter',
+               textColor='black', pos=(0.,0.), hideMouse=True, scaleTextPos=[0.,0.45], labelYPos=-0.27648,
+               markerSize=0.1, tickHeight=0.0, tickLabelWidth=0.0):
+    for options in options_list:
+        _GetScale(win, options, textColor, pos, hideMouse, scaleTextPos, labelYPos, markerSize, tickHeight,
+                  tickLabelWidth, questionDur, upKey, downKey, selectKey)
+    return len(_scalePool)
+
+
+# Forget all built scales (e.g. before closing their window)
+def ClearVASPool():
+    _scalePool.clear()
+    _keyStates.clear()
+
+
+# stepSize is the marker movement per frame at 60Hz while a key is held. The marker is moved by the measured
+# interval between flips, so it slides at stepSize*60 points per second whatever the refresh rate.
 def ShowVAS(questions_list, options_list, win, name='Question', questionDur=float('inf'), isEndedByKeypress=True, 
             upKey='up', downKey='down', selectKey='enter',textColor='black',pos=(0.,0.),stepSize=1.,hideMouse=True,
             repeatDelay=0.5, scaleTextPos=[0.,0.45], labelYPos=-0.27648, markerSize=0.1, tickHeight=0.0, tickLabelWidth=0.0):
     # import packages
-    from psychopy import visual # for ratingScale
-    import numpy as np # for tick locations
     from pyglet.window import key # for press-and-hold functionality
 
     # set up
@@ -17,8 +80,13 @@ def ShowVAS(questions_list, options_list, win, name='Question', questionDur=floa
     rating = [None]*nQuestions
     decisionTime = [None]*nQuestions
     choiceHistory = [[0]]*nQuestions
-    # Set up pyglet key handler
-    keyState=key.KeyStateHandler()
+    pointsPerSecond = stepSize*60.
+    # Set up pyglet key handler (removed again when we're done, so handlers don't pile up)
+    if win not in _keyStates:
+        _keyStates[win] = key.KeyStateHandler()
+    keyState = _keyStates[win]
+    # forget keys held when the last VAS ended: their release wasn't seen once the handler was removed
+    keyState.clear()
     win.winHandle.push_handlers(keyState)
     # Get attributes for key handler (put _ in front of numbers)
     if downKey[0].isdigit():
@@ -31,83 +99,67 @@ def ShowVAS(questions_list, options_list, win, name='Question', questionDur=floa
         upKey_attr = upKey
 
     win.color = 'white' # Setting background color to white
-    # Rating Scale Loop
-    for iQ in range(nQuestions):
-        # Make triangle
-        markerStim = visual.ShapeStim(win,lineColor=textColor,fillColor=textColor,vertices=((-markerSize/2.,markerSize*np.sqrt(5./4.)),(markerSize/2.,markerSize*np.sqrt(5./4.)),(0,0)),units='norm',closeShape=True,name='triangle');
-        
-        tickMarks = np.linspace(0,100,len(options_list[iQ])).tolist()
-        if tickLabelWidth==0.0: # if default value, determine automatically to fit all tick mark labels
-            tickWrapWidth = (tickMarks[1]-tickMarks[0])*0.9/100 # *.9 for extra space, /100 for norm units
-        else: # use user-specified value
-            tickWrapWidth = tickLabelWidth;
-        
-        ratingScale = visual.RatingScale(win, scale=questions_list[iQ], \
-            low=0., high=100., markerStart=50., precision=1., labels=options_list[iQ], tickMarks=tickMarks, tickHeight=tickHeight, \
-            marker=markerStim, markerColor=textColor, markerExpansion=1, singleClick=False, disappear=False, \
-            textSize=0.8, textColor=textColor, textFont='Arial Hebrew', showValue=False, \
-            showAccept=False, acceptKeys=selectKey, acceptPreText='key, click', acceptText='accept?', acceptSize=1.0, \
-            leftKeys=downKey, rightKeys=upKey, respKeys=(), lineColor=textColor, skipKeys=['q','escape'], \
-            mouseOnly=False, noMouse=hideMouse, size=2.0, stretch=1.0, pos=pos, minTime=0.4, maxTime=questionDur, \
-            flipVert=False, depth=0, name='%s%d'%(name,iQ), autoLog=True)
-        # Fix text wrapWidth
-        for iLabel in range(len(ratingScale.labels)):
-            ratingScale.labels[iLabel].wrapWidth = tickWrapWidth
-            ratingScale.labels[iLabel].pos  = (ratingScale.labels[iLabel].pos[0],labelYPos)
-            ratingScale.labels[iLabel].alignHoriz = 'center'
-        # Move main text
-        ratingScale.scaleDescription.pos = scaleTextPos
-
-        # Display until time runs out (or key is pressed, if specified)
-        win.logOnFlip(level=logging.EXP, msg='Display %s%d'%(name,iQ))
-        tStart = time.time()
-        while (time.time()-tStart)<questionDur:
-            # Look for keypresses
-            if keyState[getattr(key,downKey_attr)]: #returns True if left key is pressed
-                tPress = time.time()
-                valPress = ratingScale.markerPlacedAt
-                keyPressed = downKey_attr
-                step = -stepSize
-            elif keyState[getattr(key,upKey_attr)]: #returns True if the right key is pressed
-                tPress = time.time()
-                valPress = ratingScale.markerPlacedAt
-                keyPressed = upKey_attr
-                step = stepSize
-            else:
-                keyPressed = None
-
-            # Handle sliding for held keys
-            while (keyPressed is not None) and ((time.time()-tStart)<questionDur):
-                # update time
-                durPress = time.time()-tPress
-                # update display
+    try:
+        # Rating Scale Loop
+        for iQ in range(nQuestions):
+            ratingScale = _GetScale(win, options_list[iQ], textColor, pos, hideMouse, scaleTextPos, labelYPos,
+                                    markerSize, tickHeight, tickLabelWidth, questionDur, upKey, downKey, selectKey)
+            # Re-bind the question and start over
+            ratingScale.name = '%s%d'%(name,iQ)
+            ratingScale.scaleDescription.setText(questions_list[iQ])
+            ratingScale.reset()
+
+            # Display until time runs out (or key is pressed, if specified)
+            win.logOnFlip(level=logging.EXP, msg='Display %s%d'%(name,iQ))
+            tStart = core.getTime()
+            while (core.getTime()-tStart)<questionDur:
+                # Look for keypresses
+                if keyState[getattr(key,downKey_attr)]: #returns True if left key is pressed
+                    tPress = core.getTime()
+                    keyPressed = downKey_attr
+                    step = -pointsPerSecond
+                elif keyState[getattr(key,upKey_attr)]: #returns True if the right key is pressed
+                    tPress = core.getTime()
+                    keyPressed = upKey_attr
+                    step = pointsPerSecond
+                else:
+                    keyPressed = None
+
+                # Handle sliding for held keys
+                tLastFlip = None
+                while (keyPressed is not None) and ((core.getTime()-tStart)<questionDur):
+                    # update display
+                    ratingScale.draw()
+                    tFlip = win.flip()
+                    if tFlip is None:
+                        tFlip = core.getTime()
+                    # check for key release
+                    if keyState[getattr(key,keyPressed)]==False:
+                        break
+                    # Update marker by the time since the last flip
+                    if (tLastFlip is not None) and (core.getTime()-tPress>repeatDelay):
+                        ratingScale.markerPlacedAt = ratingScale.markerPlacedAt + (tFlip-tLastFlip)*step
+                        ratingScale.markerPlacedAt = max(ratingScale.markerPlacedAt,ratingScale.low)
+                        ratingScale.markerPlacedAt = min(ratingScale.markerPlacedAt,ratingScale.high)
+                    tLastFlip = tFlip
+                # Check for response
+                if isEndedByKeypress and not ratingScale.noResponse:
+                    break
+                # Redraw
                 ratingScale.draw()
                 win.flip()
-                # check for key release
-                if keyState[getattr(key,keyPressed)]==False:
-                    break
-                # Update marker
-                if durPress>repeatDelay:
-                    ratingScale.markerPlacedAt = valPress + (durPress-repeatDelay)*step*60 # *60 for refresh rate
-                    ratingScale.markerPlacedAt = max(ratingScale.markerPlacedAt,ratingScale.low)
-                    ratingScale.markerPlacedAt = min(ratingScale.markerPlacedAt,ratingScale.high)
-            # Check for response
-            if isEndedByKeypress and not ratingScale.noResponse:
-                break
-            # Redraw
-            ratingScale.draw()
-            win.flip()
-
-        # Log outputs
-        rating[iQ] = ratingScale.getRating()
-        decisionTime[iQ] = ratingScale.getRT()
-        choiceHistory[iQ] = ratingScale.getHistory()
-
-        # if no response, log manually
-        if ratingScale.noResponse:
-            logging.log(level=logging.DATA,msg='RatingScale %s: (no response) rating=%g'%(ratingScale.name,rating[iQ]))
-            logging.log(level=logging.DATA,msg='RatingScale %s: rating RT=%g'%(ratingScale.name,decisionTime[iQ]))
-            logging.log(level=logging.DATA,msg='RatingScale %s: history=%s'%(ratingScale.name,choiceHistory[iQ]))
-
-    win.color = (217, 217, 217)
+
+            # Log outputs
+            rating[iQ] = ratingScale.getRating()
+            decisionTime[iQ] = ratingScale.getRT()
+            choiceHistory[iQ] = ratingScale.getHistory()
+
+            # if no response, log manually
+            if ratingScale.noResponse:
+                logging.log(level=logging.DATA,msg='RatingScale %s: (no response) rating=%g'%(ratingScale.name,rating[iQ]))
+                logging.log(level=logging.DATA,msg='RatingScale %s: rating RT=%g'%(ratingScale.name,decisionTime[iQ]))
+                logging.log(level=logging.DATA,msg='RatingScale %s: history=%s'%(ratingScale.name,choiceHistory[iQ]))
+    finally:
+        win.winHandle.remove_handlers(keyState)
+        win.color = (217, 217, 217)
     return rating,decisionTime,choiceHistory
@@ -0,0 +1,262 @@
+#!/usr/bin/env python2
+"""Rebuild a session's on-screen timeline from its logs, for point/range queries and timing QA."""
+
+import glob
+import multiprocessing
+import os
+
+import numpy as np
+
+import Aggregate
+import LogIndex
+
+# one row per interval something was on screen; block/trial/color are -1 where they don't apply
+INTERVAL_DTYPE = [('start', 'f8'), ('end', 'f8'), ('phase', 'U16'), ('name', 'U32'), ('block', 'i2'),
+                  ('trial', 'i2'), ('color', 'i2'), ('intendedStart', 'f8'), ('droppedFrames', 'i4')]
+TRIGGER_DTYPE = [('time', 'f8'), ('code', 'i4'), ('latency', 'f8')]
+
+
+# read a csv written by the experiment into a list of dicts (values left as text)
+def _ReadCsv(filename):
+    with open(filename) as f:
+        lines = f.read().splitlines()
+    header = lines[0].split(',')
+    return [dict(zip(header, line.split(','))) for line in lines[1:] if line]
+
+
+def _Float(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class IntervalIndex(object):
+    # Intervals sorted by start, with the running maximum of their ends, so that point and range lookups are two
+    # binary searches plus a scan of the few intervals that can overlap
+    def __init__(self, intervals):
+        self.intervals = np.sort(intervals, order='start')
+        self._starts = self.intervals['start']
+        self._maxEnds = np.maximum.accumulate(self.intervals['end']) if len(intervals) else self.intervals['end']
+
+    # intervals with start <= t < end
+    def At(self, t):
+        return self.Between(t, t)
+
+    # intervals overlapping [tMin, tMax] (any interval for which start <= tMax and end > tMin)
+    def Between(self, tMin, tMax):
+        lo = np.searchsorted(self._maxEnds, tMin, 'right')  # every interval before lo ends by tMin
+        hi = np.searchsorted(self._starts, tMax, 'right')  # every interval from hi on starts after tMax
+        candidates = self.intervals[lo:hi]
+        return candidates[candidates['end'] > tMin]
+
+
+class SessionReplay(object):
+    # The timeline of one session, on the experiment clock (globalClock), from what the session wrote:
+    # phaseTimes<subject>.csv (the FrameScheduler phases: square, full, fixation, baseline, blank, rest...),
+    # avgFile<subject>.csv/.bin (block, trial and color of the square/full phases), triggers<subject>.csv, and
+    # the session log (VAS screens: from 'Display <scale>' to its rating; end of each block). Log times are on
+    # PsychoPy's logging clock; they're shifted onto the experiment clock by matching the port codes in the log
+    # with the trigger log (or, without one, the first fixation onset).
+    # logFile defaults to the newest log of the subject in the directory.
+    def __init__(self, subject, directory='.', logFile=None):
+        self.subject = str(subject)
+        self.directory = directory
+        self.logFile = logFile or self._FindLog()
+        self.clockOffset = 0.0  # log time - experiment time
+        self.triggers = np.zeros(0, dtype=TRIGGER_DTYPE)
+        self._blockEnds = np.zeros(0)
+        phases = self._LoadPhases()
+        self._LoadTriggers()
+        vas = self._LoadLog(phases)
+        self._LabelTrials(phases)
+        intervals = np.concatenate([phases, vas])
+        intervals['block'] = np.where(intervals['block'] < 0, self.Block(intervals['start']), intervals['block'])
+        self.index = IntervalIndex(intervals)
+
+    def _Path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _FindLog(self):
+        logs = [index for index in LogIndex.LogDirectory(self.directory).Update().Sessions(self.subject)]
+        if not logs:
+            return None
+        return max(logs, key=lambda index: os.path.getmtime(index.filename)).filename
+
+    def _LoadPhases(self):
+        rows = _ReadCsv(self._Path('phaseTimes%s.csv' % self.subject))
+        phases = np.zeros(len(rows), dtype=INTERVAL_DTYPE)
+        for i, row in enumerate(rows):
+            start = _Float(row['Actual Onset'])
+            phases[i] = (start, start + _Float(row['Actual Duration']), row['Phase'], '', -1, -1, -1,
+                         _Float(row['Intended Onset']), int(row['Dropped Frames']))
+        return phases[~np.isnan(phases['start'])]  # phases of 0 frames never started
+
+    def _LoadTriggers(self):
+        filename = self._Path('triggers%s.csv' % self.subject)
+        if os.path.exists(filename):
+            rows = _ReadCsv(filename)
+            self.triggers = np.array([(_Float(r['Emitted']), int(r['Code']), _Float(r['Latency (ms)']))
+                                      for r in rows], dtype=TRIGGER_DTYPE)
+
+    # VAS intervals from the log, and the clock offset and block ends it gives
+    def _LoadLog(self, phases):
+        if self.logFile is None:
+            return np.zeros(0, dtype=INTERVAL_DTYPE)
+        log = LogIndex.LogIndex(self.logFile).Update()
+        ports = log.Query('port')
+        ports = ports[ports['value'] != 0]
+        codes = self.triggers[self.triggers['code'] != 0]
+        fixations = log.Query('display', name='Fixation')
+        fixationPhases = phases[phases['phase'] == 'fixation']
+        if len(codes) and len(ports) == len(codes):
+            self.clockOffset = float(np.median(ports['time'] - codes['time']))
+        elif len(fixations) and len(fixationPhases):
+            self.clockOffset = float(fixations['time'][0] - fixationPhases['start'][0])
+        if not len(self.triggers) and len(ports):
+            self.triggers = np.array([(t - self.clockOffset, v, np.nan) for t, v in ports[['time', 'value']]],
+                                     dtype=TRIGGER_DTYPE)
+        self._blockEnds = np.sort(log.Query('endBlock')['time']) - self.clockOffset
+
+        # each VAS screen runs from its Display line to the rating (or timeout) of the same scale
+        ratings = log.Ratings()
+        displays = log.Query('display')
+        vas = []
+        for rating in ratings:
+            shown = displays[(displays['name'] == rating['name']) & (displays['time'] <= rating['time'])]
+            if len(shown):
+                vas.append((shown['time'][-1] - self.clockOffset, rating['time'] - self.clockOffset, 'VAS',
+                            rating['name'], -1, -1, -1, np.nan, 0))
+        return np.array(vas, dtype=INTERVAL_DTYPE)
+
+    # block, trial and color of the square/full phases, from the behavioral log rows written during or just after them
+    def _LabelTrials(self, phases):
+        for filename in ['avgFile%s.csv' % self.subject, 'avgFile%s.bin' % self.subject]:
+            if os.path.exists(self._Path(filename)):
+                meta, rows = Aggregate.ParseOutput(self._Path(filename))
+                break
+        else:
+            return
+        rows = np.sort(rows, order='Absolute Time')
+        for phase in phases:
+            if phase['phase'] not in ('square', 'full'):
+                continue
+            i = np.searchsorted(rows['Absolute Time'], phase['start'])
+            if i < len(rows) and rows['Absolute Time'][i] <= phase['end'] + 0.05 and \
+                    rows['Phase'][i] == phase['phase']:
+                phase['block'], phase['trial'], phase['color'] = rows['Block'][i], rows['Trial'][i], rows['Color'][i]
+
+    # block (starting at 1) running at each experiment time
+    def Block(self, t):
+        return np.searchsorted(self._blockEnds, t, 'right') + 1
+
+    # What was on screen at time t (experiment clock)
+    def At(self, t):
+        return self.index.At(t)
+
+    # Intervals overlapping tMin..tMax (the whole session by default), optionally only of one phase and block
+    def Between(self, tMin=-np.inf, tMax=np.inf, phase=None, block=None):
+        intervals = self.index.Between(tMin, tMax)
+        if phase is not None:
+            intervals = intervals[intervals['phase'] == phase]
+        if block is not None:
+            intervals = intervals[intervals['block'] == block]
+        return intervals
+
+    # Port codes sent between tMin and tMax
+    def TriggersBetween(self, tMin, tMax):
+        return self.triggers[(self.triggers['time'] >= tMin) & (self.triggers['time'] <= tMax)]
+
+    # Timing QA for the session: onset error (actual - intended, ms) of the frame-locked phases, dropped frames,
+    # trigger latency, how far each code sent is from the nearest onset on screen, and VAS durations
+    def QA(self):
+        intervals = self.index.intervals
+        timed = intervals[~np.isnan(intervals['intendedStart'])]
+        onsetError = 1000 * (timed['start'] - timed['intendedStart'])
+        triggerOffset = np.zeros(0)
+        if len(self.triggers) and len(intervals):
+            starts = intervals['start']  # sorted
+            i = np.searchsorted(starts, self.triggers['time'])
+            before, after = starts[np.clip(i - 1, 0, len(starts) - 1)], starts[np.clip(i, 0, len(starts) - 1)]
+            nearest = np.where(np.abs(after - self.triggers['time']) < np.abs(before - self.triggers['time']),
+                               after, before)
+            triggerOffset = 1000 * (self.triggers['time'] - nearest)
+        vas = intervals[intervals['phase'] == 'VAS']
+        stat = lambda values, f: float(f(values)) if len(values) else np.nan
+        return {'subject': self.subject, 'log': os.path.basename(self.logFile or ''),
+                'phases': len(timed), 'meanOnsetError': stat(onsetError, np.mean),
+                'maxOnsetError': stat(np.abs(onsetError), np.max),
+                'droppedFrames': int(intervals['droppedFrames'].sum()),
+                'triggers': len(self.triggers), 'meanTriggerLatency': stat(self.triggers['latency'], np.nanmean),
+                'maxTriggerLatency': stat(self.triggers['latency'], np.nanmax),
+                'maxTriggerOffset': stat(np.abs(triggerOffset), np.max),
+                'vas': len(vas), 'meanVasDuration': stat(vas['end'] - vas['start'], np.mean),
+                'clockOffset': self.clockOffset}
+
+
+# --- TIMING QA OVER MANY SESSIONS --- #
+QA_COLUMNS = ['subject', 'log', 'phases', 'meanOnsetError', 'maxOnsetError', 'droppedFrames', 'triggers',
+              'meanTriggerLatency', 'maxTriggerLatency', 'maxTriggerOffset', 'vas', 'meanVasDuration', 'clockOffset']
+
+
+# subjects with a phase timing log in the directory
+def FindSubjects(directory='.'):
+    names = [os.path.basename(f) for f in glob.glob(os.path.join(directory, 'phaseTimes*.csv'))]
+    return sorted(name[len('phaseTimes'):-len('.csv')] for name in names)
+
+
+# replay one session and return its QA (runs in the worker processes)
+def _SessionQA(args):
+    subject, directory = args
+    return SessionReplay(subject, directory).QA()
+
+
+# Timing QA of every session in the directory, one session per process
+def RunQA(directory='.', nProcesses=None):
+    subjects = FindSubjects(directory)
+    LogIndex.LogDirectory(directory, nProcesses=nProcesses).Update()  # index the logs once, in parallel
+    nProcesses = nProcesses or multiprocessing.cpu_count()
+    if len(subjects) > 1 and nProcesses > 1:
+        pool = multiprocessing.Pool(min(nProcesses, len(subjects)))
+        try:
+            return pool.map(_SessionQA, [(s, directory) for s in subjects], chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return [_SessionQA((s, directory)) for s in subjects]
+
+
+def SaveQA(rows, filename):
+    with open(filename, 'w') as f:
+        f.write(','.join(QA_COLUMNS) + '\n')
+        for row in rows:
+            f.write(','.join('%.3f' % row[c] if isinstance(row[c], float) else str(row[c]) for c in QA_COLUMNS) + '\n')
+
+
+# --- QUERY OR QA FROM THE COMMAND LINE --- #
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Replay session timelines from their logs.')
+    parser.add_argument('directory', nargs='?', default='.')
+    parser.add_argument('--subject', default=None, help='replay this subject (default: timing QA of every session)')
+    parser.add_argument('--at', type=float, default=None, help='show what was on screen at this time')
+    parser.add_argument('--phase', default=None)
+    parser.add_argument('--block', type=int, default=None)
+    parser.add_argument('--out', default='timingQA.csv')
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.subject is None:
+        rows = RunQA(args.directory, args.processes)
+        SaveQA(rows, args.out)
+        print('timing QA of %d sessions in %s' % (len(rows), args.out))
+    else:
+        replay = SessionReplay(args.subject, args.directory)
+        if args.at is not None:
+            intervals = replay.At(args.at)
+        else:
+            intervals = replay.Between(phase=args.phase, block=args.block)
+        print(','.join(name for name, dtype in INTERVAL_DTYPE))
+        for interval in intervals:
+            print(','.join(str(v) for v in interval.tolist()))
@@ -0,0 +1,403 @@
+#!/usr/bin/env python2
+"""Run the Main.py protocol headless, on a virtual clock with a scripted participant."""
+
+import functools
+import math
+import random
+import runpy
+import sys
+import time
+import types
+
+from psychopy import core, event, logging
+
+from devices import Pathway
+from PathwayEmulator import PathwayEmulator
+
+# the simulation being run (set by Install)
+current = None
+
+
+class VirtualClock(object):
+    # Time only moves when the experiment waits or flips. With speed set, every advance also sleeps
+    # (advance / speed) real seconds, so background threads (e.g. the medoc sender) keep up with the session.
+    def __init__(self, speed=None):
+        self.now = 0.0
+        self.speed = speed
+
+    def getTime(self):
+        return self.now
+
+    def Advance(self, dt):
+        if dt > 0:
+            self.now += float(dt)
+            if self.speed:
+                time.sleep(dt / self.speed)
+
+    def AdvanceTo(self, t):
+        self.Advance(t - self.now)
+
+
+class SimClock(object):
+    # Stands in for core.Clock, reading the virtual clock
+    def __init__(self):
+        self._timeAtLastReset = current.clock.getTime()
+
+    def getTime(self):
+        return current.clock.getTime() - self._timeAtLastReset
+
+    def reset(self, newT=0.0):
+        self._timeAtLastReset = current.clock.getTime() + newT
+
+    def add(self, t):
+        self._timeAtLastReset += t
+
+
+class ScriptedResponder(object):
+    # The simulated participant: answers every key wait after keyRt seconds with the first allowed key,
+    # never presses escape, and rates each VAS after a random time in rtRange. Ratings are taken from the
+    # ratings list in order, then drawn at random.
+    def __init__(self, seed=None, ratings=None, rtRange=(0.5, 2.0), keyRt=0.5):
+        self.random = random.Random(seed)
+        self.ratings = list(ratings or [])
+        self.rtRange = rtRange
+        self.keyRt = keyRt
+        self.nRatings = 0
+        self.nKeys = 0
+
+    def Rate(self, scale):
+        if self.ratings:
+            rating = self.ratings.pop(0)
+        else:
+            rating = round(self.random.uniform(scale.low, scale.high))
+        self.nRatings += 1
+        return rating, self.random.uniform(*self.rtRange)
+
+    def GetKeys(self, keyList=None, timeStamped=False):
+        return []
+
+    def WaitKeys(self, maxWait=float('inf'), keyList=None, timeStamped=False, **kwargs):
+        current.clock.Advance(min(self.keyRt, maxWait))
+        if self.keyRt > maxWait:
+            return None
+        self.nKeys += 1
+        key = keyList[0] if keyList else 'space'
+        if timeStamped:
+            return [(key, current.clock.getTime())]
+        return [key]
+
+
+class _NullWinHandle(object):
+    # pyglet window stand-in: just keeps track of pushed event handlers
+    def __init__(self):
+        self.handlers = []
+
+    def push_handlers(self, *handlers):
+        self.handlers.extend(handlers)
+
+    def remove_handlers(self, *handlers):
+        for h in handlers:
+            if h in self.handlers:
+                self.handlers.remove(h)
+
+
+class HeadlessWindow(object):
+    # Stands in for visual.Window: flip() moves the virtual clock to the next refresh, then runs the
+    # callOnFlip functions and logOnFlip messages like a real flip would.
+    def __init__(self, size=(800, 600), color=(0, 0, 0), units='norm', name='window', **kwargs):
+        self.size = size
+        self.color = color
+        self.units = units
+        self.name = name
+        self.frameRate = current.frameRate
+        self.frameDur = 1.0 / current.frameRate
+        self.winHandle = _NullWinHandle()
+        self.nFlips = 0
+        self._toCall = []
+        self._toLog = []
+
+    def flip(self, clearBuffer=True):
+        clock = current.clock
+        clock.AdvanceTo((math.floor(clock.getTime() / self.frameDur + 1e-6) + 1) * self.frameDur)
+        t = clock.getTime()
+        self.nFlips += 1
+        toCall, self._toCall = self._toCall, []
+        for function, args, kwargs in toCall:
+            function(*args, **kwargs)
+        toLog, self._toLog = self._toLog, []
+        for msg, level in toLog:
+            logging.log(msg=msg, level=level, t=t)
+        return t
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self._toCall.append((function, args, kwargs))
+
+    def logOnFlip(self, msg, level, obj=None):
+        self._toLog.append((msg, level))
+
+    def getActualFrameRate(self, *args, **kwargs):
+        return self.frameRate
+
+    def setMouseVisible(self, visibility):
+        pass
+
+    def close(self):
+        pass
+
+
+class NullStim(object):
+    # Stands in for TextStim/ShapeStim/ImageStim: keeps its arguments as attributes, and setX(value) sets x
+    def __init__(self, win=None, **kwargs):
+        self.win = win
+        self.autoDraw = False
+        self.pos = (0, 0)
+        self.size = None
+        self.height = None
+        self.wrapWidth = None
+        self.color = None
+        self.units = None
+        self.name = ''
+        self.text = ''
+        self.nDraws = 0
+        self.__dict__.update(kwargs)
+        if self.size is None:
+            self.size = getattr(kwargs.get('image'), 'size', (1.0, 1.0))  # PIL images know their size
+
+    def draw(self, win=None):
+        self.nDraws += 1
+
+    def __getattr__(self, name):
+        if name.startswith('set') and len(name) > 3:
+            attr = name[3].lower() + name[4:]
+
+            def Set(value, *args, **kwargs):
+                setattr(self, attr, value)
+            return Set
+        raise AttributeError(name)
+
+
+class SimRatingScale(NullStim):
+    # Stands in for visual.RatingScale: the responder picks a rating and a response time when the scale is
+    # first drawn, and the response is accepted on the first draw after that time
+    def __init__(self, win, scale='', low=1, high=7, markerStart=None, labels=(), name='', maxTime=0.0, **kwargs):
+        NullStim.__init__(self, win, name=name, **kwargs)
+        self.low = low
+        self.high = high
+        self.markerStart = markerStart
+        self.maxTime = maxTime
+        self.labels = [NullStim(win, text=label) for label in labels]
+        self.scaleDescription = NullStim(win, text=scale)
+        self.reset()
+
+    def reset(self, log=True):
+        self.noResponse = True
+        self.markerPlacedAt = self.markerStart if self.markerStart is not None else False
+        self.decisionTime = 0.0
+        self.history = None
+        self._tStart = None
+        self._plan = None
+
+    def draw(self, win=None):
+        NullStim.draw(self)
+        now = current.clock.getTime()
+        if self._tStart is None:
+            self._tStart = now
+            self._plan = current.responder.Rate(self)
+        rating, rt = self._plan
+        if self.noResponse and now - self._tStart >= rt:
+            self.history = [(self.markerStart, 0.0), (rating, now - self._tStart)]
+            self.markerPlacedAt = rating
+            self.decisionTime = now - self._tStart
+            self.noResponse = False
+            logging.log(level=logging.DATA, msg='RatingScale %s: rating=%s' % (self.name, rating))
+            logging.log(level=logging.DATA, msg='RatingScale %s: rating RT=%.3f' % (self.name, self.decisionTime))
+            logging.log(level=logging.DATA, msg='RatingScale %s: history=%s' % (self.name, self.history))
+
+    def getRating(self):
+        return self.markerPlacedAt
+
+    def getRT(self):
+        return self.decisionTime
+
+    def getHistory(self):
+        return self.history if self.history is not None else [(self.markerPlacedAt, 0.0)]
+
+
+class NullParallelPort(object):
+    # Stands in for parallel.ParallelPort, keeping every value written with its (virtual) time
+    def __init__(self, address=None):
+        self.address = address
+        self.data = []
+
+    def setData(self, data):
+        self.data.append((current.clock.getTime(), data))
+
+    def readData(self):
+        return self.data[-1][1] if self.data else 0
+
+
+class SimulatedPathway(Pathway):
+    # A Pathway that answers from an in-process PathwayEmulator on the virtual clock instead of the network
+    def __init__(self, ip, port_number, clock=None, pretest_duration=1.0, **kwargs):
+        self.emulator = PathwayEmulator(pretest_duration=pretest_duration, clock=clock)
+        Pathway.__init__(self, ip, port_number, **kwargs)
+
+    def call_many(self, commands, verbose=False):
+        responses = []
+        with self._lock:
+            for c in commands:
+                command, protocol = c if isinstance(c, tuple) else (c, None)
+                responses.append(self.decode_responses(self.emulator.respond(self._command_id(command),
+                                                                             protocol))[0][0])
+                if verbose:
+                    print(responses[-1])
+        return responses
+
+    def close(self):
+        pass
+
+
+class SimDlg(object):
+    # Stands in for gui.DlgFromDict: OK is pressed right away, with the simulation's values filled in
+    def __init__(self, dictionary, title='', order=(), **kwargs):
+        dictionary.update(current.expInfo)
+        self.OK = True
+        self.data = [dictionary[k] for k in order]
+
+
+class Simulation(object):
+    # Replaces the timing, display, input and hardware entry points Main.py uses, and puts them back in
+    # Uninstall(). Everything the experiment writes (logs, avgFile, phase and frame timing) is written as usual.
+    def __init__(self, subject='sim', seed=0, frameRate=60.0, speed=None, painSupport=False, ratings=None,
+                 temps=(36.0, 41.0, 46.0, 48.0), pretestDuration=1.0):
+        self.clock = VirtualClock(speed=speed)
+        self.frameRate = frameRate
+        self.seed = seed
+        self.responder = ScriptedResponder(seed=seed, ratings=ratings)
+        self.expInfo = {'subject': subject, 'painSupport': painSupport,
+                        'T2': temps[0], 'T4': temps[1], 'T6': temps[2], 'T8': temps[3]}
+        self.pretestDuration = pretestDuration
+        self.realDuration = None
+        self._saved = []
+        self._addedModules = []
+
+    def _Patch(self, obj, name, value):
+        self._saved.append((obj, name, getattr(obj, name, None), hasattr(obj, name)))
+        setattr(obj, name, value)
+
+    def _Module(self, name):
+        # the real module if it imports here, otherwise an empty one to patch (e.g. no display for pyglet)
+        try:
+            __import__(name)
+            return sys.modules[name]
+        except Exception:
+            pass
+        parts = name.split('.')
+        for i in range(1, len(parts) + 1):
+            prefix = '.'.join(parts[:i])
+            if prefix not in sys.modules:
+                sys.modules[prefix] = types.ModuleType(prefix)
+                self._addedModules.append(prefix)
+                if i > 1:
+                    self._Patch(sys.modules['.'.join(parts[:i - 1])], parts[i - 1], sys.modules[prefix])
+        return sys.modules[name]
+
+    def Install(self):
+        global current
+        current = self
+        import devices
+        from psychopy import visual
+        from psychopy.tools import filetools
+
+        self._Patch(core, 'Clock', SimClock)
+        self._Patch(core, 'getTime', self.clock.getTime)
+        self._Patch(core, 'wait', lambda secs, hogCPUperiod=0.2: self.clock.Advance(secs))
+        self._Patch(core, 'quit', self._Quit)
+        self._Patch(event, 'getKeys', self.responder.GetKeys)
+        self._Patch(event, 'waitKeys', self.responder.WaitKeys)
+        self._Patch(event, 'clearEvents', lambda eventType=None: None)
+        self._Patch(visual, 'Window', HeadlessWindow)
+        for name in ['TextStim', 'ShapeStim', 'ImageStim']:
+            self._Patch(visual, name, NullStim)
+        self._Patch(visual, 'RatingScale', SimRatingScale)
+        self._Patch(self._Module('psychopy.gui'), 'DlgFromDict', SimDlg)
+        parallel = self._Module('psychopy.parallel')
+        self._Patch(parallel, 'ParallelPort', NullParallelPort)
+        self._Patch(filetools, 'fromFile', self._NoFile)  # don't read or overwrite the lab's last-session info
+        self._Patch(filetools, 'toFile', lambda filename, data: None)
+        self._Patch(devices, 'Pathway', functools.partial(SimulatedPathway, clock=self.clock.getTime,
+                                                           pretest_duration=self.pretestDuration))
+        key = self._Module('pyglet.window.key')
+        if not hasattr(key, 'KeyStateHandler'):
+            self._Patch(key, 'KeyStateHandler', _KeyStateHandler)
+            self._Patch(key, '__getattr__', lambda name: name)
+        logging.setDefaultClock(SimClock())
+        random.seed(self.seed)
+        try:
+            import numpy as np
+            np.random.seed(self.seed)
+        except ImportError:
+            pass
+
+    def Uninstall(self):
+        global current
+        while self._saved:
+            obj, name, value, existed = self._saved.pop()
+            if existed:
+                setattr(obj, name, value)
+            else:
+                delattr(obj, name)
+        while self._addedModules:
+            del sys.modules[self._addedModules.pop()]
+        logging.setDefaultClock(core.monotonicClock)
+        current = None
+
+    def _NoFile(self, filename, *args, **kwargs):
+        raise IOError('no previous session info in a simulation')
+
+    def _Quit(self):
+        logging.flush()
+        raise SystemExit(0)
+
+    # Run a script (Main.py by default) start to finish, and return a summary of the run
+    def Run(self, script='Main.py'):
+        self.Install()
+        tStart = time.time()
+        try:
+            runpy.run_path(script, run_name='__main__')
+        except SystemExit:
+            pass
+        finally:
+            self.realDuration = time.time() - tStart
+            self.Uninstall()
+        return {'virtualDuration': self.clock.getTime(), 'realDuration': self.realDuration,
+                'ratings': self.responder.nRatings, 'keyPresses': self.responder.nKeys}
+
+
+class _KeyStateHandler(dict):
+    # pyglet's KeyStateHandler, for when pyglet can't be imported without a display: no key is ever held
+    def __missing__(self, key):
+        return False
+
+
+# --- RUN A SIMULATED SESSION FROM THE COMMAND LINE --- #
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run the experiment headless on a virtual clock.')
+    parser.add_argument('--script', default='Main.py')
+    parser.add_argument('--subject', default='sim', help='subject name used in the output file names')
+    parser.add_argument('--seed', type=int, default=0, help='seed for trial order, ratings and response times')
+    parser.add_argument('--frame-rate', type=float, default=60., help='simulated refresh rate (Hz)')
+    parser.add_argument('--speed', type=float, default=None,
+                        help='run this many times faster than real time (default: as fast as possible)')
+    parser.add_argument('--pain-support', action='store_true', help='talk to a simulated Medoc and parallel port')
+    parser.add_argument('--temps', type=float, nargs=4, default=[36., 41., 46., 48.], help='T2 T4 T6 T8')
+    parser.add_argument('--ratings', type=float, nargs='*', default=None, help='VAS ratings to give, in order')
+    args = parser.parse_args()
+
+    sim = Simulation(subject=args.subject, seed=args.seed, frameRate=args.frame_rate, speed=args.speed,
+                     painSupport=args.pain_support, ratings=args.ratings, temps=args.temps)
+    summary = sim.Run(args.script)
+    print('simulated %.1f s of session in %.1f s (%d ratings, %d key presses)' % (
+        summary['virtualDuration'], summary['realDuration'], summary['ratings'], summary['keyPresses']))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python2
+"""Startup timing profile, and loading slow resources in the background while the setup dialog is open."""
+
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupProfile(object):
+    # Times each import and setup step from the start of the script. Steps are always recorded (it's cheap);
+    # Report() only prints them when enabled, e.g. with python Main.py --profile-startup
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.tStart = time.time()
+        self.steps = []  # (label, start relative to tStart, duration, thread name)
+        self._lock = threading.Lock()
+        self._lastMark = self.tStart
+
+    # Record the time since the previous mark (or the start) as a step, for top-level code that isn't in a with
+    def Mark(self, label):
+        now = time.time()
+        with self._lock:
+            self.steps.append((label, self._lastMark - self.tStart, now - self._lastMark,
+                               threading.current_thread().name))
+        self._lastMark = now
+
+    @contextmanager
+    def Step(self, label):
+        tStart = time.time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.steps.append((label, tStart - self.tStart, time.time() - tStart,
+                                   threading.current_thread().name))
+
+    # import a module by name, as a timed step
+    def Import(self, name):
+        with self.Step('import %s' % name):
+            return importlib.import_module(name)
+
+    # Print (and log, if log is given, e.g. a function taking a message) one line per step, in start order
+    def Report(self, log=None):
+        lines = ['startup %s: %.3f s' % (label, duration) + ('' if thread == 'MainThread' else ' (%s)' % thread)
+                 for label, start, duration, thread in sorted(self.steps, key=lambda s: s[1])]
+        lines.append('startup total: %.3f s' % (time.time() - self.tStart))
+        if log is not None:
+            for line in lines:
+                log(line)
+        if self.enabled:
+            print('\n'.join(lines))
+        return self.steps
+
+    # Write the steps to a csv file
+    def Save(self, filename):
+        with open(filename, 'w') as f:
+            f.write('Step,Start (s),Duration (s),Thread\n')
+            for label, start, duration, thread in sorted(self.steps, key=lambda s: s[1]):
+                f.write('%s,%.4f,%.4f,%s\n' % (label, start, duration, thread))
+
+
+class BackgroundLoader(object):
+    # Runs named jobs one after another in a background thread (e.g. while gui.DlgFromDict is open), each as a
+    # profile step. Result(name) waits for that job and returns what it returned, or raises what it raised.
+    def __init__(self, profile=None):
+        self.profile = profile if profile is not None else StartupProfile()
+        self._jobs = []
+        self._results = {}
+        self._errors = {}
+        self._done = {}
+        self._thread = None
+
+    def Add(self, name, function, *args, **kwargs):
+        self._jobs.append((name, function, args, kwargs))
+        self._done[name] = threading.Event()
+
+    def Start(self):
+        self._thread = threading.Thread(target=self._Run, name='BackgroundLoader')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _Run(self):
+        for name, function, args, kwargs in self._jobs:
+            try:
+                with self.profile.Step(name):
+                    self._results[name] = function(*args, **kwargs)
+            except Exception as e:
+                self._errors[name] = e
+            self._done[name].set()
+
+    def Result(self, name):
+        if self._thread is None:
+            self.Start()
+        with self.profile.Step('wait for %s' % name):
+            self._done[name].wait()
+        if name in self._errors:
+            raise self._errors[name]
+        return self._results[name]
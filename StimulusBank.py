@@ -0,0 +1,109 @@
+#!/usr/bin/env python2
+"""Preload and cache image stimuli so trial onset costs a draw call, not disk I/O."""
+
+from psychopy import logging#, visual # visual and gui conflict, so don't import it here
+from collections import OrderedDict
+import time
+
+
+class StimulusBank(object):
+    # Holds decoded images for every (color, size) pair and a bounded LRU of uploaded ImageStims.
+    # fileTemplate is formatted with color, colorName and size, e.g. 'Circles2/{color}{colorName}_{size}.JPG'
+    # win can be None while only decoding (e.g. in a background thread before the window exists); set it
+    # before the first upload.
+    def __init__(self, win, fileTemplate, colorNames, nSizes=5, maxTextures=20, pos=(0, 0), name='StimulusBank'):
+        self.win = win
+        self.fileTemplate = fileTemplate
+        self.colorNames = colorNames  # dict of color code -> name used in the file names
+        self.nSizes = nSizes
+        self.maxTextures = maxTextures  # max number of ImageStims (GPU textures) kept alive at once
+        self.pos = pos
+        self.name = name
+        self._images = {}  # (color, size) -> decoded PIL image
+        self._stims = OrderedDict()  # (color, size) -> ImageStim, oldest first
+        self.stats = OrderedDict()  # (color, size) -> dict of load timing and memory
+
+    # path of the image file for this color and size (sizes start at 1)
+    def GetFilename(self, color, size):
+        return self.fileTemplate.format(color=color, colorName=self.colorNames[color], size=size)
+
+    # decode the image file into memory (only once per asset)
+    def _Decode(self, color, size):
+        from PIL import Image # psychopy already depends on Pillow
+        key = (color, size)
+        if key not in self._images:
+            filename = self.GetFilename(color, size)
+            tStart = time.time()
+            image = Image.open(filename)
+            image.load()  # force the decode now rather than at first use
+            tDecode = time.time() - tStart
+            self._images[key] = image
+            self.stats[key] = {'file': filename, 'decodeTime': tDecode, 'uploadTime': 0.0, 'nUploads': 0,
+                               'width': image.size[0], 'height': image.size[1],
+                               'decodedBytes': image.size[0] * image.size[1] * len(image.getbands()),
+                               'textureBytes': image.size[0] * image.size[1] * 4}  # approx. RGBA8 on the GPU
+        return self._images[key]
+
+    # create the ImageStim (uploads the texture) from the decoded image
+    def _Upload(self, color, size):
+        from psychopy import visual # for ImageStim
+        key = (color, size)
+        image = self._Decode(color, size)
+        tStart = time.time()
+        stim = visual.ImageStim(self.win, image=image, pos=self.pos, name='%s_%d_%d' % (self.name, color, size))
+        self.stats[key]['uploadTime'] += time.time() - tStart
+        self.stats[key]['nUploads'] += 1
+        # evict least recently used textures if we are over budget
+        while len(self._stims) >= self.maxTextures:
+            oldKey, oldStim = self._stims.popitem(last=False)
+            logging.log(level=logging.DEBUG, msg='%s: evicted texture %s' % (self.name, self.GetFilename(*oldKey)))
+            del oldStim  # ImageStim releases its texture when garbage collected
+        self._stims[key] = stim
+        return stim
+
+    # Get a ready-made ImageStim, uploading it on first use
+    def GetStim(self, color, size):
+        key = (color, size)
+        stim = self._stims.pop(key, None)
+        if stim is None:
+            return self._Upload(color, size)
+        self._stims[key] = stim  # mark as most recently used
+        return stim
+
+    # Get the ImageStims for every size of one color, smallest first
+    def GetStimuli(self, color):
+        return [self.GetStim(color, size) for size in range(1, self.nSizes + 1)]
+
+    # Decode every color/size image into memory, without touching the window
+    def Decode(self, colors=None):
+        if colors is None:
+            colors = sorted(self.colorNames.keys())
+        for color in colors:
+            for size in range(1, self.nSizes + 1):
+                self._Decode(color, size)
+
+    # Decode and upload every color/size image up front (call at startup, before the first trial)
+    def Preload(self, colors=None):
+        if colors is None:
+            colors = sorted(self.colorNames.keys())
+        tStart = time.time()
+        for color in colors:
+            for size in range(1, self.nSizes + 1):
+                self.GetStim(color, size)
+        logging.log(level=logging.INFO, msg='%s: preloaded %d images in %.3f s'
+                                            % (self.name, len(colors) * self.nSizes, time.time() - tStart))
+
+    # Log load time and memory for each asset and return the rows
+    def Report(self):
+        rows = []
+        for key, stat in self.stats.items():
+            row = dict(stat)
+            row['color'], row['size'] = key
+            row['resident'] = key in self._stims
+            rows.append(row)
+            logging.log(level=logging.INFO,
+                        msg='%s: %s decode=%.1fms upload=%.1fms (x%d) %dx%d decoded=%dkB texture=%dkB' % (
+                            self.name, stat['file'], stat['decodeTime'] * 1000, stat['uploadTime'] * 1000,
+                            stat['nUploads'], stat['width'], stat['height'],
+                            stat['decodedBytes'] // 1024, stat['textureBytes'] // 1024))
+        return rows
@@ -0,0 +1,79 @@
+#!/usr/bin/env python2
+"""Temperature to Medoc program code lookup, compiled once from the conversion excel file."""
+
+import os
+import pickle
+import zipfile
+import xml.etree.ElementTree as ET
+
+CACHE_VERSION = 1
+_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+# --- READ THE TEMP AND CODE COLUMNS OF THE FIRST SHEET OF AN XLSX FILE --- #
+# Reads the xml inside the xlsx directly, so neither pandas nor openpyxl is needed.
+def ReadExcelColumns(filename, tempColumn='Temp', codeColumn='Code'):
+    with zipfile.ZipFile(filename) as xlsx:
+        sharedStrings = []
+        if 'xl/sharedStrings.xml' in xlsx.namelist():
+            for si in ET.fromstring(xlsx.read('xl/sharedStrings.xml')).iter(_NS + 'si'):
+                sharedStrings.append(''.join(t.text or '' for t in si.iter(_NS + 't')))
+        sheet = ET.fromstring(xlsx.read('xl/worksheets/sheet1.xml'))
+
+    rows = []
+    for row in sheet.iter(_NS + 'row'):
+        values = {}
+        for cell in row.iter(_NS + 'c'):
+            column = cell.get('r').rstrip('0123456789')  # e.g. 'B12' -> 'B'
+            v = cell.find(_NS + 'v')
+            if v is None:
+                continue
+            values[column] = sharedStrings[int(v.text)] if cell.get('t') == 's' else v.text
+        rows.append(values)
+
+    # find the columns by their header names
+    header = dict((name, column) for column, name in rows[0].items())
+    temps = [row.get(header[tempColumn]) for row in rows[1:]]
+    codes = [row.get(header[codeColumn]) for row in rows[1:]]
+    return [(t, c) for t, c in zip(temps, codes) if t is not None and c is not None]
+
+
+# round so that e.g. '46', 46.0 and 46.00001 all find the same entry
+def _Key(temp):
+    return round(float(temp), 1)
+
+
+# --- LOAD THE TEMPERATURE TABLE, FROM THE CACHE IF THE EXCEL FILE HASN'T CHANGED --- #
+# Returns a dict of temperature -> program code (int). The cache is a small pickle next to the excel file,
+# rebuilt whenever the excel file's modification time or size change.
+def LoadTemperatureTable(filename, cacheFile=None):
+    if cacheFile is None:
+        cacheFile = filename + '.cache'
+    stat = os.stat(filename)
+    stamp = (CACHE_VERSION, stat.st_mtime, stat.st_size)
+    try:
+        with open(cacheFile, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['stamp'] == stamp:
+            return cached['table']
+    except Exception:
+        pass  # missing, old or unreadable cache: rebuild it
+
+    table = {}
+    for temp, code in ReadExcelColumns(filename):
+        table[_Key(temp)] = int(float(code))
+    try:
+        with open(cacheFile, 'wb') as f:
+            pickle.dump({'stamp': stamp, 'table': table}, f, protocol=2)
+    except IOError:
+        print('Could not write temperature table cache %s' % cacheFile)
+    return table
+
+
+# --- GET THE PROGRAM CODE FOR A TEMPERATURE (EXACT MATCH) --- #
+def GetProgramCode(table, temp):
+    try:
+        return table[_Key(temp)]
+    except KeyError:
+        raise ValueError('Temperature %s is not in the temperature table (%s to %s)'
+                         % (temp, min(table), max(table)))
@@ -0,0 +1,141 @@
+#!/usr/bin/env python2
+"""Parsed prompt and question files, compiled once into a cached bundle and loaded lazily."""
+
+import os
+import pickle
+import struct
+
+import BasicPromptTools
+
+BUNDLE_VERSION = 2
+_HEADER_SIZE = struct.Struct('<Q')  # length of the pickled index at the start of the bundle
+
+
+# stamp that changes whenever a text file is edited
+def _Stamp(filename):
+    stat = os.stat(filename)
+    return (stat.st_mtime, stat.st_size)
+
+
+class TextBundle(object):
+    # The bundle file holds a small index followed by one pickled entry per (file, kind), where kind is
+    # 'questions' (ParseQuestionFile) or 'prompts' (ParsePromptFile). Entries keep the strings exactly as the
+    # parsers return them (already reversed for Hebrew), and are keyed by path + modification time + size.
+    # Opening the bundle only reads the index; each entry is read when it's first asked for. Files that are
+    # new or changed are parsed as usual and written back by Save().
+    def __init__(self, bundleFile='textBundle.cache', directories=['Text/', 'Questions/']):
+        self.bundleFile = bundleFile
+        self.directories = directories
+        self._index = {}  # (path, kind) -> (stamp, offset, length) in the bundle file
+        self._dataStart = 0
+        self._loaded = {}  # (path, kind) -> parsed result
+        self._dirty = False
+        self.nParsed = 0  # files parsed this session (cache misses)
+        self.nCached = 0  # entries read from the bundle
+        try:
+            with open(bundleFile, 'rb') as f:
+                headerSize = _HEADER_SIZE.unpack(f.read(_HEADER_SIZE.size))[0]
+                header = pickle.loads(f.read(headerSize))
+            if header['version'] == BUNDLE_VERSION:
+                self._index = header['index']
+                self._dataStart = _HEADER_SIZE.size + headerSize
+        except Exception:
+            pass  # missing, old or unreadable bundle: everything gets parsed and the bundle rebuilt
+
+    def _Key(self, filename, kind):
+        return (os.path.normpath(filename), kind)
+
+    def _Get(self, filename, kind, parse):
+        key = self._Key(filename, kind)
+        stamp = _Stamp(filename)
+        if key in self._loaded and self._loaded[key][0] == stamp:
+            return self._loaded[key][1]
+        entry = self._index.get(key)
+        result = None
+        if entry is not None and entry[0] == stamp:
+            try:
+                with open(self.bundleFile, 'rb') as f:
+                    f.seek(self._dataStart + entry[1])
+                    result = pickle.loads(f.read(entry[2]))
+                self.nCached += 1
+            except Exception:
+                result = None
+        if result is None:
+            result = parse(filename)
+            self.nParsed += 1
+            self._dirty = True
+        self._loaded[key] = (stamp, result)
+        return result
+
+    # (questions, options, answers), as BasicPromptTools.ParseQuestionFile returns them
+    def GetQuestions(self, filename):
+        return self._Get(filename, 'questions', BasicPromptTools.ParseQuestionFile)
+
+    # (topPrompts, bottomPrompts), as BasicPromptTools.ParsePromptFile returns them
+    def GetPrompts(self, filename):
+        return self._Get(filename, 'prompts', BasicPromptTools.ParsePromptFile)
+
+    # Parse every .txt file in the bundle's directories both ways, so any of them can be loaded from the bundle
+    def Compile(self):
+        for directory in self.directories:
+            for name in sorted(os.listdir(directory)):
+                if name.endswith('.txt'):
+                    self.GetQuestions(os.path.join(directory, name))
+                    self.GetPrompts(os.path.join(directory, name))
+        self.Save()
+
+    # Write the bundle again if anything had to be parsed. Entries that are still up to date but weren't
+    # loaded this session are copied over as they are.
+    def Save(self):
+        if not self._dirty:
+            return
+        blobs = []
+        index = {}
+        offset = 0
+        try:
+            old = open(self.bundleFile, 'rb')
+        except IOError:
+            old = None
+        try:
+            keys = set(self._index) | set(self._loaded)
+            for key in sorted(keys):
+                if key in self._loaded:
+                    stamp, result = self._loaded[key]
+                    blob = pickle.dumps(result, protocol=2)
+                else:
+                    stamp, oldOffset, length = self._index[key]
+                    try:
+                        if old is None or _Stamp(key[0]) != stamp:
+                            continue  # file changed or is gone: drop it
+                    except OSError:
+                        continue
+                    old.seek(self._dataStart + oldOffset)
+                    blob = old.read(length)
+                index[key] = (stamp, offset, len(blob))
+                blobs.append(blob)
+                offset += len(blob)
+        finally:
+            if old is not None:
+                old.close()
+
+        header = pickle.dumps({'version': BUNDLE_VERSION, 'index': index}, protocol=2)
+        tmpFile = self.bundleFile + '.tmp'
+        try:
+            with open(tmpFile, 'wb') as f:
+                f.write(_HEADER_SIZE.pack(len(header)))
+                f.write(header)
+                f.write(b''.join(blobs))
+            os.replace(tmpFile, self.bundleFile)
+        except (IOError, OSError):
+            print('Could not write text bundle %s' % self.bundleFile)
+            return
+        self._index = index
+        self._dataStart = _HEADER_SIZE.size + len(header)
+        self._dirty = False
+
+
+# --- COMPILE THE BUNDLE FROM THE COMMAND LINE --- #
+if __name__ == '__main__':
+    bundle = TextBundle()
+    bundle.Compile()
+    print('%d entries in %s (%d parsed)' % (len(bundle._index), bundle.bundleFile, bundle.nParsed))
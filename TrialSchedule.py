@@ -0,0 +1,109 @@
+#!/usr/bin/env python2
+"""Whole-session trial schedule, compiled from a seed before the first trial."""
+
+import importlib
+import os
+import random
+import sys
+import types
+
+import numpy as np
+
+
+# Import a module of the bundled ioHub library in lib/iohub (e.g. 'util.variableProvider') without changing
+# sys.path, so it can't shadow an installed iohub or psychopy.iohub: lib/iohub is registered as a private package
+# whose __init__ (pytables check, lazy import of the hub client) isn't needed and isn't run.
+def _ImportBundledIohub(name):
+    root = '_bundled_iohub'
+    if root not in sys.modules:
+        package = types.ModuleType(root)
+        package.__path__ = [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib', 'iohub')]
+        sys.modules[root] = package
+    return importlib.import_module('%s.%s' % (root, name))
+
+
+_variableProvider = _ImportBundledIohub('util.variableProvider')
+BlockSetProvider, TrialSetProvider = _variableProvider.BlockSetProvider, _variableProvider.TrialSetProvider
+
+# one row per trial, in the order they are run
+TRIAL_DTYPE = [('block', 'i2'), ('trial', 'i2'), ('color', 'i2'), ('painJitter', 'f8'), ('isi', 'f8'),
+               ('postVasDelay', 'f8')]
+# one row per block
+BLOCK_DTYPE = [('block', 'i2'), ('vas', 'U16'), ('restDur', 'f8'), ('restDelay', 'f8')]
+
+
+class TrialSchedule(object):
+    # Everything random about a session is drawn here, from one seed, before the first trial: each block's
+    # color order (a shuffled TrialSetProvider over colorList), the extra delay
+    # before the heat in each trial (from painJitters), the ISI after each trial (painISI, shuffled per block),
+    # the delay after each pain rating (postVasDelays) and the rest screen after the mid-run VAS (restDurs).
+    # vasBlocks maps block number -> name of the mood VAS run before it; endVas is run after the last block.
+    # maxColorRun (if given) limits how many trials in a row may have the same color.
+    # The runtime only indexes into the arrays (Trial(block, trial), Block(block)).
+    def __init__(self, nBlocks, nTrials, colorList, painJitters, painISI, postVasDelays=(2, 3, 4),
+                 restDurs=(1, 2), vasBlocks={0: 'PreVAS', 2: 'MidRun'}, endVas='PostRun', maxColorRun=None,
+                 seed=None, maxTries=1000):
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
+        self.nBlocks = nBlocks
+        self.nTrials = nTrials
+        self.endVas = endVas
+        rng = np.random.RandomState(seed)
+
+        conditions = np.array([(c,) for c in colorList], dtype=[('color', 'i2')])
+        self.trials = np.zeros(nBlocks * nTrials, dtype=TRIAL_DTYPE)
+        self.blocks = np.zeros(nBlocks, dtype=BLOCK_DTYPE)
+        blockSets = BlockSetProvider([TrialSetProvider(conditions, True, rng) for block in range(nBlocks)], False)
+        for block, trialSet in enumerate(blockSets.getNextConditionSet()):
+            colors = self._Colors(trialSet, conditions, rng, maxColorRun, maxTries)
+            isi = list(painISI)
+            rng.shuffle(isi)
+            rows = self.trials[block * nTrials:(block + 1) * nTrials]
+            rows['block'] = block
+            rows['trial'] = np.arange(nTrials)
+            rows['color'] = colors[:nTrials]
+            rows['painJitter'] = rng.choice(painJitters, nTrials)
+            rows['isi'] = isi[:nTrials]
+            rows['postVasDelay'] = rng.choice(postVasDelays, nTrials)
+            self.blocks[block] = (block, vasBlocks.get(block, ''), rng.choice(restDurs), rng.choice(restDurs))
+
+    # colors in the order the trial set provides them, reshuffled until no color repeats more than maxColorRun
+    # times in a row
+    def _Colors(self, trialSet, conditions, rng, maxColorRun, maxTries):
+        colors = [int(c['color']) for c in trialSet.getNextConditionSet()]
+        if maxColorRun is None:
+            return colors
+        for iTry in range(maxTries):
+            if self._LongestRun(colors[:self.nTrials]) <= maxColorRun:
+                return colors
+            colors = [int(c['color']) for c in
+                      TrialSetProvider(conditions, True, rng).getNextConditionSet()]
+        raise ValueError('no color order with at most %d repeats in a row found in %d tries' % (maxColorRun,
+                                                                                              maxTries))
+
+    @staticmethod
+    def _LongestRun(values):
+        longest = run = 0
+        for i, v in enumerate(values):
+            run = run + 1 if i > 0 and v == values[i - 1] else 1
+            longest = max(longest, run)
+        return longest
+
+    def Trial(self, block, trial):
+        return self.trials[block * self.nTrials + trial]
+
+    def Block(self, block):
+        return self.blocks[block]
+
+    # Write the schedule as csv: one line per trial, with its block's VAS and rest durations
+    def Save(self, filename):
+        with open(filename, 'w') as f:
+            f.write('Seed,%d\n' % self.seed)
+            f.write('Block,Trial,Color,Pain Jitter,ISI,Post VAS Delay,VAS Before Block,Rest Duration,Rest Delay\n')
+            for t in self.trials:
+                b = self.blocks[t['block']]
+                f.write('%d,%d,%d,%g,%g,%g,%s,%g,%g\n' % (t['block'] + 1, t['trial'] + 1, t['color'], t['painJitter'],
+                                                        t['isi'], t['postVasDelay'], b['vas'], b['restDur'],
+                                                        b['restDelay']))
+            f.write('End VAS,%s\n' % self.endVas)
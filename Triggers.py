@@ -0,0 +1,166 @@
+#!/usr/bin/env python2
+"""Parallel-port event codes sent on the screen flip they mark, with emission timestamps and latency stats."""
+
+from psychopy import core, logging
+import threading
+import numpy as np
+
+# one row per code sent: when it was asked for, the flip it was meant for and when it actually went out
+TRIGGER_DTYPE = [('code', 'i4'), ('queued', 'f8'), ('intended', 'f8'), ('emitted', 'f8'), ('reset', 'f8'),
+                 ('onFlip', '?')]
+
+
+class ParallelBackend(object):
+    # Writes codes to the parallel port (to the BIOPAC computer)
+    def __init__(self, address):
+        from psychopy import parallel # only needed when the port is used
+        self.address = address
+        self.port = parallel.ParallelPort(address=address)
+        self.port.setData(0)  # initialize to all zeros
+
+    def SetData(self, data):
+        self.port.setData(data)
+
+
+class NullBackend(object):
+    # Keeps every value "written" with the time it was written (on the given clock), for testing without a port
+    def __init__(self, clock=core):
+        self.clock = clock
+        self.written = []  # (time, data)
+
+    def SetData(self, data):
+        self.written.append((self.clock.getTime(), data))
+
+
+class TriggerScheduler(object):
+    # Queue(code) sends the code right after the next window flip (win.flip is wrapped, like FlipTimer does), so
+    # every marker has the same latency relative to the visual onset; Queue(code, at=t) waits for the first flip
+    # at or after time t. Codes queued for the same flip go out on consecutive flips, so each one is seen.
+    # If pulseWidth is set, a background thread puts the line back to 0 that long after each code (None keeps
+    # the code on the line until the next one). Every code is recorded in a preallocated ring buffer of capacity
+    # rows, with its intended (flip) and actual emission times on the clock.
+    def __init__(self, win, backend, clock, pulseWidth=None, capacity=4096, portName='port'):
+        self.win = win
+        self.backend = backend
+        self.clock = clock
+        self.pulseWidth = pulseWidth
+        self.capacity = capacity
+        self.portName = portName  # used in the log messages
+        self.nTriggers = 0
+        self._log = np.zeros(capacity, dtype=TRIGGER_DTYPE)
+        self._pending = []  # [code, queued, at, intended] waiting for a flip, oldest first
+        self._lock = threading.Lock()  # one write to the backend at a time
+        self._cond = threading.Condition(self._lock)
+        self._resetAt = None  # clock time the line goes back to 0
+        self._closed = False
+        self._flip = win.flip
+        win.flip = self.Flip
+        if pulseWidth:
+            self._thread = threading.Thread(target=self._RunResets, name='TriggerScheduler')
+            self._thread.daemon = True
+            self._thread.start()
+
+    # Send the code on the next flip (or the first flip at or after time at)
+    def Queue(self, code, at=None):
+        self._pending.append([code, self.clock.getTime(), at, np.nan])
+
+    # Send the code now, without waiting for a flip (for markers that don't go with a screen change)
+    def Send(self, code):
+        t = self.clock.getTime()
+        self._Emit(code, t, t, onFlip=False)
+
+    # Send codes queued with at= that are due, without a flip (e.g. while waiting between phases)
+    def Poll(self):
+        if self._pending and self._pending[0][2] is not None and self._pending[0][2] <= self.clock.getTime():
+            code, queued, at, intended = self._pending.pop(0)
+            self._Emit(code, queued, at, onFlip=False)
+
+    def Flip(self, *args, **kwargs):
+        flipTime = self._flip(*args, **kwargs)
+        if not self._pending:
+            return flipTime
+        # win.flip() stamps the flip on PsychoPy's own clock, so the flip is timed again on self.clock, the clock
+        # every other time in the log (and the at= of each code) is on
+        t = self.clock.getTime()
+        # the first flip each code was meant for is its intended emission time
+        for item in self._pending:
+            if np.isnan(item[3]) and (item[2] is None or item[2] <= t):
+                item[3] = t
+        if not np.isnan(self._pending[0][3]):
+            code, queued, at, intended = self._pending.pop(0)
+            self._Emit(code, queued, intended, onFlip=True)
+        return flipTime
+
+    def _Emit(self, code, queued, intended, onFlip):
+        with self._cond:
+            self.backend.SetData(code)
+            tEmitted = self.clock.getTime()
+            if self.pulseWidth and code != 0:
+                self._resetAt = tEmitted + self.pulseWidth
+                self._cond.notify()
+        row = self._log[self.nTriggers % self.capacity]
+        row['code'], row['queued'], row['intended'], row['emitted'] = code, queued, intended, tEmitted
+        row['reset'] = np.nan
+        row['onFlip'] = onFlip
+        self.nTriggers += 1
+        logging.log(level=logging.EXP, msg='set %s to %d' % (self.portName, code))
+
+    # put the line back to 0 once the pulse is over (unless another code was sent in the meantime)
+    def _RunResets(self):
+        with self._cond:
+            while not self._closed:
+                if self._resetAt is None:
+                    self._cond.wait()
+                    continue
+                remaining = self._resetAt - self.clock.getTime()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                self.backend.SetData(0)
+                self._resetAt = None
+                if self.nTriggers:
+                    self._log[(self.nTriggers - 1) % self.capacity]['reset'] = self.clock.getTime()
+
+    # Send anything still queued, clear the line, stop the reset thread and put back the original win.flip
+    def Close(self):
+        while self._pending:
+            code, queued, at, intended = self._pending.pop(0)
+            self._Emit(code, queued, queued if np.isnan(intended) else intended, onFlip=False)
+        with self._cond:
+            self._closed = True
+            self._resetAt = None
+            self.backend.SetData(0)
+            self._cond.notify()
+        self.win.flip = self._flip
+
+    # codes sent so far, oldest first (only the last `capacity` are kept)
+    def GetLog(self):
+        n = min(self.nTriggers, self.capacity)
+        start = self.nTriggers % self.capacity if self.nTriggers > self.capacity else 0
+        return self._log[(np.arange(n) + start) % self.capacity]
+
+    # Latency (emitted - intended, in ms) per code: count, mean, SD and max, as a list of dicts
+    def Summary(self):
+        log = self.GetLog()
+        latencies = 1000 * (log['emitted'] - log['intended'])
+        rows = []
+        for code in np.unique(log['code']):
+            these = latencies[log['code'] == code]
+            rows.append({'code': int(code), 'n': len(these), 'meanLatency': these.mean(), 'sdLatency': these.std(),
+                         'maxLatency': these.max()})
+        return rows
+
+    # Write every code sent to a csv file, and the overall latency to the log
+    def SaveLog(self, filename):
+        with open(filename, 'w') as f:
+            f.write('Code,Queued,Intended,Emitted,Reset,On Flip,Latency (ms)\n')
+            for r in self.GetLog():
+                f.write('%d,%r,%r,%r,%r,%d,%.3f\n' % (r['code'], float(r['queued']), float(r['intended']),
+                                                      float(r['emitted']), float(r['reset']), r['onFlip'],
+                                                      1000 * (r['emitted'] - r['intended'])))
+        log = self.GetLog()
+        if len(log):
+            latencies = 1000 * (log['emitted'] - log['intended'])
+            logging.log(level=logging.INFO, msg='%d triggers: latency mean=%.3fms sd=%.3fms max=%.3fms' % (
+                len(log), latencies.mean(), latencies.std(), latencies.max()))
+        return self.Summary()
@@ -5,14 +5,16 @@ Main Pathway Device Class
 =========================
 """
 
-__all__ = ['Pathway']
+__all__ = ['Pathway', 'AsyncPathway', 'StatusWatcher']
 __author__ = ["Cosan Lab"]
 __license__ = "MIT"
 import socket
+import struct
+import threading
 import time
-import numpy as np
-from collections import OrderedDict
+from collections import OrderedDict, deque
 import six
+from six.moves import queue
 
 class Pathway(object):
 
@@ -25,10 +27,20 @@ class Pathway(object):
         timeout (float): seconds until connection timeouts; default 5s
         verbose (bool): flag whether to print responses; default True
         buffer_size (int): size of connection buffer; default 1024
+        reuse_socket (bool): keep one connection open for all commands and reconnect if it drops; default True
 
     """
 
-    def __init__(self, ip, port_number,timeout = 5.,verbose=True, buffer_size = 1024):
+    # Precompiled little-endian layouts of the messages (see segmentation_points)
+    HEADER = struct.Struct('<I')  # length of the rest of the message
+    COMMAND = struct.Struct('<IIB')  # length, time stamp, command
+    PROGRAM_COMMAND = struct.Struct('<IIBI')  # length, time stamp, command, protocol
+    RESPONSE = struct.Struct('<IIBBBHI')  # length, time stamp, command, system state, test state, result, test time
+    # commands that can be sent again after the connection drops: the device may already have run an unanswered
+    # command, and running TEST_PROGRAM/START/TRIGGER... twice would mean e.g. a second heat stimulus
+    RESENDABLE = (0,)  # STATUS
+
+    def __init__(self, ip, port_number,timeout = 5.,verbose=True, buffer_size = 1024, reuse_socket=True):
 
         assert isinstance(ip,six.string_types), "IP address must be a string."
         assert isinstance(port_number,six.integer_types), "Port must be an integer"
@@ -38,7 +50,11 @@ class Pathway(object):
         self.BUFFER_SIZE = buffer_size
         self.timeout = timeout
         self.verbose = verbose
+        self.reuse_socket = reuse_socket
         self.socket = None
+        self._in_flight = deque()
+        self._lock = threading.RLock()  # one caller at a time on the shared connection
+        self._recv_buffer = bytearray()
         self.test_states = {
         0: 'IDLE',
         1: 'RUNNING',
@@ -80,6 +96,7 @@ class Pathway(object):
         'TEST_TIME_OFFSET': (13,17),
         'ERROR_MESSAGE_OFFSET': 17
         })
+        self.command_ids = dict((v, k) for k, v in self.command_codes.items())
         try:
             _ = self.call('STATUS',verbose=False)
             print('Connection to Pathway successful')
@@ -88,96 +105,189 @@ class Pathway(object):
 
     def _create_connection(self):
         """Create and return new socket connection"""
-        socket.setdefaulttimeout(self.timeout)
         s = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        s.settimeout(self.timeout)
         s.connect((self.ip,self.port_number))
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         return s
 
-    def call(self, command, protocol=None, reuse_socket=False, verbose = False):
+    def _get_connection(self):
+        """Return the open socket connection, creating one if needed"""
+        if self.socket is None:
+            self.socket = self._create_connection()
+            self._recv_buffer = bytearray()
+        return self.socket
+
+    def close(self):
+        """Close the socket connection. Commands still in flight are dropped."""
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except socket.error:
+                pass
+        self.socket = None
+        self._recv_buffer = bytearray()
+        self._in_flight.clear()
+
+    def _reconnect(self):
+        """
+        Replace a dropped connection and resend the unanswered commands that are safe to repeat (see RESENDABLE).
+
+        Raises:
+            IOError: if any other command was still unanswered; it may or may not have run on the device, so it is not sent again and the caller has to decide what to do
+        """
+        pending = list(self._in_flight)
+        self.close()
+        unsafe = [self.command_codes[command] for command, _, _ in pending if command not in self.RESENDABLE]
+        if unsafe:
+            raise IOError('Connection to Pathway dropped before {} was answered; it may already have run, so it was not sent again.'.format(', '.join(unsafe)))
+        s = self._get_connection()
+        for command, protocol, message in pending:
+            s.sendall(message)
+            self._in_flight.append((command, protocol, message))
+        return s
+
+    def _command_id(self, command):
+        """Convert a command name to its command_id number"""
+        if isinstance(command,six.string_types):
+            command = self.command_ids[command]
+        return command
+
+    def send(self, command, protocol=None):
         """
-        Send command to device.
+        Send a command without waiting for the response, so several commands can be in flight at once. Collect the responses in order with receive().
 
         Args:
             command (str/int): command name or command_id number to send to device
             protocol (str/int): protocol number on device to issue command to (only needed for command TEST_PROGRAM)
-            reuse_socket (bool): try to reuse the last created socket connection; *NOT CURRENTLY FUNCTIONAL*
-            verbose (bool): whether to print out the device callback
 
         Returns:
-            response (dict): response from Medoc system
+            in_flight (int): number of commands waiting for a response, including this one
         """
-
-        if reuse_socket:
-            raise NotImplementedError("Reusing sockets does not currently work.")
-            if self.socket:
-                s = self.socket
-            else:
-                raise ValueError("No previous sockets exist")
-        else:
-            s = self._create_connection()
-            self.socket = s
-
-        if isinstance(command,str):
-            command = self.command_codes.keys()[self.command_codes.values().index(command)]
-
+        command = self._command_id(command)
         if command ==1 and protocol is None:
             raise ValueError('TEST_PROGRAM command requires a protocol number')
 
         MESSAGE = self._format_command(command, protocol)
-        nbytes = s.send(MESSAGE)
-        time.sleep(0.5)
-        data = s.recv(self.BUFFER_SIZE)
-        response = self._format_response(data,nbytes)
-        if not response:
-            return self.call(command,protocol,verbose=verbose)
-        if verbose:
-            print_flag = verbose
-        else:
-            print_flag = self.verbose
-        if print_flag:
+        try:
+            self._get_connection().sendall(MESSAGE)
+        except socket.error:
+            # connection was dropped by the device, so this command never went out: send it once more on a new one
+            self._reconnect().sendall(MESSAGE)
+        self._in_flight.append((command, protocol, MESSAGE))
+        return len(self._in_flight)
+
+    def _read_exactly(self, nbytes):
+        """Read until at least nbytes are buffered, reconnecting if the connection was closed before a response started."""
+        while len(self._recv_buffer) < nbytes:
+            try:
+                chunk = self._get_connection().recv(self.BUFFER_SIZE)
+            except socket.timeout:
+                raise
+            except socket.error:
+                chunk = b''
+            if not chunk:
+                if self._recv_buffer:
+                    self.close()
+                    raise IOError('Connection to Pathway closed in the middle of a response.')
+                # closed between responses: resend the unanswered commands that are safe to repeat
+                self._reconnect()
+                continue
+            self._recv_buffer += chunk
+
+    def receive(self, verbose=False):
+        """
+        Read the response to the oldest command still in flight.
+
+        Args:
+            verbose (bool): whether to print out the device callback
+
+        Returns:
+            response (dict): response from Medoc system; empty if it could not be formatted
+
+        Raises:
+            socket.timeout: if the response did not arrive in time; the connection is closed and every command in flight is dropped, so a late response can't be taken for the answer to a later command
+        """
+        if not self._in_flight:
+            raise ValueError('No commands waiting for a response')
+        try:
+            self._read_exactly(self.HEADER.size)
+            nbytes = self.HEADER.size + self.HEADER.unpack_from(self._recv_buffer)[0]
+            self._read_exactly(nbytes)
+        except socket.timeout:
+            self.close()
+            raise
+        response = self._format_response(memoryview(self._recv_buffer)[:nbytes],nbytes)
+        del self._recv_buffer[:nbytes]
+        command, _, _ = self._in_flight.popleft()
+        if not self.reuse_socket and not self._in_flight:
+            self.close()
+
+        if response and response['command_id'] != self.command_codes[command]:
+            print("WARNING: expected response to {} but got {}".format(self.command_codes[command], response['command_id']))
+        if response and (verbose or self.verbose):
             print(response)
         return response
 
-    def _format_command(self, command, protocol):
+    def call_many(self, commands, verbose=False):
         """
-        Format calls to device.
+        Send several commands back-to-back on one connection, then read their responses in order. Responses to commands sent earlier with send() must be collected with receive() first.
 
         Args:
-            command (str/int): command name or command_id number to send to device
-            protocol (int): protocol number on device to issue command to (only needed for command TEST_PROGRAM)
+            commands (list): command names/ids, or (command, protocol) tuples for TEST_PROGRAM
+            verbose (bool): whether to print out the device callbacks
 
         Returns:
-            message: formatted message to be sent
-
+            responses (list): response dicts, in the same order as commands; empty for a response that could not be formatted
         """
-        bin32 = lambda x : ''.join(reversed( [str((x >> i) & 1) for i in range(32)] ))
+        commands = [c if isinstance(c,tuple) else (c, None) for c in commands]
+        with self._lock:
+            if self._in_flight:
+                raise ValueError('{} commands sent with send() are still waiting for a response, collect them with receive() first'.format(len(self._in_flight)))
+            for command, protocol in commands:
+                self.send(command, protocol)
+            responses = [self.receive(verbose=verbose) for _ in commands]
+            # send a command whose response could not be formatted once more if it is safe to repeat (see
+            # RESENDABLE); any other command may have run, so its empty response is returned as is
+            for i, (command, protocol) in enumerate(commands):
+                if not responses[i] and self._command_id(command) in self.RESENDABLE:
+                    self.send(command, protocol)
+                    responses[i] = self.receive(verbose=verbose)
+        return responses
+
+    def call(self, command, protocol=None, reuse_socket=None, verbose = False):
+        """
+        Send command to device and wait for its response.
 
-        curtime = bin32(int(time.time()))
-        timelist = []
-        for i in range(1,5):
-            timelist.append(int(curtime[(i-1)*8:i*8],2))
-        timelist.reverse()
+        Args:
+            command (str/int): command name or command_id number to send to device
+            protocol (str/int): protocol number on device to issue command to (only needed for command TEST_PROGRAM)
+            reuse_socket (bool): send on the open connection instead of a new one; default is the value given to the constructor
+            verbose (bool): whether to print out the device callback
 
-        cmd = [command]
+        Returns:
+            response (dict): response from Medoc system
+        """
+        with self._lock:
+            if reuse_socket is False and not self._in_flight:
+                self.close()
+            return self.call_many([(command, protocol)], verbose=verbose)[-1]
 
-        protocollist = []
-        if command==1 and protocol:
-            protocol = bin32(protocol)
-            for i in range(1,5):
-                protocollist.append(int(protocol[(i-1)*8:i*8],2))
-            protocollist.reverse()
+    def _format_command(self, command, protocol):
+        """
+        Format calls to device.
 
-        MESSAGE =  timelist + cmd + protocollist # first should be time
+        Args:
+            command (str/int): command name or command_id number to send to device
+            protocol (int): protocol number on device to issue command to (only needed for command TEST_PROGRAM)
 
-        sizelist = []
-        size = bin32(len(MESSAGE))
-        for i in range(1,5):
-            sizelist.append(int(size[(i-1)*8:i*8],2))
-        sizelist.reverse()
+        Returns:
+            message (bytes): formatted message to be sent
 
-        MESSAGE = np.array(sizelist + MESSAGE)
-        MESSAGE = np.getbuffer(MESSAGE.astype(np.uint8),size=len(MESSAGE))
-        return MESSAGE
+        """
+        if command==1 and protocol is not None:
+            return self.PROGRAM_COMMAND.pack(self.PROGRAM_COMMAND.size - self.HEADER.size, int(time.time()), command, int(protocol))
+        return self.COMMAND.pack(self.COMMAND.size - self.HEADER.size, int(time.time()), command)
 
     def _format_response(self, data, nbytes):
         """
@@ -185,52 +295,60 @@ class Pathway(object):
         Note: Test time is the time since machine was turned on.
 
         Args:
-            data: data bytes from devices
+            data (bytes/memoryview): data bytes from devices, starting at the length header
             nbytes: length of bytes from devices
 
         Returns:
             response (dict): dictionary of response data
 
         """
-        data_int = [int(elem.encode('hex'),16) for elem in data]
-
         response_dict = {}
         try:
-            response_dict['response_length'] = self._decode(data_int,'LENGTH_OFFSET')
-            response_dict['time_stamp'] = time.ctime(self._decode(data_int,'TIMESTAMP_OFFSET'))
-            response_dict['command_id'] = self.command_codes[data_int[self.segmentation_points['COMMAND_OFFSET']]]
-            response_dict['pathway_state'] = self.state_codes[data_int[self.segmentation_points['SYSTEM_STATE_OFFSET']]]
-            response_dict['test_state'] = self.test_states[data_int[self.segmentation_points['TEST_STATE_OFFSET']]]
-            response_dict['response'] =  self.response_codes[self._decode(data_int,'RESULT_OFFSET')]
-            response_dict['test_time_stamp'] = self._decode_test_time(data_int)
-
-            if response_dict['response_length'] > 13:
-                #Covert to uint8 and native?
-                response_dict['error_message'] = data[self.segmentation_points['ERROR_MESSAGE_OFFSET']]
+            length, time_stamp, command, state, test_state, result, test_time = self.RESPONSE.unpack_from(data)
+            response_dict['response_length'] = length
+            response_dict['time_stamp'] = time.ctime(time_stamp)
+            response_dict['command_id'] = self.command_codes[command]
+            response_dict['pathway_state'] = self.state_codes[state]
+            response_dict['test_state'] = self.test_states[test_state]
+            response_dict['response'] =  self.response_codes[result]
+            response_dict['test_time_stamp'] = self._decode_test_time(test_time)
+
+            if length > self.RESPONSE.size - self.HEADER.size:
+                start = self.segmentation_points['ERROR_MESSAGE_OFFSET']
+                response_dict['error_message'] = bytes(data[start:self.HEADER.size + length]).decode('utf-8', 'replace')
         except Exception as e:
             print("ERROR FORMATTING RESPONSE")
-            print("data_int: ", data_int)
-            print("data: ", data)
+            print("data: ", bytes(data))
             print("nbyes: ", nbytes)
+            return {}
         return response_dict
 
-    def _decode(self,data_int,whichtime):
+    def decode_responses(self, data):
         """
-        Helper function to decode response.
+        Decode every complete response in a buffer of concatenated responses, e.g. everything returned by one recv.
+
+        Args:
+            data (bytes/bytearray/memoryview): raw bytes from device
+
+        Returns:
+            responses (list): response dicts, in order
+            nbytes (int): number of bytes used; anything after that is an incomplete response
         """
-        bin8 = lambda x : ''.join(reversed( [str((x >> i) & 1) for i in range(8)] ))
-        dat_int = data_int[self.segmentation_points[whichtime][0]:self.segmentation_points[whichtime][1]]
-        dat_bin = [bin8(dat_int[i])for i in range(0,self.segmentation_points[whichtime][1]-self.segmentation_points[whichtime][0])]
-        dat_bin.reverse()
-        dat_bin = "".join(dat_bin)
-        return int(dat_bin,2)
-
-    def _decode_test_time(self,data_int):
+        view = memoryview(data)
+        responses = []
+        offset = 0
+        while len(view) - offset >= self.HEADER.size:
+            end = offset + self.HEADER.size + self.HEADER.unpack_from(view, offset)[0]
+            if end > len(view):
+                break
+            responses.append(self._format_response(view[offset:end], end - offset))
+            offset = end
+        return responses, offset
+
+    def _decode_test_time(self,test_time):
         """
-        Helper function to decode response time.
+        Helper function to format the response test time (ms) as hh:mm:ss.ms
         """
-        test_time = self._decode(data_int,'TEST_TIME_OFFSET')
-
         hours = test_time//3600000
         mins = (test_time-(hours*3600000))//60000
         secs = (test_time-(hours*3600000)-(mins*60000))//1000
@@ -238,18 +356,21 @@ class Pathway(object):
         test_time = '%.2d:%.2d:%.2d.%3d' %(hours,mins,secs,msecs)
         return test_time
 
-    def poll_for_change(self,to_watch,desired_value,poll_interval=.5,poll_max=-1,verbose=False,server_lag=1.,reuse_socket=False):
+    def poll_for_change(self,to_watch,desired_value,poll_interval=.5,poll_max=-1,verbose=False,server_lag=0.,reuse_socket=None,min_interval=.02,backoff=1.5):
         """
         Poll system for a value change. Useful for waiting until the Medoc system has transitioned to a specific state in order to issue another command, but the transition length is unknowable.
+        Polling starts every min_interval and backs off towards poll_interval while the value stays the same. For waiting without blocking, use a StatusWatcher.
 
         Args:
             to_watch (str): the response field we should be monitoring; most often 'test_state' or 'pathway_state'
             desired_value (str): the desired value of the field to wait on, i.e. keep checking until response_field has this value
-            poll_interval (float): how often to poll; default .5s
+            poll_interval (float): longest time between polls; default .5s
             poll_max (int): upper limit on polling attempts; default -1 (unlimited)
             verbose (bool): print poll attempt number and current state
-            server_lag (float): sometimes if the socket connection is pinged too quickly after a value change the subsequent command after this method is called can get missed. This adds an additional layer of timing delay before returning from this method to prevent this; default 1s
-            reuse_socket (bool): try to reuse the last created socket connection; *NOT CURRENTLY FUNCTIONAL*
+            server_lag (float): sometimes if the socket connection is pinged too quickly after a value change the subsequent command after this method is called can get missed. This adds an additional layer of timing delay before returning from this method to prevent this; default 0s
+            reuse_socket (bool): poll on the open connection instead of a new one each time; default is the value given to the constructor
+            min_interval (float): time between the first polls; default .02s
+            backoff (float): factor the time between polls grows by after each unchanged poll; default 1.5
 
         Returns:
             status (bool): whether desired_value was achieved
@@ -257,22 +378,27 @@ class Pathway(object):
         """
         val = ''
         count = 1
-        while val != desired_value:
+        interval = min(min_interval, poll_interval)
+        while True:
             if verbose:
                 print("Poll: {}".format(str(count)))
-            resp = self.call('STATUS',reuse_socket=False)
+            resp = self.call('STATUS',reuse_socket=reuse_socket)
             if resp:
                 val = resp[to_watch]
             else:
                 val = 'RESPONSE_FORMAT_ERROR'
             if verbose:
                 print("Current value: {}".format(val))
-            time.sleep(poll_interval)
+            if val == desired_value:
+                break
             count += 1
             if poll_max > 0 and count > poll_max:
                 print("Polling limit exceeded")
                 return False
-        time.sleep(server_lag)
+            time.sleep(interval)
+            interval = min(interval * backoff, poll_interval)
+        if server_lag > 0:
+            time.sleep(server_lag)
         return True
 
     #Convenience wrappers around call method
@@ -312,3 +438,370 @@ class Pathway(object):
     def no(self):
         """ Convenience method."""
         return self.call('NO')
+
+
+class PathwayFuture(object):
+
+    """
+    The pending result of a Pathway operation. Wait on it with result() or register add_done_callback().
+
+    Attributes:
+        response (dict): response from Medoc system
+        error (Exception): exception raised while waiting for the response, if any
+
+    """
+
+    def __init__(self):
+        self.response = None
+        self.error = None
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        """ Whether the response (or an error) has arrived."""
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Block until the response arrives.
+
+        Args:
+            timeout (float): seconds to wait; default None (forever)
+
+        Returns:
+            response (dict): response from Medoc system
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError('Timed out waiting for {}'.format(self))
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+    def add_done_callback(self, fn):
+        """ Call fn(future) from the background thread once the response arrives, or right away if it already has."""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _finish(self, response=None, error=None):
+        with self._lock:
+            self.response = response
+            self.error = error
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as e:
+                print("ERROR IN PATHWAY CALLBACK: ", e)
+
+
+class PathwayCommand(PathwayFuture):
+
+    """
+    A command queued on an AsyncPathway.
+
+    Attributes:
+        command (str/int): command name or command_id number
+        protocol (int): protocol number (only for TEST_PROGRAM)
+        due_time (float): clock time at which the command should be sent
+        queued_time (float): clock time when the command was queued
+        sent_time (float): clock time when the command was sent to the device
+        ack_time (float): clock time when the response arrived
+
+    """
+
+    def __init__(self, command, protocol, due_time, queued_time):
+        PathwayFuture.__init__(self)
+        self.command = command
+        self.protocol = protocol
+        self.due_time = due_time
+        self.queued_time = queued_time
+        self.sent_time = None
+        self.ack_time = None
+
+    def __repr__(self):
+        return '<PathwayCommand {}>'.format(self.command)
+
+
+class AsyncPathway(object):
+
+    """
+    AsyncPathway sends commands to a Pathway from a background thread, so the caller (e.g. a render loop) never blocks on the network. Commands are sent in the order they are queued; a command with a delay holds back the ones queued after it.
+
+    Args:
+        pathway (Pathway): connected Pathway to send commands through; only the worker thread uses it after this
+        clock (callable): returns the current time in seconds, used for delays and timestamps; default time.time
+
+    """
+
+    def __init__(self, pathway, clock=time.time):
+        self.pathway = pathway
+        self.clock = clock
+        self.history = []
+        self._queue = queue.Queue()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='AsyncPathway')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, command, protocol=None, delay=0., callback=None):
+        """
+        Queue a command and return immediately.
+
+        Args:
+            command (str/int): command name or command_id number to send to device
+            protocol (str/int): protocol number on device to issue command to (only needed for command TEST_PROGRAM)
+            delay (float): seconds from now before the command may be sent; default 0
+            callback (callable): called with the PathwayCommand once the response arrives
+
+        Returns:
+            command (PathwayCommand): handle to wait on or inspect timestamps
+        """
+        if self._stopping.is_set():
+            raise RuntimeError('AsyncPathway is closed')
+        now = self.clock()
+        cmd = PathwayCommand(command, protocol, now + delay, now)
+        if callback is not None:
+            cmd.add_done_callback(callback)
+        self._queue.put(cmd)
+        return cmd
+
+    def _run(self):
+        while True:
+            cmd = self._queue.get()
+            if cmd is None:
+                break
+            wait = cmd.due_time - self.clock()
+            if wait > 0 and self._stopping.wait(wait):
+                cmd._finish(error=RuntimeError('AsyncPathway closed before {} was sent'.format(cmd.command)))
+                continue
+            cmd.sent_time = self.clock()
+            try:
+                response = self.pathway.call(cmd.command, protocol=cmd.protocol)
+            except Exception as e:
+                cmd.ack_time = self.clock()
+                self.history.append(cmd)
+                cmd._finish(error=e)
+                continue
+            cmd.ack_time = self.clock()
+            self.history.append(cmd)
+            cmd._finish(response=response)
+
+    def pending(self):
+        """ Number of commands queued but not yet sent."""
+        return self._queue.qsize()
+
+    def close(self, wait=True):
+        """
+        Stop the worker thread.
+
+        Args:
+            wait (bool): send everything already queued first, including delayed commands; if False, delayed commands not yet due are dropped; default True
+        """
+        if not wait:
+            self._stopping.set()
+        self._queue.put(None)
+        self._thread.join()
+        self._stopping.set()
+
+    #Convenience wrappers around submit method
+
+    def status(self, delay=0., callback=None):
+        """ Convenience method."""
+        return self.submit('STATUS', delay=delay, callback=callback)
+
+    def program(self, protocol, delay=0., callback=None):
+        """ Convenience method."""
+        return self.submit('TEST_PROGRAM', protocol=protocol, delay=delay, callback=callback)
+
+    def start(self, delay=0., callback=None):
+        """ Convenience method."""
+        return self.submit('START', delay=delay, callback=callback)
+
+    def pause(self, delay=0., callback=None):
+        """ Convenience method."""
+        return self.submit('PAUSE', delay=delay, callback=callback)
+
+    def trigger(self, delay=0., callback=None):
+        """ Convenience method."""
+        return self.submit('TRIGGER', delay=delay, callback=callback)
+
+    def stop(self, delay=0., callback=None):
+        """ Convenience method."""
+        return self.submit('STOP', delay=delay, callback=callback)
+
+    def abort(self, delay=0., callback=None):
+        """ Convenience method."""
+        return self.submit('ABORT', delay=delay, callback=callback)
+
+
+class StateWait(PathwayFuture):
+
+    """
+    A StatusWatcher wait for a response field to reach a value.
+
+    Attributes:
+        field (str): response field being watched, e.g. 'test_state'
+        value (str): value being waited for, e.g. 'RUNNING'
+        since (float): clock time the latency is measured from
+        expected_time (float): clock time the transition is expected around, if known
+        deadline (float): clock time after which the wait gives up, if any
+        met_time (float): clock time the value was first seen
+
+    """
+
+    def __init__(self, field, value, since, expected_time, deadline=None):
+        PathwayFuture.__init__(self)
+        self.deadline = deadline
+        self.field = field
+        self.value = value
+        self.since = since
+        self.expected_time = expected_time
+        self.met_time = None
+
+    def __repr__(self):
+        return '<StateWait {} == {}>'.format(self.field, self.value)
+
+
+class StatusWatcher(object):
+
+    """
+    StatusWatcher polls a Pathway for STATUS from a background thread on the Pathway's open connection and hands out waitable futures for state changes. Polling is fast while someone is waiting (fastest near an expected transition) and backs off while idle.
+    The time each wait took and how long the device stayed in each state are kept per transition, see latency_histogram().
+
+    Args:
+        pathway (Pathway): connected Pathway; calls are serialized with any other thread using it (e.g. an AsyncPathway)
+        min_interval (float): time between polls while waiting; default .02s
+        max_interval (float): longest time between polls, used while idle; default 1s
+        backoff (float): factor the time between polls grows by after each poll with no change; default 1.5
+        clock (callable): returns the current time in seconds; default time.time
+
+    """
+
+    FIELDS = ('pathway_state', 'test_state')
+
+    def __init__(self, pathway, min_interval=.02, max_interval=1., backoff=1.5, clock=time.time):
+        self.pathway = pathway
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.clock = clock
+        self.last_status = {}
+        self.last_change = {}  # field -> clock time the current value was first seen
+        self.wait_latencies = {}  # (field, value) -> seconds from since until the value was seen
+        self.dwell_times = {}  # (field, old value, new value) -> seconds spent in the old value
+        self.polls = 0
+        self._waits = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='StatusWatcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def wait_for(self, field, value, since=None, expected_in=None, timeout=None, callback=None):
+        """
+        Get a future that finishes once a response field has a value, e.g. wait_for('test_state', 'RUNNING').
+
+        Args:
+            field (str): the response field to watch; most often 'test_state' or 'pathway_state'
+            value (str): the value to wait for
+            since (float): clock time to measure the wait latency from, e.g. when START was sent; statuses polled before it don't count; default now
+            expected_in (float): seconds from now the change is expected; polling stays slow until it gets close
+            timeout (float): seconds after which the wait gives up with an error; default None (never)
+            callback (callable): called with the StateWait once the value is seen
+
+        Returns:
+            wait (StateWait): future whose result() is the STATUS response that had the value
+        """
+        now = self.clock()
+        wait = StateWait(field, value, now if since is None else since,
+                         None if expected_in is None else now + expected_in,
+                         None if timeout is None else now + timeout)
+        if callback is not None:
+            wait.add_done_callback(callback)
+        with self._lock:
+            self._waits.append(wait)
+        self._wake.set()  # poll right away rather than trusting an old status
+        return wait
+
+    def _next_interval(self, interval):
+        # fast while someone waits, slower while idle, slow until close to an expected transition
+        if not self._waits:
+            return min(interval * self.backoff, self.max_interval)
+        expected = [w.expected_time for w in self._waits if w.expected_time is not None]
+        if len(expected) == len(self._waits):
+            until = min(expected) - self.clock()
+            if until > self.min_interval:
+                return min(until / 2., self.max_interval)
+        return self.min_interval
+
+    def _run(self):
+        interval = self.min_interval
+        while not self._stopping:
+            polled = self.clock()
+            try:
+                response = self.pathway.call('STATUS')
+            except Exception as e:
+                response = None
+                print("ERROR POLLING PATHWAY STATUS: ", e)
+            now = self.clock()
+            self.polls += 1
+            changed = False
+            if response:
+                with self._lock:
+                    for field in self.FIELDS:
+                        old = self.last_status.get(field)
+                        if response[field] != old:
+                            changed = True
+                            if old is not None:
+                                self.dwell_times.setdefault((field, old, response[field]), []).append(now - self.last_change[field])
+                            self.last_change[field] = now
+                    self.last_status = response
+                    # a status polled before a wait's since (e.g. before START was sent) can be left from before
+                    met = [w for w in self._waits if response.get(w.field) == w.value and polled >= w.since]
+                    self._waits = [w for w in self._waits if w not in met]
+                for wait in met:
+                    wait.met_time = now
+                    self.wait_latencies.setdefault((wait.field, wait.value), []).append(now - wait.since)
+                    wait._finish(response=response)
+            with self._lock:
+                expired = [w for w in self._waits if w.deadline is not None and now >= w.deadline]
+                self._waits = [w for w in self._waits if w not in expired]
+            for wait in expired:
+                wait._finish(error=RuntimeError('Timed out waiting for {}'.format(wait)))
+            interval = self.min_interval if changed else self._next_interval(interval)
+            self._wake.wait(interval)
+            self._wake.clear()
+
+    def latency_histogram(self, key, bin_width=.05):
+        """
+        Histogram of the latencies recorded for a transition.
+
+        Args:
+            key (tuple): (field, value) for wait latencies, or (field, old value, new value) for time spent in the old value
+            bin_width (float): histogram bin width in seconds; default .05s
+
+        Returns:
+            histogram (OrderedDict): bin start (s) -> count
+        """
+        latencies = self.wait_latencies.get(key, []) if len(key) == 2 else self.dwell_times.get(key, [])
+        histogram = OrderedDict()
+        for latency in sorted(latencies):
+            bin_start = round(bin_width * (latency // bin_width), 6)
+            histogram[bin_start] = histogram.get(bin_start, 0) + 1
+        return histogram
+
+    def close(self):
+        """ Stop polling. Waits that have not finished get an error."""
+        self._stopping = True
+        self._wake.set()
+        self._thread.join()
+        with self._lock:
+            waits, self._waits = self._waits, []
+        for wait in waits:
+            wait._finish(error=RuntimeError('StatusWatcher closed before {} was seen'.format(wait)))
@@ -12,6 +12,8 @@ import time
 import subprocess
 import json
 import signal
+import threading
+from collections import deque
 from weakref import proxy
 
 import psutil
@@ -58,8 +60,14 @@ class DeviceRPC(object):
     def __call__(self, *args, **kwargs):
         # Send the device method call request to the ioHub Server and wait
         # for the method return value sent back from the ioHub Server.
-        r = self.sendToHub(('EXP_DEVICE', 'DEV_RPC', self.device_class,
-                            self.method_name, args, kwargs))
+        r = self.sendToHub(self._request(args, kwargs))
+        return self._processReply(r, kwargs)
+
+    def _request(self, args, kwargs):
+        return ('EXP_DEVICE', 'DEV_RPC', self.device_class,
+                self.method_name, args, kwargs)
+
+    def _processReply(self, r, kwargs):
         try:
             r = r[1:]
             if len(r) == 1:
@@ -224,6 +232,104 @@ class ioHubDevices(object):
     def getNames(self):
         return self._devicesByName.keys()
 
+class ioHubBatch(object):
+    """
+    Collects several ioHub Server requests and sends them as one BATCH
+    request, so they cost a single round trip instead of one each. The
+    server handles the requests in the order they were added.
+
+    Created by ioHubConnection.batch(); use it as a context manager::
+
+        with io.batch() as batch:
+            batch.add(io.getEvents)
+            batch.add(io.sendMessageEvent, 'frame start')
+            batch.add(io.devices.mouse.getPosition)
+        events, _, mouse_pos = batch.results
+
+    Requests can be added with add(), passing an ioHub device method
+    (e.g. io.devices.mouse.getPosition) or the getEvents / sendMessageEvent
+    methods of the ioHubConnection, followed by the arguments for the call.
+    Their return values are in the results list, in the order they were
+    added, once send() has been called (when the with block ends).
+    """
+    def __init__(self, hubClient):
+        self.hubClient = hubClient
+        self.results = None
+        self._requests = []
+        self._handlers = []
+
+    def add(self, method, *args, **kwargs):
+        """Add a call of method(*args, **kwargs) to the batch and return its
+        index in the results list."""
+        if isinstance(method, DeviceRPC):
+            self._requests.append(method._request(args, kwargs))
+            self._handlers.append(lambda r: method._processReply(r, kwargs))
+        elif getattr(method, '__self__', None) is self.hubClient and \
+                method.__name__ in ('getEvents', 'sendMessageEvent'):
+            getattr(self, '_add_' + method.__name__)(*args, **kwargs)
+        else:
+            raise ValueError('ioHubBatch.add() takes an ioHub device method, '
+                             'getEvents or sendMessageEvent, not '
+                             '{}.'.format(method))
+        return len(self._handlers) - 1
+
+    def _add_getEvents(self, device_label=None, as_type='namedtuple'):
+        hub = self.hubClient
+        if device_label is not None:
+            raise ValueError('Use the device getEvents method to add the '
+                             'events of one device to a batch.')
+        if hub._event_rings is not None or hub._push_covers_all:
+            # no request needed: read from shared memory or the pushed
+            # events when the batch is sent
+            self._requests.append(None)
+            self._handlers.append(lambda r: hub.getEvents(as_type=as_type))
+            return
+        self._requests.append(('GET_EVENTS',))
+        self._handlers.append(
+            lambda r: hub._convertEvents(
+                hub._takeEvents(hub._takePushedEvents(r[1])), as_type))
+
+    def _add_sendMessageEvent(self, text, category='', offset=0.0,
+                              sec_time=None):
+        msg_evt = MessageEvent._createAsList(text, category=category,
+                                             msg_offset=offset,
+                                             sec_time=sec_time)
+        self._requests.append(('EXP_DEVICE', 'EVENT_TX', [msg_evt, ]))
+        self._handlers.append(lambda r: True)
+
+    def send(self):
+        """Send the batch and return the list of results."""
+        requests = [r for r in self._requests if r is not None]
+        replies = []
+        if requests:
+            replies = self.hubClient._sendToHubServer(('BATCH', requests))[1]
+            if replies is None or len(replies) != len(requests):
+                raise ioHubError('Invalid BATCH reply from ioHub Server.',
+                                 replies)
+        replies = iter(replies)
+        self.results = []
+        for request, handler in zip(self._requests, self._handlers):
+            reply = None
+            if request is not None:
+                reply = next(replies)
+                if isinstance(reply, list):
+                    reply = self.hubClient._decodeReply(reply)
+                if ioHubConnection._isErrorReply(reply):
+                    raise ioHubError(reply)
+            self.results.append(handler(reply))
+        self._requests = []
+        self._handlers = []
+        return self.results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+        return False
+
+
 class ioHubConnection(object):
     """ioHubConnection is responsible for creating, sending requests to, and
     reading replies from the ioHub Process. This class is also used to
@@ -268,7 +374,18 @@ class ioHubConnection(object):
         Computer.psychopy_process = psutil.Process()
 
         # udp port setup
-        self.udp_client = None
+        self.udp_client = None # connection to the server, whatever the transport
+        # shared memory event rings, when shared_memory_events is enabled
+        self._event_rings = None
+        self._buffered_events = 0
+
+        # event subscription (see subscribe())
+        self._push_client = None
+        self._push_thread = None
+        self._push_callback = None
+        self._push_covers_all = False
+        self._pushed_events = deque()
+        self.pushed_messages_lost = 0
 
         # the dynamically generated object that contains an attribute for
         # each device registered for monitoring with the ioHub server so
@@ -337,6 +454,15 @@ class ioHubConnection(object):
         When events are retrieved from an event buffer, they are removed from
         that buffer as well.
 
+        If the ioHub Server was started with shared_memory_events: True, the
+        events are read from the shared memory event rings instead of being
+        requested over UDP (see getEventArrays()). The server writes events
+        of polled devices to the rings after each poll and any other events
+        every windows_msgpump_interval (1 msec by default), rather than when
+        getEvents() is called, so an event that arrived just before the call
+        may only be returned by the next one. Events pushed by the server
+        since subscribe() was called are included as well.
+
         If events are only needed from one device instead of all devices,
         providing a valid device name as the device_label argument will
         result in only events from that device being returned.
@@ -363,16 +489,28 @@ class ioHubConnection(object):
         """
         r = None
         if device_label is None:
-            events = self._sendToHubServer(('GET_EVENTS',))[1]
-            if events is None:
-                r = self.allEvents
-            else:
-                self.allEvents.extend(events)
-                r = self.allEvents
-            self.allEvents = []
+            events = None
+            if not self._push_covers_all:
+                if self._event_rings is not None:
+                    events = self._getRingEvents()
+                else:
+                    events = self._sendToHubServer(('GET_EVENTS',))[1]
+            events = self._takePushedEvents(events)
+            r = self._takeEvents(events)
         else:
             r = self.devices.getDevice(device_label).getEvents()
+        return self._convertEvents(r, as_type)
+
+    def _takeEvents(self, events):
+        """Return the events buffered during wait() followed by events,
+        emptying the buffer."""
+        if events:
+            self.allEvents.extend(events)
+        r = self.allEvents
+        self.allEvents = []
+        return r
 
+    def _convertEvents(self, r, as_type):
         if r:
             if as_type == 'list':
                 return r
@@ -391,6 +529,109 @@ class ioHubConnection(object):
 
         return []
 
+    def batch(self, calls=None):
+        """Send several requests to the ioHub Server in one message.
+
+        With no arguments, returns an ioHubBatch to be used as a context
+        manager; the requests added to it are sent when the with block ends
+        and their return values are in its results attribute.
+
+        calls can instead be a list of (method, arg1, arg2, ...) tuples, in
+        which case the requests are sent right away. Each method is an ioHub
+        device method (e.g. io.devices.mouse.getPosition), or this
+        connection's getEvents or sendMessageEvent method.
+
+        Args:
+            calls (list): Optional (method, args...) tuples.
+
+        Returns:
+            ioHubBatch if calls is None, else the list of return values of
+            the calls, in order.
+        """
+        batch = ioHubBatch(self)
+        if calls is None:
+            return batch
+        for call in calls:
+            batch.add(*call)
+        return batch.send()
+
+    def getEventArrays(self):
+        """Retrieve the events written to the shared memory event rings since
+        the last call to getEvents(), getEventArrays() or clearEvents(),
+        without converting them to lists.
+
+        Only available when the ioHub Server was started with
+        shared_memory_events: True.
+
+        Returns:
+            dict: event type name -> numpy structured array of the events of
+                  that type (dtype is the event class's NUMPY_DTYPE), oldest
+                  first. Event types with no new events are left out.
+        """
+        if self._event_rings is None:
+            raise ioHubError('getEventArrays() requires the '
+                             'shared_memory_events ioHub setting.')
+        return {EventConstants.getName(etype): events
+                for etype, events in self._event_rings.read().items()}
+
+    def subscribe(self, device_labels=None, event_types=None, callback=None):
+        """Ask the ioHub Server to push events to this process as they are
+        processed, instead of waiting for getEvents() to request them. This
+        removes the up to one polling interval delay between an event and
+        the script seeing it, and the request traffic while idle.
+
+        Pushed events are received by a background thread. If a callback is
+        given, it is called from that thread with each list of events (as
+        namedtuples); otherwise the events are returned by the next
+        getEvents() call.
+
+        Each push message has a sequence number; when one is missing, the
+        thread asks the server to send it again. Messages the server no
+        longer has are counted in pushed_messages_lost.
+
+        Calling subscribe() again replaces the current subscription.
+
+        Args:
+            device_labels (list): Names of the devices to receive events
+                                  from. None (the default) with no
+                                  event_types means all devices.
+            event_types (list): EventConstants ids or names of the event
+                                types to receive, in addition to those of
+                                device_labels.
+            callback (callable): Optional function to receive the events.
+
+        Returns:
+            list: The subscribed event type ids.
+        """
+        self.unsubscribe()
+        if event_types is not None:
+            event_types = [EventConstants.getID(t) if isinstance(t, basestring)
+                           else t for t in event_types]
+
+        from ..net import createClientConnection
+        push_client = createClientConnection(self._iohub_server_config)
+        push_client.sendTo(('SUBSCRIPTION', 'ADD', device_labels,
+                            event_types))
+        r = push_client.receive()
+        if not r or self._isErrorReply(r[0]):
+            push_client.close()
+            raise ioHubError('ioHub Server did not accept the subscription.',
+                             r)
+        etypes = r[0][1]
+
+        self._push_client = push_client
+        self._push_callback = callback
+        self._push_covers_all = device_labels is None and event_types is None
+        self._push_thread = threading.Thread(target=self._receivePushedEvents,
+                                             name='ioHubEventSubscription')
+        self._push_thread.daemon = True
+        self._push_thread.start()
+        return etypes
+
+    def unsubscribe(self):
+        """Stop the event subscription started by subscribe(), if any."""
+        self._stopSubscription(notify_server=True)
+
     def clearEvents(self, device_label='all'):
         """Clears unread events from the ioHub Server's Event Buffer(s)
         so that unneeded events are not discarded.
@@ -417,6 +658,8 @@ class ioHubConnection(object):
         if device_label.lower() == 'all':
             self.allEvents = []
             self._sendToHubServer(('RPC', 'clearEventBuffer', [True, ]))
+            self._skipRingEvents()
+            self._pushed_events.clear()
             try:
                 self.getDevice('keyboard')._clearLocalEvents()
             except:
@@ -424,6 +667,8 @@ class ioHubConnection(object):
         elif device_label in [None, '', False]:
             self.allEvents = []
             self._sendToHubServer(('RPC', 'clearEventBuffer', [False, ]))
+            self._skipRingEvents()
+            self._pushed_events.clear()
             try:
                 self.getDevice('keyboard')._clearLocalEvents()
             except:
@@ -901,12 +1146,18 @@ class ioHubConnection(object):
 
         self._iohub_server_config = ioHubConfig
 
-        # >>>>> Create open UDP port to ioHub Server
-
-        server_udp_port = self._iohub_server_config.get('udp_port', 9000)
-        from ..net import UDPClientConnection
-        self.udp_client = UDPClientConnection(remote_port=server_udp_port)
-        # <<<<< Done Creating open UDP port to ioHub Server
+        # >>>>> Create connection to ioHub Server
+        # (with a unix transport, the connection is made in
+        # _waitForServerInit, once the server has created its socket)
+        from ..net import createClientConnection, localSocketPath
+        transport = self._iohub_server_config.get('transport', 'udp')
+        if transport == 'udp':
+            self.udp_client = createClientConnection(self._iohub_server_config)
+        else:
+            server_socket_path = localSocketPath(self._iohub_server_config)
+            if os.path.exists(server_socket_path):
+                os.remove(server_socket_path)
+        # <<<<< Done Creating connection to ioHub Server
 
         # >>>> Check for orphaned ioHub Process and kill if found...
         iopFileName = os.path.join(rootScriptPath, '.iohpid')
@@ -1010,8 +1261,126 @@ class ioHubConnection(object):
         # >>>> Creating client side iohub device wrappers...
         self._createDeviceList(ioHubConfig['monitor_devices'])
 
+        # >>>> Attach to the shared memory event rings, if enabled...
+        if self._iohub_server_config.get('shared_memory_events', False):
+            self._attachEventRings()
+
         return 'OK'
 
+    def _attachEventRings(self):
+        """Attach to the event rings the ioHub Server writes events to."""
+        from ..eventrings import EventRingReader, sessionRingPath
+        ring_path = sessionRingPath(Computer.current_process.pid,
+                                    self._iohub_server_config.get('udp_port',
+                                                                  9000))
+
+        def getDtype(etype):
+            return EventConstants.getClass(etype).NUMPY_DTYPE
+
+        try:
+            self._event_rings = EventRingReader(ring_path, getDtype)
+        except Exception: # pylint: disable=broad-except
+            print2err('Could not attach to shared memory event rings at ',
+                      ring_path, '; using UDP for events.')
+            printExceptionDetailsToStdErr()
+            self._event_rings = None
+
+    def _getRingEvents(self):
+        """Events from the shared memory rings as event lists, sorted by
+        hub time, plus any the server had to keep in its global buffer."""
+        events = []
+        for etype, records in self._event_rings.read().items():
+            text_fields = [i for i, n in enumerate(records.dtype.names)
+                           if records.dtype[n].kind == 'S']
+            for record in records.tolist():
+                record = list(record)
+                for i in text_fields:
+                    record[i] = record[i].decode('utf-8', 'replace')
+                events.append(record)
+
+        buffered = self._event_rings.buffered()
+        if buffered != self._buffered_events:
+            self._buffered_events = buffered
+            udp_events = self._sendToHubServer(('GET_EVENTS',))[1]
+            if udp_events:
+                events.extend(udp_events)
+
+        if not events:
+            return None
+        events.sort(key=lambda e: e[DeviceEvent.EVENT_HUB_TIME_INDEX])
+        return events
+
+    def _receivePushedEvents(self):
+        """Subscription thread: receive push messages in sequence order,
+        asking the server to resend any that are missing."""
+        push_client = self._push_client
+        held = {}
+        expected = 1
+        last_resend = 0.0
+        while self._push_client is push_client:
+            r = push_client.receive()
+            if not r or not isinstance(r[0], list) or len(r[0]) != 3:
+                # the receive timed out: if the RESEND request (or what it
+                # resent) was lost, no newer push may come to ask again
+                if held and Computer.getTime() - last_resend > 0.05:
+                    push_client.sendTo(('SUBSCRIPTION', 'RESEND', expected))
+                    last_resend = Computer.getTime()
+                continue
+            _, seq, events = r[0]
+            if seq < expected:
+                continue # already received; sent again after a resend
+            held[seq] = events
+            if seq > expected and Computer.getTime() - last_resend > 0.05:
+                push_client.sendTo(('SUBSCRIPTION', 'RESEND', expected))
+                last_resend = Computer.getTime()
+            while expected in held:
+                events = held.pop(expected)
+                if events is None:
+                    self.pushed_messages_lost += 1
+                elif self._push_callback:
+                    try:
+                        self._push_callback([self.eventListToNamedTuple(e)
+                                             for e in events])
+                    except Exception: # pylint: disable=broad-except
+                        print2err('Error in event subscription callback:')
+                        printExceptionDetailsToStdErr()
+                else:
+                    self._pushed_events.extend(events)
+                expected += 1
+
+    def _takePushedEvents(self, events):
+        """Add the events pushed since the last call to events (which may be
+        None), sorted by hub time."""
+        if not self._pushed_events:
+            return events
+        pushed = []
+        while self._pushed_events:
+            pushed.append(self._pushed_events.popleft())
+        if events:
+            pushed.extend(events)
+        pushed.sort(key=lambda e: e[DeviceEvent.EVENT_HUB_TIME_INDEX])
+        return pushed
+
+    def _stopSubscription(self, notify_server=True):
+        push_client = self._push_client
+        if push_client is None:
+            return
+        self._push_client = None
+        self._push_covers_all = False
+        if self._push_thread:
+            self._push_thread.join()
+            self._push_thread = None
+        try:
+            if notify_server:
+                push_client.sendTo(('SUBSCRIPTION', 'REMOVE'))
+        finally:
+            push_client.close()
+
+    def _skipRingEvents(self):
+        if self._event_rings is not None:
+            self._event_rings.skip()
+            self._buffered_events = self._event_rings.buffered()
+
     def _waitForServerInit(self):
         # >>>> Wait for iohub server ready signal ....
         hubonline = False
@@ -1019,6 +1388,14 @@ class ioHubConnection(object):
         timeout_duration = self._iohub_server_config.get('start_process_timeout', 30.0)
         timeout_time = Computer.getTime() + timeout_duration
         while hubonline is False and Computer.getTime() < timeout_time:
+            if self.udp_client is None:
+                from ..net import createClientConnection
+                try:
+                    self.udp_client = createClientConnection(
+                        self._iohub_server_config)
+                except (IOError, OSError):
+                    time.sleep(0.1)
+                    continue
             r = self._sendToHubServer(['GET_IOHUB_STATUS', ])
             if r:
                 hubonline = r[1] == 'RUNNING'
@@ -1133,6 +1510,11 @@ class ioHubConnection(object):
             raise ioHubError(result)
 
         # Otherwise return the result
+        return self._decodeReply(result)
+
+    @staticmethod
+    def _decodeReply(result):
+        """Convert the bytes values in a reply to str under Python 3."""
         if constants.PY3 and not result is None:
             if isinstance(result, list):
                 for ind, items in enumerate(result):
@@ -1247,6 +1629,10 @@ class ioHubConnection(object):
                 pass
 
             self._shutdown_attempted = True
+            self._stopSubscription(notify_server=False)
+            if self._event_rings is not None:
+                self._event_rings.close()
+                self._event_rings = None
             TimeoutError = psutil.TimeoutExpired
             try:
                 self.udp_client.sendTo(('STOP_IOHUB_SERVER',))
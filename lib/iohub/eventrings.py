@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+# Part of the psychopy.iohub library.
+# Copyright (C) 2012-2016 iSolver Software Solutions
+# Distributed under the terms of the GNU General Public License (GPL).
+"""Shared memory event rings, used to pass device events from the ioHub
+Server to the experiment process without a UDP request per getEvents() call.
+
+The ioHub Server is the only writer. Each event type gets its own ring file,
+holding a small header followed by capacity fixed size records laid out with
+the event class's NUMPY_DTYPE. A record is written into its slot before the
+ring's write_count is incremented, so a reader never needs a lock: it reads
+write_count, copies the records it has not seen yet, then reads write_count
+again and drops any record the writer may have overwritten while it was being
+copied (those are reported as lost, like events that are dropped because the
+reader fell more than capacity events behind).
+
+A directory file lists the rings that exist, so a reader only has to check
+one counter to find rings that were added since it last looked. It also
+counts the events the server had to keep in its global event buffer instead
+(events that could not be stored as a record), so the reader knows when a
+GET_EVENTS request is still needed.
+"""
+from __future__ import division, absolute_import
+
+import os
+import mmap
+import tempfile
+
+import numpy as np
+
+MAX_RINGS = 128
+
+# Header at the start of every ring file.
+RING_HEADER_DTYPE = np.dtype([('write_count', '<u8'), ('capacity', '<u8'),
+                              ('event_type', '<u8'), ('itemsize', '<u8')])
+# Directory file: number of rings and of events left in the global event
+# buffer, then one entry per ring.
+DIRECTORY_HEADER_DTYPE = np.dtype([('ring_count', '<u8'),
+                                   ('buffered_count', '<u8')])
+DIRECTORY_ENTRY_DTYPE = np.dtype([('event_type', '<u8'), ('capacity', '<u8'),
+                                  ('itemsize', '<u8')])
+
+
+def defaultRingPath(tag):
+    """Return the base path used for the ring files of one ioHub session.
+
+    /dev/shm is used when it exists so the files are never written to disk;
+    otherwise the system temp folder is used.
+    """
+    folder = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(folder, 'iohub_events_{}'.format(tag))
+
+
+def sessionRingPath(psychopy_pid, udp_port):
+    """Base path of the rings shared by the experiment process psychopy_pid
+    and the ioHub Server listening on udp_port."""
+    return defaultRingPath('{}_{}'.format(psychopy_pid, udp_port))
+
+
+def ringFileName(base_path, event_type):
+    return '{}_{}.ring'.format(base_path, event_type)
+
+
+def _mapFile(file_path, size=None):
+    """Memory map file_path, creating it with size bytes if size is given."""
+    if size is not None:
+        with open(file_path, 'wb') as f:
+            f.truncate(size)
+    with open(file_path, 'r+b') as f:
+        return mmap.mmap(f.fileno(), 0)
+
+
+class EventRing(object):
+    """One single writer / multiple reader ring of event records."""
+
+    def __init__(self, file_path, dtype, capacity=None, event_type=0):
+        self.file_path = file_path
+        self.dtype = np.dtype(dtype)
+        create = capacity is not None
+        if create:
+            size = RING_HEADER_DTYPE.itemsize + capacity * self.dtype.itemsize
+            self._mmap = _mapFile(file_path, size)
+        else:
+            self._mmap = _mapFile(file_path)
+        self.header = np.ndarray((1,), RING_HEADER_DTYPE, self._mmap, 0)[0]
+        if create:
+            self.header['capacity'] = capacity
+            self.header['event_type'] = event_type
+            self.header['itemsize'] = self.dtype.itemsize
+            self.header['write_count'] = 0
+        elif int(self.header['itemsize']) != self.dtype.itemsize:
+            raise ValueError('Event ring {} holds {} byte records, '
+                             'expected {}.'.format(file_path,
+                                                   self.header['itemsize'],
+                                                   self.dtype.itemsize))
+        self.capacity = int(self.header['capacity'])
+        self.event_type = int(self.header['event_type'])
+        self.records = np.ndarray((self.capacity,), self.dtype, self._mmap,
+                                  RING_HEADER_DTYPE.itemsize)
+        self._header_counts = np.ndarray((1,), '<u8', self._mmap, 0)
+        self.read_count = 0
+        self.lost = 0
+
+    # Writer side
+
+    def write(self, event):
+        """Store one event (a list of attribute values) in the next slot."""
+        write_count = int(self._header_counts[0])
+        self.records[write_count % self.capacity] = tuple(event)
+        self._header_counts[0] = write_count + 1
+
+    # Reader side
+
+    def _writeCount(self):
+        return int(self._header_counts[0])
+
+    def pending(self):
+        """Number of events written since the last read()."""
+        return self._writeCount() - self.read_count
+
+    def read(self):
+        """Return the events written since the last read() as a structured
+        array, oldest first. The array is a copy of the shared records, taken
+        with at most two slice copies, so it stays valid after the writer
+        wraps around."""
+        write_count = self._writeCount()
+        start = self.read_count
+        if write_count == start:
+            return self.records[:0].copy()
+        # the slot after the newest record may be being written, so at most
+        # capacity - 1 records can be read
+        if write_count - start >= self.capacity:
+            self.lost += write_count - start - self.capacity + 1
+            start = write_count - self.capacity + 1
+
+        first = start % self.capacity
+        last = write_count % self.capacity
+        if first < last:
+            events = self.records[first:last].copy()
+        else:
+            events = np.concatenate((self.records[first:],
+                                     self.records[:last]))
+
+        # any slot the writer reached (or was writing) while we were copying
+        # is not reliable
+        overwritten = self._writeCount() - self.capacity - start + 1
+        if overwritten > 0:
+            self.lost += overwritten
+            events = events[overwritten:]
+        self.read_count = write_count
+        return events
+
+    def skip(self):
+        """Mark every event written so far as read."""
+        self.read_count = self._writeCount()
+
+    def close(self):
+        self.records = None
+        self.header = None
+        self._header_counts = None
+        if self._mmap:
+            self._mmap.close()
+            self._mmap = None
+
+
+class EventRingWriter(object):
+    """ioHub Server side: creates one ring per event type the first time an
+    event of that type is written, and lists it in the directory file."""
+
+    def __init__(self, base_path, capacity=8192):
+        self.base_path = base_path
+        self.capacity = capacity
+        self.rings = {}
+        self._directory_path = base_path + '.dir'
+        size = DIRECTORY_HEADER_DTYPE.itemsize + \
+            MAX_RINGS * DIRECTORY_ENTRY_DTYPE.itemsize
+        self._mmap = _mapFile(self._directory_path, size)
+        self._counts = np.ndarray((2,), '<u8', self._mmap, 0)
+        self._entries = np.ndarray((MAX_RINGS,), DIRECTORY_ENTRY_DTYPE,
+                                   self._mmap,
+                                   DIRECTORY_HEADER_DTYPE.itemsize)
+
+    def _addRing(self, event_type, dtype):
+        ring_index = int(self._counts[0])
+        if ring_index >= MAX_RINGS:
+            raise RuntimeError('Too many event rings ({}).'.format(MAX_RINGS))
+        ring = EventRing(ringFileName(self.base_path, event_type), dtype,
+                         self.capacity, event_type)
+        self._entries[ring_index] = (event_type, ring.capacity,
+                                     ring.dtype.itemsize)
+        self._counts[0] = ring_index + 1
+        self.rings[event_type] = ring
+        return ring
+
+    def write(self, event_type, dtype, event):
+        ring = self.rings.get(event_type)
+        if ring is None:
+            ring = self._addRing(event_type, dtype)
+        ring.write(event)
+
+    def countBuffered(self):
+        """Note that an event went to the global event buffer instead."""
+        self._counts[1] += 1
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+            try:
+                os.remove(ring.file_path)
+            except OSError:
+                pass
+        self.rings = {}
+        if self._mmap:
+            self._entries = None
+            self._counts = None
+            self._mmap.close()
+            self._mmap = None
+            try:
+                os.remove(self._directory_path)
+            except OSError:
+                pass
+
+
+class EventRingReader(object):
+    """Experiment process side: attaches to the rings written by an
+    EventRingWriter with the same base_path.
+
+    getDtype(event_type) must return the NUMPY_DTYPE of the event class for
+    the given event type id.
+    """
+
+    def __init__(self, base_path, getDtype):
+        self.base_path = base_path
+        self.getDtype = getDtype
+        self.rings = {}
+        self._mmap = _mapFile(base_path + '.dir')
+        self._counts = np.ndarray((2,), '<u8', self._mmap, 0)
+        self._entries = np.ndarray((MAX_RINGS,), DIRECTORY_ENTRY_DTYPE,
+                                   self._mmap,
+                                   DIRECTORY_HEADER_DTYPE.itemsize)
+        self._attached = 0
+
+    def _attachNewRings(self):
+        ring_count = int(self._counts[0])
+        while self._attached < ring_count:
+            event_type = int(self._entries[self._attached]['event_type'])
+            self.rings[event_type] = EventRing(
+                ringFileName(self.base_path, event_type),
+                self.getDtype(event_type))
+            self._attached += 1
+
+    def read(self):
+        """Return {event_type: structured array} of the events written since
+        the last read(), leaving out event types with no new events."""
+        if self._attached < self._counts[0]:
+            self._attachNewRings()
+        events = {}
+        for event_type, ring in self.rings.items():
+            if ring.pending():
+                events[event_type] = ring.read()
+        return events
+
+    def skip(self):
+        """Discard every event written so far."""
+        self._attachNewRings()
+        for ring in self.rings.values():
+            ring.skip()
+
+    def buffered(self):
+        """Number of events the server kept in its global event buffer."""
+        return int(self._counts[1])
+
+    def lost(self):
+        """Number of events dropped because the reader fell behind."""
+        return sum(ring.lost for ring in self.rings.values())
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
+        if self._mmap:
+            self._entries = None
+            self._counts = None
+            self._mmap.close()
+            self._mmap = None
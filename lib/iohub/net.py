@@ -4,7 +4,10 @@
 # Distributed under the terms of the GNU General Public License (GPL).
 from __future__ import division, absolute_import
 
+import os
 import struct
+import tempfile
+from collections import OrderedDict
 from weakref import proxy
 
 from gevent import sleep, Greenlet
@@ -25,6 +28,134 @@ MAX_PACKET_SIZE = 64 * 1024
 
 defTimeout = 0.1
 
+# Replies too large for one datagram are sent as chunks. Each chunk starts
+# with CHUNK_HEADER: CHUNK_MAGIC (0xc1, a byte msgpack never uses, so chunks
+# can not be mistaken for a whole message), message id, chunk index, chunk
+# count, chunk size and total message size. The receiver puts the chunks
+# back together in index order, whatever order they arrive in, and asks for
+# the ones still missing with a ('RESEND_CHUNKS', message id, [indices])
+# request when none arrive for chunkTimeout seconds.
+CHUNK_MAGIC = 0xc1
+CHUNK_HEADER = struct.Struct('<BIIIII')
+MAX_CHUNK_SIZE = MAX_PACKET_SIZE // 2 - CHUNK_HEADER.size
+chunkTimeout = 0.05
+# RESEND_CHUNKS asks for at most this many chunks of a message at a time,
+# and the receiver gives up after MAX_CHUNK_RESENDS requests in a row that
+# bring no chunk back.
+RESEND_WINDOW = 16
+MAX_CHUNK_RESENDS = 5
+# Receive buffer asked for on client sockets, so a burst of chunks is not
+# dropped by the OS (which may grant less).
+RCV_SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+# Messages on the 'unix_stream' transport: byte count, then the message.
+FRAME_HEADER = struct.Struct('<I')
+
+TRANSPORTS = ('udp', 'unix', 'unix_stream')
+
+
+def localSocketPath(config):
+    """Socket file of the ioHub Server for the 'unix' and 'unix_stream'
+    transports: the unix_socket_path setting, or a file named after udp_port
+    in the temp folder."""
+    path = config.get('unix_socket_path')
+    if path in [None, 'None']:
+        path = os.path.join(tempfile.gettempdir(),
+                            'iohub_{}.sock'.format(config.get('udp_port', 9000)))
+    return path
+
+
+def createClientConnection(config):
+    """Create a client connection to the ioHub Server, using the transport
+    set in config. For the unix transports, raises IOError if the server's
+    socket does not exist yet."""
+    transport = config.get('transport', 'udp')
+    if transport == 'udp':
+        return UDPClientConnection(remote_port=config.get('udp_port', 9000))
+    if transport not in TRANSPORTS:
+        raise ValueError('Unknown ioHub transport: {}'.format(transport))
+    path = localSocketPath(config)
+    if not os.path.exists(path):
+        raise IOError('ioHub Server socket not found: {}'.format(path))
+    if transport == 'unix':
+        return UnixClientConnection(path)
+    return UnixStreamClientConnection(path)
+
+
+def sendChunks(sock, data, msg_id, address, indices=None,
+               chunk_size=MAX_CHUNK_SIZE):
+    """Send the chunks of data (all of them, or those in indices) to
+    address. Chunks are memoryview slices of data; where the socket has
+    sendmsg, the header and the slice are sent without joining them."""
+    view = memoryview(data)
+    total = len(data)
+    count = (total + chunk_size - 1) // chunk_size
+    sendmsg = getattr(sock, 'sendmsg', None)
+    if indices is None:
+        indices = range(count)
+    for i in indices:
+        if i >= count:
+            continue
+        header = CHUNK_HEADER.pack(CHUNK_MAGIC, msg_id, i, count, chunk_size,
+                                   total)
+        chunk = view[i * chunk_size:(i + 1) * chunk_size]
+        if sendmsg:
+            sendmsg([header, chunk], [], 0, address)
+        else:
+            sock.sendto(header + chunk.tobytes(), address)
+    return count
+
+
+class ChunkReassembler(object):
+    """Puts chunked messages back together on the receiving side."""
+    MAX_PARTIAL_MESSAGES = 4
+
+    def __init__(self):
+        self.partial = OrderedDict()  # msg_id -> [buffer, received flags, n]
+
+    @staticmethod
+    def isChunk(data):
+        return len(data) >= CHUNK_HEADER.size and \
+            bytearray(data[:1])[0] == CHUNK_MAGIC
+
+    def add(self, data, nbytes=None):
+        """Add one received chunk (data[:nbytes]). Returns the complete
+        message as a bytearray when this was its last missing chunk, else
+        None."""
+        if nbytes is None:
+            nbytes = len(data)
+        _, msg_id, index, count, chunk_size, total = \
+            CHUNK_HEADER.unpack_from(data)
+        entry = self.partial.get(msg_id)
+        if entry is None:
+            entry = [bytearray(total), bytearray(count), 0]
+            self.partial[msg_id] = entry
+            while len(self.partial) > self.MAX_PARTIAL_MESSAGES:
+                self.partial.popitem(last=False)
+        buf, received, _ = entry
+        if index >= count or received[index]:
+            return None # bad or duplicate chunk
+        start = index * chunk_size
+        payload = memoryview(data)[CHUNK_HEADER.size:nbytes]
+        buf[start:start + len(payload)] = payload
+        received[index] = 1
+        entry[2] += 1
+        if entry[2] < count:
+            return None
+        del self.partial[msg_id]
+        return buf
+
+    def missing(self):
+        """[(msg_id, [missing chunk indices]), ...] of the incomplete
+        messages."""
+        return [(msg_id, [i for i, r in enumerate(entry[1]) if not r])
+                for msg_id, entry in self.partial.items()]
+
+    def clear(self):
+        self.partial.clear()
+
+
 class SocketConnection(object): # pylint: disable=too-many-instance-attributes
     def __init__(
             self,
@@ -44,6 +175,9 @@ class SocketConnection(object): # pylint: disable=too-many-instance-attributes
         self.lastAddress = None
         self.sock = None
         self.initSocket(broadcast, blocking, timeout)
+        self._chunks = ChunkReassembler()
+        self._rcvBuffer = bytearray(rcvBufferLength)
+        self.resent_chunk_count = 0
 
         self.coder = msgpack
         self.packer = msgpack.Packer()
@@ -80,21 +214,46 @@ class SocketConnection(object): # pylint: disable=too-many-instance-attributes
 
     def receive(self):
         try:
-            data, address = self.sock.recvfrom(self._rcvBufferLength)
-            self.lastAddress = address
+            data = self._receiveMessage()
+            if data is None:
+                return None
             self.feed(data)
-            result = self.unpack()
-            if result[0] == 'IOHUB_MULTIPACKET_RESPONSE':
-                num_packets = result[1]
-                while num_packets > 0:
-                    data, address = self.sock.recvfrom(self._rcvBufferLength)
-                    self.feed(data)
-                    num_packets = num_packets - 1
-                result = self.unpack()
-            return result, address
+            return self.unpack(), self.lastAddress
         except Exception: # pylint: disable=broad-except
             pass # printExceptionDetailsToStdErr()
 
+    def _receiveMessage(self):
+        """Return the next whole message, putting chunked messages back
+        together and asking for missing chunks again when needed."""
+        rcv_buffer = self._rcvBuffer
+        resends = 0
+        timeout = self.sock.gettimeout()
+        while True:
+            if self._chunks.partial:
+                self.sock.settimeout(chunkTimeout)
+            try:
+                nbytes, address = self.sock.recvfrom_into(rcv_buffer)
+            except Exception: # pylint: disable=broad-except
+                if not self._chunks.partial or resends >= MAX_CHUNK_RESENDS:
+                    self._chunks.clear()
+                    raise
+                resends += 1
+                for msg_id, indices in self._chunks.missing():
+                    indices = indices[:RESEND_WINDOW]
+                    self.resent_chunk_count += len(indices)
+                    self.sendTo(('RESEND_CHUNKS', msg_id, indices),
+                                self.lastAddress)
+                continue
+            finally:
+                self.sock.settimeout(timeout)
+            self.lastAddress = address
+            resends = 0
+            if not ChunkReassembler.isChunk(rcv_buffer):
+                return bytes(rcv_buffer[:nbytes])
+            message = self._chunks.add(rcv_buffer, nbytes)
+            if message is not None:
+                return message
+
     def close(self):
         self.sock.close()
 
@@ -118,10 +277,103 @@ class UDPClientConnection(SocketConnection):
             import socket
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
-                             MAX_PACKET_SIZE)
+                             RCV_SOCKET_BUFFER_SIZE)
         self.sock.settimeout(timeout)
         self.sock.setblocking(blocking)
 
+class UnixClientConnection(SocketConnection):
+    """Datagram connection to an ioHub Server using the 'unix' transport.
+    The client socket is bound to a file next to the server's, so the
+    server can reply to it; the file is removed by close()."""
+    _connection_count = 0
+
+    def __init__(self, remote_path, rcvBufferLength=MAX_PACKET_SIZE,
+                 timeout=defTimeout):
+        UnixClientConnection._connection_count += 1
+        self._local_path = '{}.{}_{}'.format(
+            remote_path, os.getpid(), UnixClientConnection._connection_count)
+        SocketConnection.__init__(self, remote_host=remote_path,
+                                  rcvBufferLength=rcvBufferLength,
+                                  blocking=1, timeout=timeout)
+
+    def initSocket(self, broadcast=False, blocking=1, timeout=defTimeout):
+        if Computer.is_iohub_process is True:
+            from gevent import socket
+        else:
+            import socket
+        if os.path.exists(self._local_path):
+            os.remove(self._local_path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                             RCV_SOCKET_BUFFER_SIZE)
+        self.sock.bind(self._local_path)
+        self.sock.settimeout(timeout)
+
+    def sendTo(self, data, address=None):
+        if address is None:
+            address = self._remote_host
+        return SocketConnection.sendTo(self, data, address)
+
+    def close(self):
+        self.sock.close()
+        try:
+            os.remove(self._local_path)
+        except OSError:
+            pass
+
+
+class UnixStreamClientConnection(SocketConnection):
+    """Stream connection to an ioHub Server using the 'unix_stream'
+    transport. Messages are framed with FRAME_HEADER, so there is no size
+    limit and no chunking; a receive() that times out part way through a
+    message keeps what it got for the next call."""
+    def __init__(self, remote_path, rcvBufferLength=MAX_PACKET_SIZE,
+                 timeout=defTimeout):
+        self._pending = bytearray()
+        SocketConnection.__init__(self, remote_host=remote_path,
+                                  rcvBufferLength=rcvBufferLength,
+                                  blocking=1, timeout=timeout)
+
+    def initSocket(self, broadcast=False, blocking=1, timeout=defTimeout):
+        if Computer.is_iohub_process is True:
+            from gevent import socket
+        else:
+            import socket
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self._remote_host)
+        self.sock.settimeout(timeout)
+
+    def sendTo(self, data, address=None):
+        packed_data = self.pack(data)
+        self.sock.sendall(FRAME_HEADER.pack(len(packed_data)))
+        self.sock.sendall(packed_data)
+        return len(packed_data)
+
+    def _nextMessage(self):
+        pending = self._pending
+        if len(pending) < FRAME_HEADER.size:
+            return None
+        end = FRAME_HEADER.size + FRAME_HEADER.unpack_from(pending)[0]
+        if len(pending) < end:
+            return None
+        message = bytes(pending[FRAME_HEADER.size:end])
+        del pending[:end]
+        return message
+
+    def receive(self):
+        try:
+            message = self._nextMessage()
+            while message is None:
+                data = self.sock.recv(self._rcvBufferLength)
+                if not data:
+                    return None # connection closed
+                self._pending.extend(data)
+                message = self._nextMessage()
+            self.feed(message)
+            return self.unpack(), self._remote_host
+        except Exception: # pylint: disable=broad-except
+            pass # printExceptionDetailsToStdErr()
+
 ##### TIME SYNC CLASS ######
 
 
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+# Part of the psychopy.iohub library.
+# Copyright (C) 2012-2016 iSolver Software Solutions
+# Distributed under the terms of the GNU General Public License (GPL).
+"""Benchmarks of the ioHub client <-> server transport, run without starting
+an ioHub Server.
+
+transportBench() runs the ioHub request server for one transport ('udp',
+'unix' or 'unix_stream') in a separate process, with a stand-in for the
+ioServer that has one device and a fixed set of buffered events, and times
+PING, GET_EVENTS and DEV_RPC round trips from a client connection.
+
+chunkStress() sends one GET_EVENTS_RESULT reply holding sample_count
+binocular eye samples through the chunked reply path (net.sendChunks on the
+sending side, net.UDPClientConnection.receive on the receiving side). The
+first send of each reply can drop and reorder chunks, so the time includes
+asking for the missing chunks again. Every reply is checked against the
+samples that were sent.
+
+Usage::
+
+    python -m psychopy.iohub.netbench transports --requests 2000
+    python -m psychopy.iohub.netbench chunks --samples 20000 --drop 0.02
+"""
+from __future__ import division, absolute_import, print_function
+
+import multiprocessing
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from collections import deque
+
+import msgpack
+import numpy as np
+
+from .net import UDPClientConnection, sendChunks, MAX_CHUNK_SIZE
+from .net import TRANSPORTS, createClientConnection
+
+
+def eyeSamples(sample_count):
+    """sample_count BinocularEyeSampleEvent value lists, as the ioHub Server
+    puts in a GET_EVENTS_RESULT reply."""
+    from .devices import DeviceEvent
+    from .devices.eyetracker.eye_events import BinocularEyeSampleEvent
+    from .constants import EventConstants
+    template = np.zeros(1, BinocularEyeSampleEvent.NUMPY_DTYPE)[0].tolist()
+    samples = []
+    for i in range(sample_count):
+        sample = list(template)
+        sample[DeviceEvent.EVENT_ID_INDEX] = i
+        sample[DeviceEvent.EVENT_TYPE_ID_INDEX] = \
+            EventConstants.BINOCULAR_EYE_SAMPLE
+        sample[DeviceEvent.EVENT_HUB_TIME_INDEX] = i * 0.001
+        samples.append([v.decode('utf-8') if isinstance(v, bytes) else v
+                        for v in sample])
+    return samples
+
+
+class _LossySocket(object):
+    """Socket wrapper that drops a fraction of the datagrams sent through it
+    and sends the rest in shuffled order when flush() is called."""
+    def __init__(self, sock, drop_rate):
+        self.sock = sock
+        self.drop_rate = drop_rate
+        self.held = []
+        self.dropped = 0
+        if hasattr(sock, 'sendmsg'):
+            self.sendmsg = self._sendmsg
+
+    def _sendmsg(self, buffers, ancdata, flags, address):
+        self.sendto(b''.join(bytes(b) for b in buffers), address)
+
+    def sendto(self, data, address):
+        if random.random() < self.drop_rate:
+            self.dropped += 1
+        else:
+            self.held.append((bytes(data), address))
+
+    def flush(self):
+        random.shuffle(self.held)
+        for data, address in self.held:
+            self.sock.sendto(data, address)
+        self.held = []
+
+
+class _ReplyServer(threading.Thread):
+    """Answers GET_EVENTS with the same chunked reply each time, and
+    RESEND_CHUNKS requests like udpServer does."""
+    def __init__(self, events, drop_rate=0.0):
+        threading.Thread.__init__(self, name='netbench server')
+        self.daemon = True
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(0.2)
+        self.port = self.sock.getsockname()[1]
+        self.reply = msgpack.Packer().pack(('GET_EVENTS_RESULT', events))
+        self.drop_rate = drop_rate
+        self.msg_id = 0
+        self.dropped = 0
+        self.running = True
+
+    def run(self):
+        unpacker = msgpack.Unpacker(use_list=True, raw=False)
+        while self.running:
+            try:
+                data, address = self.sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+            unpacker.feed(data)
+            request = unpacker.unpack()
+            if request[0] == 'GET_EVENTS':
+                self.msg_id += 1
+                lossy = _LossySocket(self.sock, self.drop_rate)
+                sendChunks(lossy, self.reply, self.msg_id, address)
+                lossy.flush()
+                self.dropped += lossy.dropped
+            elif request[0] == 'RESEND_CHUNKS':
+                sendChunks(self.sock, self.reply, request[1], address,
+                           request[2])
+
+    def stop(self):
+        self.running = False
+        self.join()
+        self.sock.close()
+
+
+def chunkStress(sample_count=10000, repeats=10, drop_rate=0.0):
+    """Time receiving sample_count eye samples in one reply, repeats times.
+
+    Returns a dict with the reply size, chunk count, receive times (sec.msec)
+    and the number of chunks dropped and asked for again.
+    """
+    events = eyeSamples(sample_count)
+    server = _ReplyServer(events, drop_rate)
+    server.start()
+    client = UDPClientConnection(remote_port=server.port, timeout=1.0)
+    client.unpacker = msgpack.Unpacker(use_list=True, raw=False)
+    client.feed = client.unpacker.feed
+    client.unpack = client.unpacker.unpack
+    times = []
+    try:
+        for _ in range(repeats):
+            stime = time.time()
+            client.sendTo(('GET_EVENTS',))
+            result = client.receive()
+            times.append(time.time() - stime)
+            if result is None or result[0][1] != events:
+                raise RuntimeError('Reply {} was not received whole.'.format(
+                    len(times)))
+    finally:
+        client.close()
+        server.stop()
+    reply_size = len(server.reply)
+    return dict(samples=sample_count, reply_bytes=reply_size,
+                chunks=(reply_size + MAX_CHUNK_SIZE - 1) // MAX_CHUNK_SIZE,
+                times=times, dropped=server.dropped,
+                resent=client.resent_chunk_count)
+
+
+class _BenchDevice(object):
+    """The device DEV_RPC requests are sent to."""
+    def getPosition(self):
+        return [0.0, 0.0]
+
+
+class _BenchHub(object):
+    """The parts of ioServer the request server uses. Each GET_EVENTS
+    request gets the same event_count eye samples."""
+    def __init__(self, event_count):
+        self.events = eyeSamples(event_count)
+        self.eventBuffer = deque()
+        self.udpService = None
+
+    def log(self, text, level=None):
+        pass
+
+    def processDeviceEvents(self):
+        self.eventBuffer.extend(self.events)
+
+    @staticmethod
+    def getStatus():
+        return 'RUNNING'
+
+    def unsubscribe(self, address):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+def _runBenchServer(config, event_count, ready):
+    from .devices import Computer
+    Computer.is_iohub_process = True
+    from .server import ioServer, createRequestServer
+    ioServer.deviceDict['BenchDevice'] = _BenchDevice()
+    hub = _BenchHub(event_count)
+    hub.udpService = createRequestServer(hub, config)
+    hub.udpService.start()
+    ready.set()
+    hub.udpService.serve_forever()
+
+
+def _timeRequests(client, request, count):
+    times = np.zeros(count)
+    for i in range(count):
+        stime = time.time()
+        client.sendTo(request)
+        if client.receive() is None:
+            raise RuntimeError('No reply to {}.'.format(request[0]))
+        times[i] = time.time() - stime
+    return times
+
+
+def transportBench(transport, request_count=1000, event_count=100,
+                   udp_port=9134):
+    """Time request_count PING, GET_EVENTS (returning event_count eye
+    samples) and DEV_RPC round trips over transport.
+
+    Returns {request type: array of round trip times (sec.msec)} and the
+    packed size of the GET_EVENTS reply.
+    """
+    config = dict(transport=transport, udp_port=udp_port,
+                  unix_socket_path=os.path.join(
+                      tempfile.gettempdir(),
+                      'iohub_bench_{}.sock'.format(os.getpid())))
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=_runBenchServer,
+                                     args=(config, event_count, ready))
+    server.daemon = True
+    server.start()
+    if not ready.wait(30.0):
+        server.terminate()
+        raise RuntimeError('The {} bench server did not start.'.format(
+            transport))
+    client = createClientConnection(config)
+    requests = [('PING', ('PING', time.time(), 1, 'x' * 32)),
+                ('GET_EVENTS', ('GET_EVENTS',)),
+                ('DEV_RPC', ('EXP_DEVICE', 'DEV_RPC', 'BenchDevice',
+                             'getPosition', [], {}))]
+    results = {}
+    try:
+        for name, request in requests:
+            _timeRequests(client, request, 10) # warm up
+            results[name] = _timeRequests(client, request, request_count)
+    finally:
+        client.close()
+        server.terminate()
+        server.join()
+        if os.path.exists(config['unix_socket_path']):
+            os.remove(config['unix_socket_path'])
+    reply_bytes = len(msgpack.Packer().pack(('GET_EVENTS_RESULT',
+                                             eyeSamples(event_count))))
+    return results, reply_bytes
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='ioHub transport benchmarks.')
+    parser.add_argument('benchmark', choices=['transports', 'chunks'])
+    parser.add_argument('--transports', default=','.join(TRANSPORTS))
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--events', type=int, default=100,
+                        help='eye samples returned by each GET_EVENTS')
+    parser.add_argument('--samples', type=int, default=10000)
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--drop', type=float, default=0.0,
+                        help='fraction of chunks dropped on the first send')
+    args = parser.parse_args()
+
+    if args.benchmark == 'transports':
+        print('transport    request     mean ms  median ms  p99 ms  '
+              'requests/s    MB/s')
+        for transport in args.transports.split(','):
+            results, reply_bytes = transportBench(transport, args.requests,
+                                                  args.events)
+            for name, times in sorted(results.items()):
+                times_ms = times * 1000.0
+                rate = len(times) / times.sum()
+                mbps = rate * reply_bytes / 1e6 if name == 'GET_EVENTS' else 0
+                print('{:12} {:10} {:8.3f} {:10.3f} {:7.3f} {:11.0f} '
+                      '{:7.1f}'.format(transport, name, times_ms.mean(),
+                                       np.median(times_ms),
+                                       np.percentile(times_ms, 99), rate,
+                                       mbps))
+        raise SystemExit(0)
+
+    r = chunkStress(args.samples, args.repeats, args.drop)
+    times = np.array(r['times']) * 1000.0
+    print('{} eye samples: {:.2f} MB in {} chunks'.format(
+        r['samples'], r['reply_bytes'] / 1e6, r['chunks']))
+    print('receive time: mean {:.2f} ms, min {:.2f} ms, max {:.2f} ms'.format(
+        times.mean(), times.min(), times.max()))
+    print('chunks dropped: {}, asked for again: {}'.format(r['dropped'],
+                                                          r['resent']))
@@ -11,7 +11,7 @@ from collections import deque, OrderedDict
 
 import msgpack
 import gevent
-from gevent.server import DatagramServer
+from gevent.server import DatagramServer, StreamServer
 from gevent import Greenlet
 
 try:
@@ -24,7 +24,8 @@ from past.builtins import basestring, unicode
 from . import _pkgroot
 from . import IOHUB_DIRECTORY, EXP_SCRIPT_DIRECTORY, _DATA_STORE_AVAILABLE
 from .errors import print2err, printExceptionDetailsToStdErr, ioHubError
-from .net import MAX_PACKET_SIZE
+from .net import MAX_PACKET_SIZE, MAX_CHUNK_SIZE, sendChunks
+from .net import FRAME_HEADER, localSocketPath
 from .util import convertCamelToSnake, win32MessagePump
 from .util import yload, yLoader
 from .constants import DeviceConstants, EventConstants
@@ -34,13 +35,18 @@ from .devices.deviceConfigValidation import validateDeviceConfiguration
 getTime = Computer.getTime
 
 MAX_PACKET_SIZE = 64 * 1024
+# number of chunked replies kept for RESEND_CHUNKS requests
+MAX_SENT_MESSAGES = 8
 
 # pylint: disable=protected-access
 # pylint: disable=broad-except
 
-class udpServer(DatagramServer):
+class ioHubRequestHandler(object):
+    """Handles the requests sent by ioHub clients. The server classes below
+    add a transport: they receive requests, pass them to handleRequest() and
+    implement sendData() to send the replies."""
     client_proc_init_req = None
-    def __init__(self, ioHubServer, address):
+    def __init__(self, ioHubServer):
         self.iohub = ioHubServer
         self.feed = None
         self._running = True
@@ -51,14 +57,10 @@ class udpServer(DatagramServer):
         self.unpacker = msgpack.Unpacker(use_list=True)
         self.unpack = self.unpacker.unpack
         self.feed = self.unpacker.feed
-        DatagramServer.__init__(self, address)
+        # replies collected while a BATCH request is being handled
+        self._batch_replies = None
 
-    def handle(self, request, replyTo):
-        if self._running is False:
-            return False
-        self.feed(request)
-        request = self.unpack()
-        # print2err(">> Rx Packet: {}, {}".format(request, replyTo))
+    def handleRequest(self, request, replyTo):
         request_type = unicode(request.pop(0), 'utf-8') # convert bytes to string for compatibility
         if request_type == 'SYNC_REQ':
             self.sendResponse(['SYNC_REPLY', getTime()], replyTo)
@@ -68,11 +70,16 @@ class udpServer(DatagramServer):
             msg_id = request.pop(0)
             payload = request.pop(0)
             ctime = getTime()
+            address = replyTo
+            if not isinstance(address, (tuple, basestring)):
+                address = None # a stream connection, not an address
             self.sendResponse(['PING_BACK', ctime, msg_id,
-                               payload, replyTo], replyTo)
+                               payload, address], replyTo)
             return True
         elif request_type == 'GET_EVENTS':
             return self.handleGetEvents(replyTo)
+        elif request_type == 'RESEND_CHUNKS':
+            return self.resendChunks(request.pop(0), request.pop(0), replyTo)
         elif request_type == 'EXP_DEVICE':
             return self.handleExperimentDeviceRequest(request, replyTo)
         elif request_type == 'CUSTOM_TASK':
@@ -119,6 +126,10 @@ class udpServer(DatagramServer):
                 printExceptionDetailsToStdErr()
                 self.sendResponse('RPC_NOT_CALLABLE_ERROR', replyTo)
                 return False
+        elif request_type == 'BATCH':
+            return self.handleBatchRequest(request, replyTo)
+        elif request_type == 'SUBSCRIPTION':
+            return self.handleSubscriptionRequest(request, replyTo)
         elif request_type == 'GET_IOHUB_STATUS':
             self.sendResponse((request_type, self.iohub.getStatus()), replyTo)
             return True
@@ -173,6 +184,56 @@ class udpServer(DatagramServer):
         edata = ('CUSTOM_TASK_REPLY', request)
         self.sendResponse(edata, replyTo)
 
+    def handleBatchRequest(self, request, replyTo):
+        """Handle each request in a BATCH request in order, replying once
+        with ('BATCH_RESULT', [reply of each request])."""
+        if self._batch_replies is not None:
+            print2err('BATCH_NESTED_ERROR')
+            self._batch_replies.append('BATCH_NESTED_ERROR')
+            return False
+        requests = request.pop(0)
+        self._batch_replies = []
+        all_ok = True
+        try:
+            for sub_request in requests:
+                reply_count = len(self._batch_replies)
+                ok = self.handleRequest(sub_request, replyTo)
+                all_ok = all_ok and ok is not False
+                if len(self._batch_replies) == reply_count:
+                    self._batch_replies.append(None)
+        except Exception:
+            print2err('BATCH_RUNTIME_ERROR')
+            printExceptionDetailsToStdErr()
+            all_ok = False
+        finally:
+            replies = self._batch_replies
+            self._batch_replies = None
+        while len(replies) < len(requests):
+            replies.append('BATCH_RUNTIME_ERROR')
+        self.sendResponse(('BATCH_RESULT', replies), replyTo)
+        return all_ok
+
+    def handleSubscriptionRequest(self, request, replyTo):
+        subtype = unicode(request.pop(0), 'utf-8')
+        if subtype == 'ADD':
+            device_names = request.pop(0)
+            if device_names is not None:
+                device_names = [n if isinstance(n, unicode) else
+                                unicode(n, 'utf-8') for n in device_names]
+            event_types = request.pop(0)
+            etypes = self.iohub.subscribe(replyTo, device_names, event_types)
+            self.sendResponse(('SUBSCRIPTION_RESULT', etypes), replyTo)
+            return True
+        elif subtype == 'REMOVE':
+            self.iohub.unsubscribe(replyTo)
+            self.sendResponse(('SUBSCRIPTION_RESULT', None), replyTo)
+            return True
+        elif subtype == 'RESEND':
+            return self.iohub.resendPushedEvents(replyTo, request.pop(0))
+        print2err('SUBSCRIPTION_TYPE_NOT_SUPPORTED_ERROR: ', subtype)
+        self.sendResponse('SUBSCRIPTION_TYPE_NOT_SUPPORTED_ERROR', replyTo)
+        return False
+
     def handleGetEvents(self, replyTo):
         try:
             self.iohub.processDeviceEvents()
@@ -314,35 +375,19 @@ class udpServer(DatagramServer):
             return False
 
     def sendResponse(self, data, address):
-        reply_data_sz = -1
-        max_pkt_sz = int(MAX_PACKET_SIZE / 2 - 20)
-        pkt_cnt = -1
-        p = si = -1
-        try:
-            reply_data = self.pack(data)
-            reply_data_sz = len(reply_data)
-            if reply_data_sz >= max_pkt_sz:
-                pkt_cnt = int(reply_data_sz // max_pkt_sz) + 1
-                mpr_payload = ('IOHUB_MULTIPACKET_RESPONSE', pkt_cnt)
-                self.sendResponse(mpr_payload, address)
-                for p in xrange(pkt_cnt - 1):
-                    si = p*max_pkt_sz
-                    self.socket.sendto(reply_data[si:si+max_pkt_sz], address)
-                si = (p+1)*max_pkt_sz
-                self.socket.sendto(reply_data[si:reply_data_sz], address)
-            else:
-                self.socket.sendto(reply_data, address)
-        except Exception:
-            print2err('=============================')
-            print2err('Error trying to send data to experiment process:')
-            print2err('max_pkt_sz: ', max_pkt_sz)
-            print2err('reply_data_sz: ', reply_data_sz)
-            print2err('pkt_cnt: ', pkt_cnt)
-            print2err('packet index, byte index: ', p, si)
-            printExceptionDetailsToStdErr()
-            print2err('=============================')
-            pktdata = self.pack('IOHUB_SERVER_RESPONSE_ERROR')
-            self.socket.sendto(pktdata, address)
+        if self._batch_replies is not None:
+            self._batch_replies.append(data)
+            return
+        self.sendData(data, address)
+
+    def sendData(self, data, address):
+        """Send data to address now, even while a batch is being handled
+        (used for events pushed to subscribers). Each transport's server
+        class provides this."""
+
+    def resendChunks(self, msg_id, indices, address):
+        # only datagram transports split replies into chunks
+        return False
 
     def setExperimentInfo(self, exp_info_list):
         self.iohub.experimentInfoList = exp_info_list
@@ -466,6 +511,139 @@ class udpServer(DatagramServer):
             sys.exit(1)
 
 
+class udpServer(ioHubRequestHandler, DatagramServer):
+    """Receives requests as datagrams, over UDP or, with the 'unix'
+    transport, a Unix domain datagram socket (address is then that socket,
+    bound to socket_path when the server starts). Replies too large for one
+    datagram are sent in chunks."""
+    def __init__(self, ioHubServer, address, socket_path=None):
+        ioHubRequestHandler.__init__(self, ioHubServer)
+        # chunked replies, by message id, for RESEND_CHUNKS requests
+        self._msg_id = 0
+        self._sent_messages = OrderedDict()
+        self.socket_path = socket_path
+        DatagramServer.__init__(self, address)
+
+    def init_socket(self):
+        # requests sent before start() would queue in a socket bound
+        # earlier, and their replies would reach the client out of step
+        if self.socket_path is not None:
+            self.socket.bind(self.socket_path)
+        DatagramServer.init_socket(self)
+
+    def handle(self, request, replyTo):
+        if self._running is False:
+            return False
+        self.feed(request)
+        request = self.unpack()
+        # print2err(">> Rx Packet: {}, {}".format(request, replyTo))
+        return self.handleRequest(request, replyTo)
+
+    def sendData(self, data, address):
+        reply_data_sz = -1
+        pkt_cnt = -1
+        try:
+            reply_data = self.pack(data)
+            reply_data_sz = len(reply_data)
+            if reply_data_sz > MAX_CHUNK_SIZE:
+                # keep the packed reply so lost chunks can be sent again
+                self._msg_id = (self._msg_id + 1) & 0xffffffff
+                self._sent_messages[self._msg_id] = reply_data
+                while len(self._sent_messages) > MAX_SENT_MESSAGES:
+                    self._sent_messages.popitem(last=False)
+                pkt_cnt = sendChunks(self.socket, reply_data, self._msg_id,
+                                     address)
+            else:
+                self.socket.sendto(reply_data, address)
+        except Exception:
+            print2err('=============================')
+            print2err('Error trying to send data to experiment process:')
+            print2err('reply_data_sz: ', reply_data_sz)
+            print2err('pkt_cnt: ', pkt_cnt)
+            printExceptionDetailsToStdErr()
+            print2err('=============================')
+            pktdata = self.pack('IOHUB_SERVER_RESPONSE_ERROR')
+            self.socket.sendto(pktdata, address)
+
+    def resendChunks(self, msg_id, indices, address):
+        reply_data = self._sent_messages.get(msg_id)
+        if reply_data is None:
+            print2err('RESEND_CHUNKS_ERROR: message no longer kept: ', msg_id)
+            return False
+        sendChunks(self.socket, reply_data, msg_id, address, indices)
+        return True
+
+
+class unixStreamServer(ioHubRequestHandler, StreamServer):
+    """Receives requests over Unix domain stream connections (the
+    'unix_stream' transport). Each message is sent as a FRAME_HEADER byte
+    count followed by the packed message, so replies of any size go out in
+    one piece. Replies are sent on the connection the request came from.
+    The listener is bound to socket_path when the server starts."""
+    def __init__(self, ioHubServer, listener, socket_path):
+        ioHubRequestHandler.__init__(self, ioHubServer)
+        self.socket_path = socket_path
+        StreamServer.__init__(self, listener)
+
+    def init_socket(self):
+        self.socket.bind(self.socket_path)
+        self.socket.listen(8)
+        StreamServer.init_socket(self)
+
+    def handle(self, sock, address):
+        pending = bytearray()
+        try:
+            while self._running:
+                data = sock.recv(MAX_PACKET_SIZE)
+                if not data:
+                    break
+                pending.extend(data)
+                while len(pending) >= FRAME_HEADER.size:
+                    end = FRAME_HEADER.size + \
+                        FRAME_HEADER.unpack_from(pending)[0]
+                    if len(pending) < end:
+                        break
+                    self.feed(bytes(pending[FRAME_HEADER.size:end]))
+                    del pending[:end]
+                    self.handleRequest(self.unpack(), sock)
+        except Exception:
+            print2err('Error on ioHub client connection:')
+            printExceptionDetailsToStdErr()
+        finally:
+            self.iohub.unsubscribe(sock)
+            sock.close()
+
+    def sendData(self, data, address):
+        try:
+            reply_data = self.pack(data)
+            address.sendall(FRAME_HEADER.pack(len(reply_data)))
+            address.sendall(reply_data)
+        except Exception:
+            print2err('Error trying to send data to experiment process:')
+            printExceptionDetailsToStdErr()
+
+
+def createRequestServer(ioHubServer, config):
+    """Create the request server for the transport set in config. For the
+    unix transports the socket file is only created by the server's start(),
+    so clients can't send requests before it handles them."""
+    transport = config.get('transport', 'udp')
+    if transport == 'udp':
+        return udpServer(ioHubServer, ':%d' % config.get('udp_port', 9000))
+
+    from gevent import socket
+    path = localSocketPath(config)
+    if os.path.exists(path):
+        os.remove(path) # left by an ioHub Server that did not exit cleanly
+    if transport == 'unix':
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        return udpServer(ioHubServer, sock, path)
+    elif transport == 'unix_stream':
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        return unixStreamServer(ioHubServer, sock, path)
+    raise ioHubError('Unknown ioHub transport: {}'.format(transport))
+
+
 class DeviceMonitor(Greenlet):
     def __init__(self, device, sleep_interval):
         Greenlet.__init__(self)
@@ -479,6 +657,11 @@ class DeviceMonitor(Greenlet):
         while self.running is True:
             stime = ctime()
             self.device._poll()
+            iohub = self.device._iohub_server
+            if iohub is not None and iohub.eventRings is not None:
+                # so getEvents() sees the polled events in the event rings
+                # without waiting for processEventsTasklet
+                iohub.processDeviceEvents([self.device])
             i = self.sleep_interval - (ctime() - stime)
             if i > 0.0:
                 gevent.sleep(i)
@@ -489,6 +672,30 @@ class DeviceMonitor(Greenlet):
         self.device = None
 
 
+class EventSubscription(object):
+    """Events of the subscribed types, pushed to one client address as they
+    are processed. Each push message gets the next sequence number, and the
+    last history_length messages are kept so a client that notices a gap can
+    ask for them again."""
+    def __init__(self, address, event_types, history_length=128):
+        self.address = address
+        self.event_types = set(event_types)
+        self.seq = 0
+        self.pending = []
+        self.history = deque(maxlen=history_length)
+
+    def takePushMessage(self):
+        """Return the next ('PUSH_EVENTS', seq, events) message, or None if
+        no events are pending."""
+        if not self.pending:
+            return None
+        self.seq += 1
+        message = ('PUSH_EVENTS', self.seq, self.pending)
+        self.pending = []
+        self.history.append(message)
+        return message
+
+
 class ioServer(object):
     eventBuffer = None
     deviceDict = {}
@@ -517,10 +724,22 @@ class ioServer(object):
         self._all_dev_conf_errors = []
         ebuf_sz = config.get('global_event_buffer', 2048)
         ioServer.eventBuffer = deque(maxlen=ebuf_sz)
+        self.subscriptions = OrderedDict()
+        self.eventRings = None
+        if config.get('shared_memory_events', False):
+            from .eventrings import EventRingWriter, sessionRingPath
+            psychopy_pid = 0
+            if Computer.psychopy_process:
+                psychopy_pid = Computer.psychopy_process.pid
+            ring_path = sessionRingPath(psychopy_pid,
+                                        config.get('udp_port', 9000))
+            self.eventRings = EventRingWriter(
+                ring_path, config.get('event_ring_size', 8192))
+            self.log('Shared memory event rings: {}'.format(ring_path))
 
         self._running = True
-        # start UDP service
-        self.udpService = udpServer(self, ':%d' % config.get('udp_port', 9000))
+        # start the request server (UDP or a Unix domain socket)
+        self.udpService = createRequestServer(self, config)
         self._initDataStore(config, rootScriptPathDir)
 
         self._addDevices(config)
@@ -615,6 +834,11 @@ class ioServer(object):
             stime = Computer.getTime()
             try:
                 win32MessagePump()
+                # events added by the keyboard and mouse hooks (through the
+                # message pump on Windows, a hook thread elsewhere) go to the
+                # event rings every sleep_interval, not every 10 msec
+                if self.eventRings is not None:
+                    self.processDeviceEvents()
             except KeyboardInterrupt:
                 self._running = False
                 break
@@ -862,8 +1086,10 @@ class ioServer(object):
             dur = sleep_interval - (Computer.getTime() - stime)
             gevent.sleep(max(0.0, dur))
 
-    def processDeviceEvents(self):
-        for device in self.devices:
+    def processDeviceEvents(self, devices=None):
+        """Turn the native events of devices (default: every device) into
+        ioHub events and hand them to their listeners."""
+        for device in self.devices if devices is None else devices:
             evt = []
             try:
                 events = device._getNativeEventBuffer()
@@ -892,7 +1118,72 @@ class ioServer(object):
                 printExceptionDetailsToStdErr()
                 print2err('--------------------------------------')
 
+        if self.subscriptions:
+            self.pushSubscribedEvents()
+
+    def subscribe(self, address, device_names=None, event_types=None):
+        """Push the events of the given devices and event types to address
+        from now on, instead of adding them to the global event buffer.
+        With neither given, every event that would go to the global event
+        buffer is pushed. Returns the subscribed event type ids."""
+        etypes = set(event_types or [])
+        if device_names is not None or not event_types:
+            for device in self.devices:
+                if device_names is None or device.name in device_names:
+                    for etype, listeners in device._event_listeners.items():
+                        if self in listeners:
+                            etypes.add(etype)
+        self.subscriptions[address] = EventSubscription(address, etypes)
+        self.log('Event subscription for {}: {}'.format(address,
+                                                        sorted(etypes)))
+        return sorted(etypes)
+
+    def unsubscribe(self, address):
+        self.subscriptions.pop(address, None)
+
+    def pushSubscribedEvents(self):
+        # sendData can yield to other greenlets (sendall on a stream socket),
+        # and a client that disconnects meanwhile is unsubscribed
+        for address, subscription in list(self.subscriptions.items()):
+            message = subscription.takePushMessage()
+            if message:
+                self.udpService.sendData(message, address)
+
+    def resendPushedEvents(self, address, first_seq):
+        """Send the push messages from first_seq on again. Messages that are
+        no longer in the history are sent without their events, so the
+        client knows they are lost."""
+        subscription = self.subscriptions.get(address)
+        if subscription is None:
+            return False
+        kept = dict((m[1], m) for m in subscription.history)
+        for seq in range(first_seq, subscription.seq + 1):
+            message = kept.get(seq, ('PUSH_EVENTS', seq, None))
+            self.udpService.sendData(message, address)
+        return True
+
     def _handleEvent(self, event):
+        if self.subscriptions:
+            etype = event[DeviceEvent.EVENT_TYPE_ID_INDEX]
+            pushed = False
+            for subscription in self.subscriptions.values():
+                if etype in subscription.event_types:
+                    subscription.pending.append(event)
+                    pushed = True
+            if pushed:
+                return
+        if self.eventRings is not None:
+            etype = event[DeviceEvent.EVENT_TYPE_ID_INDEX]
+            try:
+                eclass = EventConstants.getClass(etype)
+                self.eventRings.write(etype, eclass.NUMPY_DTYPE, event)
+                return
+            except Exception:
+                # keep the event for the next GET_EVENTS request instead
+                print2err('Error writing event to shared memory ring: ',
+                          EventConstants.getName(etype))
+                printExceptionDetailsToStdErr()
+                self.eventRings.countBuffered()
         self.eventBuffer.append(event)
 
     def clearEventBuffer(self, call_proc_events=True):
@@ -943,6 +1234,14 @@ class ioServer(object):
 
             self.closeDataStoreFile()
 
+            if self.eventRings:
+                self.eventRings.close()
+                self.eventRings = None
+
+            socket_path = getattr(self.udpService, 'socket_path', None)
+            if socket_path and os.path.exists(socket_path):
+                os.remove(socket_path)
+
             while self.devices:
                 self.devices.pop(0)._close()
         except Exception:
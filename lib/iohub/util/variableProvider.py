@@ -3,12 +3,15 @@ __author__ = 'Sol'
 import numpy as np
 import sys
 import json
+from collections import OrderedDict
 from psychopy.core import getTime
-from . import OrderedDict,  printExceptionDetailsToStdErr, print2err
+from ..errors import printExceptionDetailsToStdErr, print2err
 #### Experiment Variable (IV and DV) Condition Management
 #
 class ConditionSetProvider(object):
-    def __init__(self, conditionSetArray, randomize=False):        
+    # randomState: numpy RandomState to shuffle with, so the order can be reproduced from a seed
+    # (default: the global numpy generator)
+    def __init__(self, conditionSetArray, randomize=False, randomState=None):
         non_empty_count=0
         empty_sets=[]
         for i,c in enumerate(conditionSetArray):
@@ -26,10 +29,14 @@ class ConditionSetProvider(object):
         self.currentConditionSetIndex=-1
         self.currentConditionSetIteration=0
         self.randomize=randomize
+        self.randomState=randomState
 
-        self._provideInOrder=range(self.conditionSetCount)
+        self._provideInOrder=list(range(self.conditionSetCount))
         if self.randomize is True:
-            np.random.shuffle(self._provideInOrder)
+            if self.randomState is None:
+                np.random.shuffle(self._provideInOrder)
+            else:
+                self.randomState.shuffle(self._provideInOrder)
 
     def getNextConditionSet(self):
         for i in self._provideInOrder:
@@ -61,12 +68,12 @@ class ConditionSetProvider(object):
         return self._provideInOrder
 
 class BlockSetProvider(ConditionSetProvider):
-    def __init__(self, blockSetArray, randomize):
-        ConditionSetProvider.__init__(self, blockSetArray, randomize)
+    def __init__(self, blockSetArray, randomize, randomState=None):
+        ConditionSetProvider.__init__(self, blockSetArray, randomize, randomState)
 
 class TrialSetProvider(ConditionSetProvider):
-    def __init__(self, trialSetArray, randomize):
-        ConditionSetProvider.__init__(self, trialSetArray, randomize)
+    def __init__(self, trialSetArray, randomize, randomState=None):
+        ConditionSetProvider.__init__(self, trialSetArray, randomize, randomState)
 
 class ExperimentVariableProvider(object):
     _randomGeneratorSeed=None